@@ -1,10 +1,28 @@
 """
 API module for Azure Service Tags Tracker
 Handles subscription management and email notifications.
+
+Each Vercel function imports only what it uses. db_config is cheap (pymongo is
+imported with the first client); the managers and the email service (sendgrid)
+are loaded on first attribute access.
 """
 
+import importlib
+
 from .db_config import db_config, DatabaseConfig
-from .subscription_manager import SubscriptionManager
-from .email_service import EmailService
+
+_LAZY_ATTRIBUTES = {
+    'SubscriptionManager': '.subscription_manager',
+    'EmailService': '.email_service',
+}
 
 __all__ = ['db_config', 'DatabaseConfig', 'SubscriptionManager', 'EmailService']
+
+
+def __getattr__(name):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
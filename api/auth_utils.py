@@ -2,10 +2,11 @@
 Authentication utilities for serverless APIs.
 - Password hashing via bcrypt
 - JWT creation/verification for sessions
+
+bcrypt and jwt are imported on first use: most requests hash nothing, and
+an anonymous request never decodes a token.
 """
 import os
-import bcrypt
-import jwt
 import datetime
 from typing import Optional, Dict
 
@@ -23,6 +24,7 @@ def _require_secret():
 def hash_password(password: str) -> str:
     if not password:
         raise ValueError("Password is required")
+    import bcrypt
     salt = bcrypt.gensalt()
     hashed = bcrypt.hashpw(password.encode("utf-8"), salt)
     return hashed.decode("utf-8")
@@ -31,6 +33,7 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     if not password or not hashed:
         return False
+    import bcrypt
     try:
         return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
     except Exception:
@@ -50,6 +53,7 @@ def create_token(user: Dict, plan: Optional[Dict] = None) -> str:
         "exp": now + datetime.timedelta(days=JWT_TTL_DAYS),
         "iat": now,
     }
+    import jwt
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
 
 
@@ -66,6 +70,7 @@ def create_action_token(email: str, purpose: str, ttl_minutes: int = ACTION_TTL_
     }
     if extra:
         payload.update(extra)
+    import jwt
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
 
 
@@ -73,6 +78,7 @@ def verify_action_token(token: str, purpose: str) -> Optional[Dict]:
     """Validate a purpose-bound JWT; returns payload if valid/purpose matches."""
     if not token or not JWT_SECRET:
         return None
+    import jwt
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
         if payload.get("purpose") != purpose:
@@ -87,6 +93,7 @@ def verify_token(token: str) -> Optional[Dict]:
         return None
     if not JWT_SECRET:
         return None
+    import jwt
     try:
         return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
     except Exception:
@@ -0,0 +1,159 @@
+"""
+Change Index
+Aggregates of a week's changes, built once per notification run.
+
+Filtered subscriptions pick any mix of services, regions and IP queries
+(addresses or CIDRs); a change concerns the subscription when it matches any
+of them. Services and regions are dict lookups. IP queries go through a prefix
+index of the week's added and removed prefixes: CIDR blocks either nest or
+are disjoint, so a query overlaps a prefix when one of its supernets is a
+changed prefix (one lookup per prefix length) or a changed prefix starts
+inside it (a binary search over the sorted prefix starts).
+"""
+
+import ipaddress
+from bisect import bisect_left, bisect_right
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+# Region selection meaning "no particular region" (older subscription form)
+ALL_REGIONS = 'all'
+
+
+class ChangeIndex:
+    """Change aggregates keyed by service, region and changed prefix"""
+
+    def __init__(self, changes: Dict):
+        self.changes: List[Dict] = changes.get('changes', [])
+        # service -> {'changes': n, 'regions': {region, ...}, 'added': n, 'removed': n}
+        self.services: Dict[str, Dict] = {}
+        # service / region -> positions of its changes in self.changes
+        self.service_changes: Dict[str, List[int]] = {}
+        self.region_changes: Dict[str, List[int]] = {}
+        for position, item in enumerate(self.changes):
+            service = item.get('service')
+            aggregate = self.services.setdefault(service, {
+                'changes': 0, 'regions': set(), 'added': 0, 'removed': 0
+            })
+            aggregate['changes'] += 1
+            aggregate['added'] += _added_count(item)
+            aggregate['removed'] += _removed_count(item)
+            self.service_changes.setdefault(service, []).append(position)
+            region = item.get('region')
+            if region:
+                aggregate['regions'].add(region)
+                self.region_changes.setdefault(region.lower(), []).append(position)
+
+        # Built on the first IP query, as most runs have none
+        self._networks: Optional[Dict[Tuple[int, int, int], List[int]]] = None
+        self._starts: Dict[int, List[int]] = {}
+        self._start_changes: Dict[int, List[int]] = {}
+        self._query_cache: Dict[str, FrozenSet[int]] = {}
+
+    def _build_prefix_index(self):
+        """Index every added and removed prefix by (version, length, network) and by start address"""
+        self._networks = {}
+        starts: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        for position, item in enumerate(self.changes):
+            for prefix in item.get('added_prefixes', []) + item.get('removed_prefixes', []):
+                network = _parse_network(prefix)
+                if network is None:
+                    continue
+                self._networks.setdefault(_network_key(network), []).append(position)
+                starts[network.version].append((int(network.network_address), position))
+        for version, entries in starts.items():
+            entries.sort()
+            self._starts[version] = [start for start, _ in entries]
+            self._start_changes[version] = [position for _, position in entries]
+
+    def ip_query_changes(self, query: str) -> FrozenSet[int]:
+        """Positions of the changes whose added or removed prefixes overlap an IP or CIDR query"""
+        cached = self._query_cache.get(query)
+        if cached is not None:
+            return cached
+        if self._networks is None:
+            self._build_prefix_index()
+
+        matched: Set[int] = set()
+        network = _parse_network(query)
+        if network is not None:
+            bits = network.max_prefixlen
+            address = int(network.network_address)
+            # Changed prefixes containing the query
+            for length in range(network.prefixlen + 1):
+                matched.update(self._networks.get((network.version, length, address >> (bits - length)), ()))
+            # Changed prefixes inside the query
+            starts = self._starts[network.version]
+            first = bisect_left(starts, address)
+            last = bisect_right(starts, int(network.broadcast_address))
+            matched.update(self._start_changes[network.version][first:last])
+
+        result = frozenset(matched)
+        self._query_cache[query] = result
+        return result
+
+    def matches(self, selected_services: Iterable[str], selected_regions: Iterable[str] = (),
+                ip_queries: Iterable[str] = ()) -> bool:
+        """Whether any change concerns the selected services, regions or IP queries"""
+        return (any(service in self.services for service in selected_services)
+                or any(region.lower() in self.region_changes for region in selected_regions)
+                or any(self.ip_query_changes(query) for query in ip_queries))
+
+    def scoped_stats(self, selected_services: Iterable[str], selected_regions: Iterable[str] = (),
+                     ip_queries: Iterable[str] = ()) -> Tuple[int, int, int, int]:
+        """(services changed, regions, IPs added, IPs removed) over the changes a selection covers"""
+        selected_regions = [region for region in selected_regions if region != ALL_REGIONS]
+        ip_queries = list(ip_queries)
+        if not selected_regions and not ip_queries:
+            return self._service_stats(selected_services)
+
+        positions: Set[int] = set()
+        for service in selected_services:
+            positions.update(self.service_changes.get(service, ()))
+        for region in selected_regions:
+            positions.update(self.region_changes.get(region.lower(), ()))
+        for query in ip_queries:
+            positions |= self.ip_query_changes(query)
+
+        added = removed = 0
+        regions: Set[str] = set()
+        for position in positions:
+            item = self.changes[position]
+            added += _added_count(item)
+            removed += _removed_count(item)
+            if item.get('region'):
+                regions.add(item['region'])
+        return len(positions), len(regions), added, removed
+
+    def _service_stats(self, selected_services: Iterable[str]) -> Tuple[int, int, int, int]:
+        """scoped_stats for a services-only selection, from the per-service aggregates"""
+        changed = added = removed = 0
+        regions: Set[str] = set()
+        for service in set(selected_services):
+            aggregate = self.services.get(service)
+            if aggregate is None:
+                continue
+            changed += aggregate['changes']
+            added += aggregate['added']
+            removed += aggregate['removed']
+            regions |= aggregate['regions']
+        return changed, len(regions), added, removed
+
+
+def _added_count(item: Dict) -> int:
+    return item.get('added_count', len(item.get('added_prefixes', [])))
+
+
+def _removed_count(item: Dict) -> int:
+    return item.get('removed_count', len(item.get('removed_prefixes', [])))
+
+
+def _parse_network(value: str):
+    """IPv4/IPv6 network of an address or CIDR, or None if it is neither"""
+    try:
+        return ipaddress.ip_network(str(value).strip(), strict=False)
+    except ValueError:
+        return None
+
+
+def _network_key(network) -> Tuple[int, int, int]:
+    return network.version, network.prefixlen, int(network.network_address) >> (network.max_prefixlen - network.prefixlen)
@@ -1,16 +1,29 @@
 """
 MongoDB Atlas Configuration
 Handles secure database connections with error handling and retries.
+
+One pooled MongoClient is created lazily per process and shared by every
+request a warm serverless instance serves, so only a cold start pays for the
+TLS handshake and server selection. Handlers call connect() (cheap once the
+client exists) and leave the client open; scripts close it when done.
 """
 
 import os
 import sys
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
-from dotenv import load_dotenv
+import threading
+
+# Deployed functions get their settings from the environment; .env is for local runs
+if not os.getenv('VERCEL'):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Connections per instance (serverless instances serve few requests at once)
+MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '10'))
+# Idle pooled connections are dropped after this long
+MAX_IDLE_TIME_MS = int(os.getenv('MONGODB_MAX_IDLE_TIME_MS', '300000'))
+# Atlas requires TLS; MONGODB_TLS=false is for a local plain-text stand-in (e.g. mongod in Docker)
+TLS_ENABLED = os.getenv('MONGODB_TLS', 'true').lower() != 'false'
 
-# Load environment variables
-load_dotenv()
 
 class DatabaseConfig:
     """MongoDB Atlas database configuration and connection management"""
@@ -21,73 +34,101 @@ class DatabaseConfig:
         self.collection_name = 'subscriptions'
         self.client = None
         self.db = None
-        
+        self.pool_metrics = None
+        self.clients_created = 0
+        self.connects = 0
+        self._lock = threading.Lock()
+    
+    def _create_client(self):
         if not self.uri:
             raise ValueError("MONGODB_URI environment variable is not set")
+        from pymongo import MongoClient
+        from .pool_metrics import PoolMetrics
+        
+        if self.pool_metrics is None:
+            self.pool_metrics = PoolMetrics()
+        # No I/O here: the pool connects on first use and monitors the cluster in the background
+        return MongoClient(
+            self.uri,
+            serverSelectionTimeoutMS=5000,  # 5 second timeout
+            connectTimeoutMS=10000,
+            maxPoolSize=MAX_POOL_SIZE,
+            maxIdleTimeMS=MAX_IDLE_TIME_MS,
+            retryWrites=True,
+            w='majority',
+            tls=TLS_ENABLED,
+            tlsAllowInvalidCertificates=True,  # For development only
+            event_listeners=[self.pool_metrics]
+        )
     
-    def connect(self):
-        """Establish connection to MongoDB Atlas"""
+    def get_database(self):
+        """Shared database handle, creating the pooled client on first use"""
+        if self.db is None:
+            with self._lock:
+                if self.db is None:
+                    self.client = self._create_client()
+                    self.clients_created += 1
+                    self.db = self.client[self.db_name]
+        return self.db
+    
+    def connect(self, verify: bool = False):
+        """
+        Make sure the shared client exists (reused across invocations)
+        
+        Args:
+            verify: Also ping the server (scripts and health checks; handlers skip the round-trip)
+        """
+        self.connects += 1
         try:
-            self.client = MongoClient(
-                self.uri,
-                serverSelectionTimeoutMS=5000,  # 5 second timeout
-                connectTimeoutMS=10000,
-                retryWrites=True,
-                w='majority',
-                tls=True,
-                tlsAllowInvalidCertificates=True  # For development only
-            )
-            
-            # Test connection
-            self.client.admin.command('ping')
-            self.db = self.client[self.db_name]
-            
-            print(f"✅ Connected to MongoDB Atlas: {self.db_name}")
+            self.get_database()
+            if verify:
+                self.client.admin.command('ping')
+                print(f"✅ Connected to MongoDB Atlas: {self.db_name}")
             return True
             
-        except (ConnectionFailure, ServerSelectionTimeoutError) as e:
-            print(f"❌ Failed to connect to MongoDB: {e}")
-            return False
         except Exception as e:
-            print(f"❌ Unexpected error connecting to MongoDB: {e}")
+            from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+            if isinstance(e, (ConnectionFailure, ServerSelectionTimeoutError)):
+                print(f"❌ Failed to connect to MongoDB: {e}")
+            else:
+                print(f"❌ Unexpected error connecting to MongoDB: {e}")
             return False
     
+    @staticmethod
+    def is_unreachable(error: Exception) -> bool:
+        """
+        Whether a query failed because no server could be selected
+        
+        connect() does not ping, so handlers learn the cluster is down from
+        their first query instead. Never imports pymongo: if it is not loaded,
+        the error cannot have come from it.
+        """
+        errors = sys.modules.get('pymongo.errors')
+        return errors is not None and isinstance(error, errors.ServerSelectionTimeoutError)
+    
     def get_collection(self, collection_name=None):
         """Get collection reference"""
-        if self.db is None:
-            if not self.connect():
-                raise ConnectionError("Cannot connect to database")
-        
         col_name = collection_name or self.collection_name
-        return self.db[col_name]
+        return self.get_database()[col_name]
     
-    def close(self):
-        """Close database connection"""
-        if self.client:
-            self.client.close()
-            print("🔌 Closed MongoDB connection")
+    def pool_stats(self) -> dict:
+        """Connection pool metrics and how often the warm client was reused"""
+        return {
+            'clients_created': self.clients_created,
+            'connects': self.connects,
+            'client_reuses': max(0, self.connects - self.clients_created),
+            'max_pool_size': MAX_POOL_SIZE,
+            **(self.pool_metrics.snapshot() if self.pool_metrics else {})
+        }
     
-    def create_indexes(self):
-        """Create database indexes for performance"""
-        try:
-            collection = self.get_collection()
-            
-            # Index on email for fast lookups (unique for active subscriptions)
-            collection.create_index([("email", 1), ("status", 1)])
-            
-            # Index on unsubscribe token for fast validation
-            collection.create_index("unsubscribe_token", unique=True)
-            
-            # Index on timestamp for sorting
-            collection.create_index("timestamp", -1)
-            
-            # Index on status for filtering
-            collection.create_index("status")
-            
-            print("✅ Database indexes created")
-            
-        except Exception as e:
-            print(f"⚠️ Error creating indexes: {e}")
+    def close(self):
+        """Close the shared client (scripts, at exit; handlers keep it warm)"""
+        with self._lock:
+            if self.client:
+                self.client.close()
+                self.client = None
+                self.db = None
+                print("🔌 Closed MongoDB connection")
 
 # Global database instance
 db_config = DatabaseConfig()
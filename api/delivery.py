@@ -0,0 +1,159 @@
+"""
+Concurrent Email Delivery
+Sends notification requests from a bounded thread pool under a global rate limit.
+
+Every API call (first attempts and retries alike) takes a token from a shared
+token bucket, so the pool never exceeds the provider's request rate however
+many workers are running. Throttling (429) and server errors (5xx), as well
+as network errors, are retried with exponential backoff and full jitter.
+Other failures (e.g. 400, 401) are final.
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Defaults stay well under SendGrid's mail/send rate limit
+MAX_WORKERS = int(os.getenv('EMAIL_MAX_WORKERS', '8'))
+RATE_LIMIT = float(os.getenv('EMAIL_RATE_LIMIT', '10'))  # requests per second
+MAX_RETRIES = int(os.getenv('EMAIL_MAX_RETRIES', '4'))
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens per second, bursts of up to capacity.
+    The default capacity of one token spaces requests evenly at the rate."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until tokens are available, then take them"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _status_code(response=None, error: Optional[Exception] = None) -> Optional[int]:
+    """HTTP status of a response, or of an HTTPError raised by the SendGrid client"""
+    source = response if error is None else error
+    return getattr(source, 'status_code', None)
+
+
+def _retry_after(error: Optional[Exception]) -> Optional[float]:
+    """Seconds the provider asked us to wait (Retry-After), if it said so"""
+    headers = getattr(error, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(status_code: Optional[int]) -> bool:
+    """Throttling, server errors and network errors (no status) are worth retrying"""
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+class DeliveryEngine:
+    """
+    Deliver jobs concurrently with rate limiting, retries and per-recipient results.
+
+    A job is (recipient emails, send) where send() makes one API call and returns
+    a response with a status_code (or raises). All recipients of a job share its
+    outcome, as they share one request.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, rate_limit: float = RATE_LIMIT,
+                 max_retries: int = MAX_RETRIES, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY,
+                 burst: float = 1.0):
+        self.max_workers = max(1, max_workers)
+        self.bucket = TokenBucket(rate_limit, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _backoff(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """Full jitter: a random delay up to base * 2^attempt, but at least any Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def _run(self, send: Callable, max_retries: int) -> Dict:
+        """Send one job, retrying transient failures. Returns its result."""
+        result = {'status': 'failed', 'attempts': 0, 'status_code': None, 'error': None}
+        for attempt in range(max_retries + 1):
+            self.bucket.acquire()
+            result['attempts'] += 1
+            error = None
+            try:
+                response = send()
+                result['status_code'] = _status_code(response)
+            except Exception as e:
+                error = e
+                result['status_code'] = _status_code(error=e)
+                if result['status_code'] is not None:
+                    result['error'] = f"HTTP {result['status_code']} {getattr(e, 'reason', '')}".strip()
+                else:
+                    result['error'] = str(e) or type(e).__name__
+
+            status_code = result['status_code']
+            if error is None and status_code is not None and 200 <= status_code < 300:
+                result['status'] = 'sent'
+                result['error'] = None
+                return result
+            if error is None:
+                result['error'] = f"HTTP {status_code}"
+            if not is_retryable(status_code) or attempt == max_retries:
+                return result
+            time.sleep(self._backoff(attempt, error))
+        return result
+
+    def deliver(self, jobs: Iterable[Tuple[List[str], Callable]], max_retries: Optional[int] = None) -> Dict:
+        """
+        Run every job and report per recipient.
+
+        max_retries overrides the engine's retries for this call (e.g. what is
+        left of a caller's own attempt budget).
+
+        Returns:
+            Dict with sent and failed (recipient counts), api_calls, retries and
+            results ({email: {status, attempts, status_code, error}})
+        """
+        jobs = list(jobs)
+        max_retries = self.max_retries if max_retries is None else max(0, max_retries)
+        report = {'sent': 0, 'failed': 0, 'api_calls': 0, 'retries': 0, 'results': {}}
+        lock = threading.Lock()
+
+        def run(job: Tuple[List[str], Callable]):
+            emails, send = job
+            result = self._run(send, max_retries)
+            with lock:
+                report['api_calls'] += result['attempts']
+                report['retries'] += result['attempts'] - 1
+                report[result['status']] += len(emails)
+                for email in emails:
+                    report['results'][email] = result
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(1, len(jobs)))) as pool:
+            # list() re-raises anything unexpected from a worker
+            list(pool.map(run, jobs))
+        return report
@@ -1,29 +1,159 @@
 """
 Email Service using SendGrid
 Handles sending confirmation and notification emails.
+
+sendgrid is imported when the first message is built, so importing this module
+(or running without an API key) does not pay for it.
 """
 
+import json
 import os
+import threading
 from datetime import datetime
-from typing import Dict, List
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, To, Content
-from dotenv import load_dotenv
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, FrozenSet, List, Optional, Tuple
+
+from .change_index import ChangeIndex
+from .delivery import DeliveryEngine
+
+if TYPE_CHECKING:
+    from sendgrid.helpers.mail import Mail
+
+# Deployed functions get their settings from the environment; .env is for local runs
+if not os.getenv('VERCEL'):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# SendGrid accepts at most 1000 personalizations per mail/send request
+MAX_PERSONALIZATIONS = int(os.getenv('SENDGRID_MAX_PERSONALIZATIONS', '1000'))
+
+CHANGE_NOTIFICATION_SUBJECT = 'Weekly Update: Azure Public Cloud IP Ranges & Service Tags changes'
+
+# Per-recipient placeholders in change notifications, replaced through SendGrid substitutions
+EMAIL_TAG = '-email-'
+UNSUBSCRIBE_URL_TAG = '-unsubscribe_url-'
+
+
+def _fmt_date(value) -> str:
+    """Return date-only label (YYYY-MM-DD) for ISO/timestamp strings."""
+    if not value:
+        return "Not provided"
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, str):
+        cleaned = value.strip()
+        # Try ISO parsing first (handles timezone offsets and Z)
+        try:
+            iso_candidate = cleaned.replace('Z', '+00:00')
+            return datetime.fromisoformat(iso_candidate).date().isoformat()
+        except Exception:
+            pass
+        formats = [
+            "%Y-%m-%d",
+            "%m/%d/%Y",
+            "%Y-%m-%d %H:%M:%S",
+            "%Y-%m-%dT%H:%M:%S",
+            "%Y-%m-%dT%H:%M:%S.%f%z",
+            "%Y-%m-%dT%H:%M:%S.%f",
+            "%Y-%m-%dT%H:%M:%S%z",
+        ]
+        for fmt in formats:
+            try:
+                return datetime.strptime(cleaned[:len(fmt.replace('%z',''))], fmt).date().isoformat()
+            except ValueError:
+                continue
+        if len(cleaned) >= 10:
+            return cleaned[:10]
+        return cleaned
+    return str(value)
+
+
+class StubResponse:
+    """Minimal stand-in for the python_http_client response returned by SendGrid"""
+
+    def __init__(self, status_code: int = 202):
+        self.status_code = status_code
+        self.body = b''
+        self.headers = {}
+
+
+class StubTransport:
+    """
+    Offline transport with the SendGridAPIClient.send interface.
+
+    Records each request body instead of sending it and, when outbox_dir is
+    set, also writes it there as JSON. Enable with EMAIL_TRANSPORT=stub
+    (and EMAIL_STUB_DIR) or pass it to EmailService(transport=...).
+    """
+
+    def __init__(self, outbox_dir: Optional[str] = None, status_code: int = 202):
+        self.outbox_dir = Path(outbox_dir) if outbox_dir else None
+        self.status_code = status_code
+        self.sent: List[Dict] = []
+
+    def send(self, message: 'Mail') -> StubResponse:
+        request_body = message.get()
+        self.sent.append(request_body)
+        if self.outbox_dir:
+            self.outbox_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.outbox_dir / f"{len(self.sent):06d}.json", 'w', encoding='utf-8') as f:
+                json.dump(request_body, f, indent=2, ensure_ascii=False)
+        return StubResponse(self.status_code)
+
+
+Scope = Tuple[str, FrozenSet[str], FrozenSet[str], FrozenSet[str]]
+
+
+def subscription_scope(recipient: Dict) -> Scope:
+    """What a recipient's change notification depends on: subscription type and selected services, regions and IPs"""
+    return (recipient.get('subscriptionType', 'all'),
+            frozenset(recipient.get('selectedServices', []) or []),
+            frozenset(recipient.get('selectedRegions', []) or []),
+            frozenset(recipient.get('ip_queries', []) or []))
 
-load_dotenv()
+
+class ChangeNotificationRenderer:
+    """
+    Renders the change notification once per subscription scope.
+
+    Every recipient in a scope gets the same (html, text) body; their address
+    and unsubscribe link are left as substitution tags for SendGrid.
+    """
+
+    def __init__(self, email_service: 'EmailService', changes: Dict, change_index: Optional[ChangeIndex] = None):
+        self.email_service = email_service
+        self.context = email_service._change_context(changes, change_index)
+        self.cache: Dict[Scope, Tuple[str, str]] = {}
+
+    def render(self, scope: Scope) -> Tuple[str, str]:
+        body = self.cache.get(scope)
+        if body is None:
+            subscription_type, selected_services, selected_regions, ip_queries = scope
+            # Sorted so every ordering of the same selection renders identically
+            body = self.email_service._render_change_notification(self.context, subscription_type,
+                                                                  sorted(selected_services),
+                                                                  sorted(selected_regions), sorted(ip_queries))
+            self.cache[scope] = body
+        return body
 
 
 class EmailService:
     """Email service for subscription management"""
     
-    def __init__(self):
+    def __init__(self, transport=None, delivery: Optional[DeliveryEngine] = None):
         self.api_key = os.getenv('SENDGRID_API_KEY')
         self.from_email = os.getenv('FROM_EMAIL', 'noreply@azure-tracker.com')
         self.from_name = os.getenv('FROM_NAME', 'Azure Service Tags Tracker')
         self.app_url = os.getenv('APP_URL', 'https://eliaquimbrandao.github.io/azure-service-tags-tracker-dev')
-        self.client = None
+        self.client = transport
+        self.delivery = delivery or DeliveryEngine()
+        self.last_delivery: Optional[Dict] = None
         
-        if self.api_key and self.api_key != 'your_sendgrid_api_key_here':
+        if self.client is None and os.getenv('EMAIL_TRANSPORT', '').lower() == 'stub':
+            self.client = StubTransport(os.getenv('EMAIL_STUB_DIR'))
+        elif self.client is None and self.api_key and self.api_key != 'your_sendgrid_api_key_here':
+            from sendgrid import SendGridAPIClient
             self.client = SendGridAPIClient(self.api_key)
     
     def send_confirmation_email(self, subscription: Dict) -> bool:
@@ -87,6 +217,7 @@ class EmailService:
             </html>
             """
             
+            from sendgrid.helpers.mail import Mail, Email, To, Content
             message = Mail(
                 from_email=Email(self.from_email, self.from_name),
                 to_emails=To(subscription['email']),
@@ -107,7 +238,63 @@ class EmailService:
             print(f"❌ Error sending email: {e}")
             return False
     
-    def send_change_notification(self, recipients: List[Dict], changes: Dict) -> bool:
+    def send_upgrade_magic_link(self, email: str, link: str) -> bool:
+        """Send a short-lived magic link so the user can finalize premium and set a password."""
+        if not email:
+            return False
+        if not link:
+            return False
+
+        subject = "Complete your premium upgrade"
+        html_content = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; background: #f7f7fb; color: #1f2937; }}
+                .container {{ max-width: 560px; margin: 0 auto; padding: 24px; }}
+                .card {{ background: #ffffff; border-radius: 10px; padding: 24px; box-shadow: 0 10px 35px rgba(31,41,55,0.08); }}
+                .btn {{ display: inline-block; background: #2563eb; color: #fff; padding: 12px 18px; border-radius: 8px; text-decoration: none; font-weight: 600; }}
+                .muted {{ color: #6b7280; font-size: 14px; margin-top: 12px; }}
+                .code {{ font-family: 'SFMono-Regular', Consolas, 'Liberation Mono', monospace; background: #f3f4f6; padding: 4px 8px; border-radius: 6px; }}
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <div class="card">
+                    <h2>Finish upgrading to Premium</h2>
+                    <p>Click the button below to confirm your email and create a password. This link expires soon for security.</p>
+                    <p><a class="btn" href="{link}" target="_blank" rel="noopener">Complete upgrade</a></p>
+                    <p class="muted">If the button does not work, copy and paste this link into your browser:</p>
+                    <p class="code">{link}</p>
+                    <p class="muted">You are receiving this because someone requested a premium upgrade for this email.</p>
+                </div>
+            </div>
+        </body>
+        </html>
+        """
+
+        if not self.client:
+            print("⚠️ SendGrid not configured. Upgrade link for", email, "=>", link)
+            return False
+
+        try:
+            from sendgrid.helpers.mail import Mail, Email, To, Content
+            message = Mail(
+                from_email=Email(self.from_email, self.from_name),
+                to_emails=To(email),
+                subject=subject,
+                html_content=Content("text/html", html_content)
+            )
+            response = self.client.send(message)
+            return response.status_code in [200, 202]
+        except Exception as e:
+            print(f"❌ Error sending upgrade magic link: {e}")
+            return False
+    
+    def send_change_notification(self, recipients: List[Dict], changes: Dict, batched: bool = True,
+                                 change_index: Optional[ChangeIndex] = None,
+                                 max_retries: Optional[int] = None) -> bool:
         """
         Send notification email about Azure Service Tags changes.
 
@@ -115,9 +302,25 @@ class EmailService:
         (all services vs filtered selection) and show a scoped summary when
         applicable.
 
+        The body is rendered once per subscription scope (type and set of
+        selected services). Recipients of a scope share SendGrid requests,
+        with one personalization each (up to MAX_PERSONALIZATIONS per
+        request). Their address and unsubscribe link are filled in through
+        substitutions, so nobody sees another recipient.
+
+        Requests are sent concurrently by the DeliveryEngine (rate limited,
+        retried on 429/5xx); the per-recipient outcome is kept in
+        self.last_delivery.
+
         Args:
             recipients: List of dicts with keys email, subscriptionType, selectedServices
+                        and optionally selectedRegions, ip_queries and unsubscribe_token
             changes: Change data from latest-changes.json
+            batched: Group recipients into multi-personalization requests
+                     (False sends one request per recipient)
+            change_index: ChangeIndex of changes, if the caller already built one
+            max_retries: Retries per request instead of the DeliveryEngine's
+                         (the outbox passes what is left of its attempts)
 
         Returns:
             True if at least one email was sent successfully
@@ -126,172 +329,132 @@ class EmailService:
             print(f"⚠️ SendGrid not configured. Would send to {len(recipients)} recipients")
             return False
         
+        self.last_delivery = None
         try:
-            # Summarize change payload for a compact snapshot
-            change_list = changes.get('changes', [])
-            services_changed = len(change_list)
-            # Dates: Microsoft publish vs our detection vs change week
-            timestamp = changes.get('generated_at') or changes.get('timestamp') or 'Not provided'
-            published_date = (changes.get('metadata') or {}).get('date_published') or changes.get('date') or timestamp
-            regions_changed = 0
-            added_total = 0
-            removed_total = 0
-            seen_regions = set()
-
-            for item in change_list:
-                added_total += item.get('added_count', len(item.get('added_prefixes', [])))
-                removed_total += item.get('removed_count', len(item.get('removed_prefixes', [])))
-                region = item.get('region')
-                if region:
-                    seen_regions.add(region)
-
-            if seen_regions:
-                regions_changed = len(seen_regions)
-
-            # Prefer regional count from summary when available (matches dashboard)
-            regional_map = changes.get('regional_changes') if isinstance(changes.get('regional_changes'), dict) else None
-            regions_from_summary = len([r for r, count in regional_map.items() if count]) if regional_map else regions_changed
-
-            def _fmt_date(value) -> str:
-                """Return date-only label (YYYY-MM-DD) for ISO/timestamp strings."""
-                if not value:
-                    return "Not provided"
-                if isinstance(value, datetime):
-                    return value.date().isoformat()
-                if isinstance(value, str):
-                    cleaned = value.strip()
-                    # Try ISO parsing first (handles timezone offsets and Z)
-                    try:
-                        iso_candidate = cleaned.replace('Z', '+00:00')
-                        return datetime.fromisoformat(iso_candidate).date().isoformat()
-                    except Exception:
-                        pass
-                    formats = [
-                        "%Y-%m-%d",
-                        "%m/%d/%Y",
-                        "%Y-%m-%d %H:%M:%S",
-                        "%Y-%m-%dT%H:%M:%S",
-                        "%Y-%m-%dT%H:%M:%S.%f%z",
-                        "%Y-%m-%dT%H:%M:%S.%f",
-                        "%Y-%m-%dT%H:%M:%S%z",
-                    ]
-                    for fmt in formats:
-                        try:
-                            return datetime.strptime(cleaned[:len(fmt.replace('%z',''))], fmt).date().isoformat()
-                        except ValueError:
-                            continue
-                    if len(cleaned) >= 10:
-                        return cleaned[:10]
-                    return cleaned
-                return str(value)
-
-            def send_upgrade_magic_link(self, email: str, link: str) -> bool:
-                """Send a short-lived magic link so the user can finalize premium and set a password."""
-                if not email:
-                    return False
-                if not link:
-                    return False
-
-                subject = "Complete your premium upgrade"
-                html_content = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <style>
-                        body {{ font-family: Arial, sans-serif; background: #f7f7fb; color: #1f2937; }}
-                        .container {{ max-width: 560px; margin: 0 auto; padding: 24px; }}
-                        .card {{ background: #ffffff; border-radius: 10px; padding: 24px; box-shadow: 0 10px 35px rgba(31,41,55,0.08); }}
-                        .btn {{ display: inline-block; background: #2563eb; color: #fff; padding: 12px 18px; border-radius: 8px; text-decoration: none; font-weight: 600; }}
-                        .muted {{ color: #6b7280; font-size: 14px; margin-top: 12px; }}
-                        .code {{ font-family: 'SFMono-Regular', Consolas, 'Liberation Mono', monospace; background: #f3f4f6; padding: 4px 8px; border-radius: 6px; }}
-                    </style>
-                </head>
-                <body>
-                    <div class="container">
-                        <div class="card">
-                            <h2>Finish upgrading to Premium</h2>
-                            <p>Click the button below to confirm your email and create a password. This link expires soon for security.</p>
-                            <p><a class="btn" href="{link}" target="_blank" rel="noopener">Complete upgrade</a></p>
-                            <p class="muted">If the button does not work, copy and paste this link into your browser:</p>
-                            <p class="code">{link}</p>
-                            <p class="muted">You are receiving this because someone requested a premium upgrade for this email.</p>
-                        </div>
-                    </div>
-                </body>
-                </html>
-                """
-
-                if not self.client:
-                    print("⚠️ SendGrid not configured. Upgrade link for", email, "=>", link)
-                    return False
-
-                try:
-                    message = Mail(
-                        from_email=Email(self.from_email, self.from_name),
-                        to_emails=To(email),
-                        subject=subject,
-                        html_content=Content("text/html", html_content)
-                    )
-                    response = self.client.send(message)
-                    return response.status_code in [200, 202]
-                except Exception as e:
-                    print(f"❌ Error sending upgrade magic link: {e}")
-                    return False
-
-            detected_label = _fmt_date(timestamp)
-            published_label = _fmt_date(published_date)
-
-            def scoped_stats(selected_services: List[str]):
-                if not selected_services:
-                    # All-services subscription: use summary region count if present
-                    return services_changed, regions_from_summary, added_total, removed_total
-                svc_changed = 0
-                svc_regions = set()
-                svc_added = 0
-                svc_removed = 0
-                for item in change_list:
-                    if item.get('service') not in selected_services:
-                        continue
-                    svc_changed += 1
-                    svc_added += item.get('added_count', len(item.get('added_prefixes', [])))
-                    svc_removed += item.get('removed_count', len(item.get('removed_prefixes', [])))
-                    region = item.get('region')
-                    if region:
-                        svc_regions.add(region)
-                return svc_changed, len(svc_regions), svc_added, svc_removed
-
-            success_count = 0
+            renderer = ChangeNotificationRenderer(self, changes, change_index)
+            
+            groups: Dict[Scope, List[Dict]] = {}
             for recipient in recipients:
-                email = recipient['email']
-                subscription_type = recipient.get('subscriptionType', 'all')
-                selected_services = recipient.get('selectedServices', []) or []
-
-                scoped_services_changed, scoped_regions, scoped_added, scoped_removed = scoped_stats(selected_services)
-
-                reason = "You receive this because you subscribed to all Azure Service Tags changes."
-                if subscription_type == 'filtered':
-                    reason = "You receive this because you subscribed to updates for specific services." + \
-                             (" Services: " + ", ".join(selected_services) if selected_services else "")
-
-                # Plaintext part (keeps size tiny and forwards cleanly)
-                text_lines = [
-                    "Azure Service Tags update",
-                    reason,
-                    "We detected new Azure Service Tags activity this week. Review the dashboard for a complete list of every service and IP range that changed, plus historical context and filtering tools.",
-                    f"Services changed: {scoped_services_changed}",
-                    f"Regions touched: {scoped_regions}",
-                    f"IPs added: {scoped_added} | removed: {scoped_removed}",
-                    f"Published by Microsoft: {published_label}",
-                    f"Detected by tracker: {detected_label}",
-                    f"Details: {self.app_url}/history.html",
-                    f"Manage subscription: {self.app_url}/unsubscribe.html",
-                ]
-                text_body = "\n".join(text_lines)
-
-                # Compact HTML summary mirroring the dashboard hero stats with a dark header
-                subscription_line = "Weekly change summary from your subscription to all Azure Service Tags & IP ranges changes." if subscription_type == 'all' else "Weekly change summary for your subscription to selected Azure Service Tags changes."
-
-                html_content = f"""
+                groups.setdefault(subscription_scope(recipient), []).append(recipient)
+            
+            batch_size = MAX_PERSONALIZATIONS if batched else 1
+            jobs = []
+            for scope, group in groups.items():
+                html_content, text_body = renderer.render(scope)
+                for start in range(0, len(group), batch_size):
+                    batch = group[start:start + batch_size]
+                    jobs.append(([recipient['email'] for recipient in batch],
+                                 partial(self._send_change_batch, html_content, text_body, batch)))
+
+            report = self.delivery.deliver(jobs, max_retries=max_retries)
+            self.last_delivery = report
+
+            # Recipients of one request share its result; report each failed request once
+            failed = {}
+            for email, result in report['results'].items():
+                if result['status'] != 'sent':
+                    failed.setdefault(id(result), (result, []))[1].append(email)
+            for result, emails in failed.values():
+                target = emails[0] if len(emails) == 1 else f"{len(emails)} recipients"
+                print(f"⚠️ Failed to send to {target} after {result['attempts']} attempts: {result['error']}")
+
+            print(f"✅ Change notifications sent to {report['sent']}/{len(recipients)} subscribers "
+                  f"({report['api_calls']} API calls, {report['retries']} retries, {len(groups)} distinct emails)")
+            return report['sent'] > 0
+        except Exception as e:
+            print(f"❌ Error sending notifications: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+    
+    @staticmethod
+    def _change_context(changes: Dict, change_index: Optional[ChangeIndex] = None) -> Dict:
+        """Totals and labels shared by every recipient's change notification"""
+        # Summarize change payload for a compact snapshot
+        change_list = changes.get('changes', [])
+        services_changed = len(change_list)
+        # Dates: Microsoft publish vs our detection vs change week
+        timestamp = changes.get('generated_at') or changes.get('timestamp') or 'Not provided'
+        published_date = (changes.get('metadata') or {}).get('date_published') or changes.get('date') or timestamp
+        regions_changed = 0
+        added_total = 0
+        removed_total = 0
+        seen_regions = set()
+
+        for item in change_list:
+            added_total += item.get('added_count', len(item.get('added_prefixes', [])))
+            removed_total += item.get('removed_count', len(item.get('removed_prefixes', [])))
+            region = item.get('region')
+            if region:
+                seen_regions.add(region)
+
+        if seen_regions:
+            regions_changed = len(seen_regions)
+
+        # Prefer regional count from summary when available (matches dashboard)
+        regional_map = changes.get('regional_changes') if isinstance(changes.get('regional_changes'), dict) else None
+        regions_from_summary = len([r for r, count in regional_map.items() if count]) if regional_map else regions_changed
+
+        return {
+            'change_list': change_list,
+            'change_index': change_index or ChangeIndex(changes),
+            'services_changed': services_changed,
+            'regions_changed': regions_from_summary,
+            'added_total': added_total,
+            'removed_total': removed_total,
+            'published_label': _fmt_date(published_date),
+            'detected_label': _fmt_date(timestamp)
+        }
+    
+    @staticmethod
+    def _scoped_stats(context: Dict, selected_services: List[str], selected_regions: List[str] = (),
+                      ip_queries: List[str] = ()) -> Tuple[int, int, int, int]:
+        """(services changed, regions, IPs added, IPs removed) for a recipient's selection"""
+        if not selected_services and not selected_regions and not ip_queries:
+            # All-services subscription: use summary region count if present
+            return context['services_changed'], context['regions_changed'], context['added_total'], context['removed_total']
+        return context['change_index'].scoped_stats(selected_services, selected_regions, ip_queries)
+    
+    def _render_change_notification(self, context: Dict, subscription_type: str, selected_services: List[str],
+                                    selected_regions: List[str] = (), ip_queries: List[str] = ()) -> Tuple[str, str]:
+        """
+        Render the (html, text) change notification for one kind of subscription.
+
+        The recipient's address and unsubscribe link are left as EMAIL_TAG and
+        UNSUBSCRIBE_URL_TAG for SendGrid substitutions.
+        """
+        scoped_services_changed, scoped_regions, scoped_added, scoped_removed = \
+            self._scoped_stats(context, selected_services, selected_regions, ip_queries)
+
+        reason = "You receive this because you subscribed to all Azure Service Tags changes."
+        if subscription_type == 'filtered':
+            targets = "services, regions or IP ranges" if selected_regions or ip_queries else "services"
+            selection = [f"{label}: " + ", ".join(values) for label, values in
+                         (("Services", selected_services), ("Regions", selected_regions), ("IP ranges", ip_queries))
+                         if values]
+            reason = f"You receive this because you subscribed to updates for specific {targets}." + \
+                     (" " + ". ".join(selection) if selection else "")
+
+        # Plaintext part (keeps size tiny and forwards cleanly)
+        text_lines = [
+            "Azure Service Tags update",
+            reason,
+            "We detected new Azure Service Tags activity this week. Review the dashboard for a complete list of every service and IP range that changed, plus historical context and filtering tools.",
+            f"Services changed: {scoped_services_changed}",
+            f"Regions touched: {scoped_regions}",
+            f"IPs added: {scoped_added} | removed: {scoped_removed}",
+            f"Published by Microsoft: {context['published_label']}",
+            f"Detected by tracker: {context['detected_label']}",
+            f"Details: {self.app_url}/history.html",
+            f"Manage subscription: {UNSUBSCRIBE_URL_TAG}",
+            f"Sent to {EMAIL_TAG}",
+        ]
+        text_body = "\n".join(text_lines)
+
+        # Compact HTML summary mirroring the dashboard hero stats with a dark header
+        subscription_line = "Weekly change summary from your subscription to all Azure Service Tags & IP ranges changes." if subscription_type == 'all' else "Weekly change summary for your subscription to selected Azure Service Tags changes."
+
+        html_content = f"""
                                 <!DOCTYPE html>
                                 <html>
                                     <head>
@@ -324,7 +487,7 @@ class EmailService:
                                                 <p>{subscription_line}</p>
                                             </div>
                                             <div class=\"body\">
-                                                    <div class=\"pill secondary\">Published by Microsoft: {published_label}</div><div class=\"pill tertiary\">Detected by tracker: {detected_label}</div>
+                                                    <div class=\"pill secondary\">Published by Microsoft: {context['published_label']}</div><div class=\"pill tertiary\">Detected by tracker: {context['detected_label']}</div>
                                                 <p class=\"reason\">{reason}</p>
                                                 <p class=\"reason\">We detected new Azure Service Tags activity this week. Review the dashboard for a complete list of every service and IP range that changed, plus historical context and filtering tools.</p>
                                                                                                 <table class=\"stats-table\" role=\"presentation\">
@@ -342,37 +505,48 @@ class EmailService:
                                                                                                         </td>
                                                                                                     </tr>
                                                                                                 </table>
-                                                <div class=\"footer\">Manage subscription: <a href=\"{self.app_url}/unsubscribe.html\" style=\"color:#1d4ed8; text-decoration:none;\">unsubscribe</a> · Dashboard: <a href=\"{self.app_url}\" style=\"color:#1d4ed8; text-decoration:none;\">open</a></div>
+                                                <div class=\"footer\">Manage subscription: <a href=\"{UNSUBSCRIBE_URL_TAG}\" style=\"color:#1d4ed8; text-decoration:none;\">unsubscribe</a> · Dashboard: <a href=\"{self.app_url}\" style=\"color:#1d4ed8; text-decoration:none;\">open</a><br>Sent to {EMAIL_TAG}</div>
                                             </div>
                                         </div>
                                     </body>
                                 </html>
                                 """
 
-                try:
-                    message = Mail(
-                        from_email=Email(self.from_email, self.from_name),
-                        to_emails=To(email),
-                        subject='Weekly Update: Azure Public Cloud IP Ranges & Service Tags changes',
-                        html_content=Content("text/html", html_content)
-                    )
-
-                    # Add plaintext alternative to improve deliverability/forwarding
-                    message.add_content(Content("text/plain", text_body))
-
-                    response = self.client.send(message)
-                    if response.status_code in [200, 202]:
-                        success_count += 1
-                except Exception as e:
-                    print(f"⚠️ Failed to send to {email}: {e}")
-
-            print(f"✅ Change notifications sent to {success_count}/{len(recipients)} subscribers")
-            return success_count > 0
-        except Exception as e:
-            print(f"❌ Error sending notifications: {e}")
-            import traceback
-            traceback.print_exc()
-            return False
+        return html_content, text_body
+    
+    def _recipient_substitutions(self, recipient: Dict) -> Dict[str, str]:
+        """Per-recipient values for the substitution tags of a change notification"""
+        email = recipient['email']
+        token = recipient.get('unsubscribe_token')
+        if token:
+            unsubscribe_url = f"{self.app_url}/unsubscribe.html?token={token}&email={email}"
+        else:
+            unsubscribe_url = f"{self.app_url}/unsubscribe.html"
+        return {EMAIL_TAG: email, UNSUBSCRIBE_URL_TAG: unsubscribe_url}
+    
+    def _send_change_batch(self, html_content: str, text_body: str, batch: List[Dict]):
+        """One API call for a batch of recipients (called again by the delivery engine on retry)"""
+        return self.client.send(self._change_message(html_content, text_body, batch))
+    
+    def _change_message(self, html_content: str, text_body: str, batch: List[Dict]) -> 'Mail':
+        """Build one mail/send request with a personalization per recipient"""
+        from sendgrid.helpers.mail import Mail, Email, Content, Personalization, To, Substitution
+        message = Mail(
+            from_email=Email(self.from_email, self.from_name),
+            subject=CHANGE_NOTIFICATION_SUBJECT,
+            html_content=Content("text/html", html_content)
+        )
+
+        # Add plaintext alternative to improve deliverability/forwarding
+        message.add_content(Content("text/plain", text_body))
+
+        for recipient in batch:
+            personalization = Personalization()
+            personalization.add_to(To(recipient['email']))
+            for tag, value in self._recipient_substitutions(recipient).items():
+                personalization.add_substitution(Substitution(tag, value))
+            message.add_personalization(personalization)
+        return message
     
     def send_unsubscribe_verification(self, email: str, verification_token: str) -> bool:
         """
@@ -443,6 +617,7 @@ class EmailService:
             </html>
             """
             
+            from sendgrid.helpers.mail import Mail, Email, To, Content
             message = Mail(
                 from_email=Email(self.from_email, self.from_name),
                 to_emails=To(email),
@@ -490,3 +665,17 @@ class EmailService:
         print(f"Type: {subscription.get('subscriptionType', 'all').title()} Changes")
         print(f"\nUnsubscribe: {unsubscribe_url}")
         print("="*60 + "\n")
+
+
+_shared_service: Optional[EmailService] = None
+_shared_lock = threading.Lock()
+
+
+def shared_email_service() -> EmailService:
+    """The process-wide EmailService, so warm instances and serve_api.py reuse one SendGrid client"""
+    global _shared_service
+    if _shared_service is None:
+        with _shared_lock:
+            if _shared_service is None:
+                _shared_service = EmailService()
+    return _shared_service
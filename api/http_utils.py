@@ -0,0 +1,71 @@
+"""
+HTTP helpers shared by the API functions
+JSON responses and CORS headers for the GitHub Pages site.
+
+Every endpoint's handler subclasses JSONRequestHandler and only implements its
+do_<METHOD> methods. Responses carry a Content-Length, so the same handlers
+can serve keep-alive connections (scripts/serve_api.py) as well as Vercel.
+"""
+
+import json
+from http.server import BaseHTTPRequestHandler
+
+from .db_config import DatabaseConfig
+
+ALLOWED_ORIGINS = [
+    'https://eliaquimbrandao.github.io',
+    'http://localhost:8000',
+    'http://127.0.0.1:8000',
+    'http://localhost:3000',
+    'http://127.0.0.1:3000'
+]
+
+
+class JSONRequestHandler(BaseHTTPRequestHandler):
+    """Base handler: JSON responses, CORS headers and preflight"""
+
+    # Overridden per endpoint
+    allowed_methods = 'GET, POST, OPTIONS'
+    allowed_headers = 'Content-Type, Authorization'
+
+    def do_OPTIONS(self):
+        """Handle CORS preflight request"""
+        self.send_response(200)
+        self.send_cors_headers()
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_json_response(self, status_code, data):
+        """Send JSON response with CORS headers"""
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_cors_headers()
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_response(self, status_code, message):
+        """Send error response"""
+        self.send_json_response(status_code, {
+            'success': False,
+            'error': message
+        })
+
+    def send_exception_response(self, error):
+        """Send a 500 for an unhandled error, without pymongo's topology details"""
+        if DatabaseConfig.is_unreachable(error):
+            self.send_error_response(500, "Database connection failed")
+        else:
+            self.send_error_response(500, str(error))
+
+    def send_cors_headers(self):
+        """Send CORS headers for GitHub Pages"""
+        origin = self.headers.get('Origin', '*')
+        if origin in ALLOWED_ORIGINS or origin == '*':
+            self.send_header('Access-Control-Allow-Origin', origin)
+        else:
+            self.send_header('Access-Control-Allow-Origin', ALLOWED_ORIGINS[0])
+        self.send_header('Access-Control-Allow-Methods', self.allowed_methods)
+        self.send_header('Access-Control-Allow-Headers', self.allowed_headers)
+        self.send_header('Access-Control-Max-Age', '86400')
@@ -0,0 +1,137 @@
+"""
+IP Range Index
+Answers "which service tags cover this IP/CIDR?" for /api/lookup.
+
+Reads docs/data/ip-ranges.bin, written by the watcher (scripts/ip_index.py
+documents the layout). The file is memory-mapped once per process and its
+columns are used in place through memoryviews, so a warm instance pays for
+the mapping and the JSON header once and every request after that only
+touches the pages its binary searches land on.
+
+Ranges are sorted by (start, length). The last range starting at or before
+the queried network is the most specific candidate; its parent chain holds
+every enclosing prefix, so a lookup is one bisect plus at most 33 (IPv4) or
+129 (IPv6) parent hops.
+"""
+
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DEFAULT_RANGES_FILE = Path(__file__).parent.parent / 'docs' / 'data' / 'ip-ranges.bin'
+RANGES_FILE = Path(os.getenv('IP_RANGES_FILE', str(DEFAULT_RANGES_FILE)))
+
+# Written by scripts/ip_index.py; keep the two in sync
+MAGIC = b'STRNG\x00\x01\x00'
+NONE = 0xFFFFFFFF
+_BITS = {4: 32, 6: 128}
+
+
+class RangeIndex:
+    """Memory-mapped sorted-range index of one service tags snapshot"""
+
+    def __init__(self, path: Path = RANGES_FILE):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:8] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{self.path} is not a service tags range file")
+        header_length, = struct.unpack_from('<I', self._map, 8)
+        header = json.loads(self._map[12:12 + header_length])
+
+        self.change_number = header.get('changeNumber')
+        self.cloud = header.get('cloud')
+        self.tracked_since = header.get('trackedSince')
+        self.tags: List[List[str]] = header['tags']
+        self.dates: List[str] = header['dates']
+
+        base = 12 + header_length
+        self._view = view = memoryview(self._map)
+        self._columns = {}
+        for name, (offset, typecode, count) in header['columns'].items():
+            column = view[base + offset:base + offset + count * struct.calcsize(typecode)].cast(typecode)
+            if sys.byteorder == 'big':
+                # The file is little-endian; only here are the columns copied
+                column = array(typecode, column)
+                column.byteswap()
+            self._columns[name] = column
+
+    @property
+    def ranges(self) -> int:
+        return len(self._columns['4.length']) + len(self._columns['6.length'])
+
+    def lookup(self, query: str) -> List[Dict]:
+        """Return every service tag covering an IPv4/IPv6 address or CIDR, most specific first.
+
+        Each match is {'service', 'region', 'system_service', 'prefix', 'first_seen'}.
+        For a CIDR only prefixes covering the whole range are returned. Raises
+        ValueError for anything that is not an address or prefix.
+        """
+        network = ipaddress.ip_network(query.strip(), strict=False)
+        family, bits = network.version, _BITS[network.version]
+        value, query_length = int(network.network_address), network.prefixlen
+
+        columns = self._columns
+        low = columns[f'{family}.lo']
+        high = columns.get(f'{family}.hi')
+        if high is None:
+            position = bisect_right(low, value) - 1
+        else:
+            # Ranges sharing the upper 64 bits are contiguous; search their lower halves
+            first = bisect_left(high, value >> 64)
+            last = bisect_right(high, value >> 64, first)
+            position = bisect_right(low, value & 0xFFFFFFFFFFFFFFFF, first, last) - 1
+
+        lengths, parents, entries = columns[f'{family}.length'], columns[f'{family}.parent'], columns[f'{family}.entries']
+        entry_tag, entry_date = columns['entry_tag'], columns['entry_date']
+        address_class = ipaddress.IPv4Address if family == 4 else ipaddress.IPv6Address
+        matches = []
+        while 0 <= position != NONE:
+            length = lengths[position]
+            start = (high[position] << 64 | low[position]) if high is not None else low[position]
+            # The candidate may be a sibling that ends before the query; its ancestors may still cover it
+            if length <= query_length and not (length and (value ^ start) >> (bits - length)):
+                prefix = f"{address_class(start)}/{length}"
+                for entry in range(entries[position], entries[position + 1]):
+                    name, region, system_service = self.tags[entry_tag[entry]]
+                    matches.append({
+                        'service': name,
+                        'region': region,
+                        'system_service': system_service,
+                        'prefix': prefix,
+                        'first_seen': self.dates[entry_date[entry]]
+                    })
+            position = parents[position]
+        return matches
+
+    def close(self):
+        """Release the columns and unmap the file"""
+        for column in self._columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self._columns = {}
+        self._view.release()
+        self._map.close()
+
+
+_shared_index: Optional[RangeIndex] = None
+_shared_lock = threading.Lock()
+
+
+def shared_range_index() -> RangeIndex:
+    """The process-wide RangeIndex, mapped on first use and shared by every request"""
+    global _shared_index
+    if _shared_index is None:
+        with _shared_lock:
+            if _shared_index is None:
+                _shared_index = RangeIndex()
+    return _shared_index
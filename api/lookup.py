@@ -0,0 +1,76 @@
+"""
+Serverless API endpoint for IP → service tag lookups
+Deploy on Vercel: /api/lookup
+
+GET  /api/lookup?ip=20.42.65.92&ip=2603:1000::/48   (or ?ip=a,b)
+POST /api/lookup  {"queries": ["20.42.65.92", "10.0.0.0/8", ...]}
+
+Answers from the memory-mapped range index (docs/data/ip-ranges.bin), mapped
+once per warm instance, so a batch of lookups costs microseconds each instead
+of a download of current.json.
+"""
+
+import json
+import os
+from urllib.parse import urlparse, parse_qs
+from api.http_utils import JSONRequestHandler
+from api.ip_ranges import shared_range_index
+
+LOOKUP_MAX_BATCH = int(os.getenv('LOOKUP_MAX_BATCH', '1000'))
+
+
+class handler(JSONRequestHandler):
+    allowed_methods = 'GET, POST, OPTIONS'
+    allowed_headers = 'Content-Type'
+
+    def do_GET(self):
+        """Handle GET request with ?ip= queries"""
+        params = parse_qs(urlparse(self.path).query)
+        queries = [query for value in params.get('ip', []) for query in value.split(',') if query.strip()]
+        self.send_lookup_response(queries)
+
+    def do_POST(self):
+        """Handle POST request with a batch of queries"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(content_length)
+            data = json.loads(body.decode('utf-8')) if body else {}
+        except (ValueError, UnicodeDecodeError):
+            self.send_error_response(400, "Invalid JSON")
+            return
+
+        queries = data.get('queries') if isinstance(data, dict) else None
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            self.send_error_response(400, "Body must be {\"queries\": [\"<ip or cidr>\", ...]}")
+            return
+        self.send_lookup_response(queries)
+
+    def send_lookup_response(self, queries):
+        """Look up every query and send one result per query, in order"""
+        if not queries:
+            self.send_error_response(400, "At least one IP address or CIDR is required")
+            return
+        if len(queries) > LOOKUP_MAX_BATCH:
+            self.send_error_response(413, f"At most {LOOKUP_MAX_BATCH} queries per request")
+            return
+
+        try:
+            index = shared_range_index()
+        except (OSError, ValueError) as e:
+            self.send_error_response(503, f"IP index unavailable: {e}")
+            return
+
+        results = []
+        for query in queries:
+            try:
+                results.append({'query': query, 'matches': index.lookup(query)})
+            except ValueError:
+                results.append({'query': query, 'error': 'Not an IP address or CIDR'})
+
+        self.send_json_response(200, {
+            'success': True,
+            'changeNumber': index.change_number,
+            'cloud': index.cloud,
+            'trackedSince': index.tracked_since,
+            'results': results
+        })
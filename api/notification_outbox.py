@@ -0,0 +1,194 @@
+"""
+Notification Outbox
+Durable, resumable delivery of change notifications through MongoDB.
+
+Every change set gets one job per recipient: {change_date, email} plus the
+recipient's subscription context, status, attempts and lease. change_date
+holds the change set's key (scripts/send_notifications.py: the date plus the
+publish's changeNumber), so same-day publishes do not share jobs. Enqueueing is
+idempotent (jobs are only inserted if missing), so a rerun after a crash only
+sends what is still pending.
+
+Workers claim jobs in batches under a lease. A claim atomically flips pending
+(or lease-expired) jobs to 'sending' and stamps them with the claim's token, so
+any number of processes can drain the same change set without two of them
+holding a job. A worker that dies mid-batch leaves its jobs to be reclaimed
+when the lease expires. Delivery is at-least-once: a job is resent only if its
+worker died between SendGrid accepting it and recording it as sent.
+
+Every SendGrid call counts as an attempt: the DeliveryEngine's own retries
+within a claim are added to the job's attempts and capped by what is left of
+OUTBOX_MAX_ATTEMPTS, so a recipient gets at most that many calls in total.
+
+Job status: pending -> sending -> sent | failed (pending again on retryable errors)
+Its indexes are declared in api/schema.py.
+"""
+
+import os
+import secrets
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+
+from pymongo import UpdateOne
+
+from .db_config import db_config
+from .delivery import is_retryable
+
+OUTBOX_COLLECTION = 'notification_outbox'
+LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', '600'))
+MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+
+# Recipient fields copied into a job (what the email is rendered from)
+RECIPIENT_FIELDS = ('email', 'subscriptionType', 'selectedServices', 'selectedRegions', 'ip_queries',
+                    'unsubscribe_token')
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class NotificationOutbox:
+    """Per-recipient notification jobs with leased, batched claims"""
+
+    def __init__(self, collection=None, lease_seconds: int = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.collection = collection if collection is not None else db_config.get_collection(OUTBOX_COLLECTION)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def enqueue(self, change_date: str, recipients: Iterable[Dict], chunk_size: int = 1000) -> int:
+        """
+        Add a pending job per recipient, leaving existing jobs of the change set untouched.
+
+        Returns:
+            Number of jobs inserted
+        """
+        inserted = 0
+        requests: List[UpdateOne] = []
+        now = datetime.utcnow()
+        for recipient in recipients:
+            job = {field: recipient.get(field) for field in RECIPIENT_FIELDS}
+            job.update({
+                'change_date': change_date,
+                'status': 'pending',
+                'attempts': 0,
+                'claim_token': None,
+                'lease_owner': None,
+                'lease_expires_at': None,
+                'created_at': now
+            })
+            requests.append(UpdateOne({'change_date': change_date, 'email': job['email']},
+                                      {'$setOnInsert': job}, upsert=True))
+            if len(requests) >= chunk_size:
+                inserted += self.collection.bulk_write(requests, ordered=False).upserted_count
+                requests = []
+        if requests:
+            inserted += self.collection.bulk_write(requests, ordered=False).upserted_count
+        return inserted
+
+    def claim(self, change_date: str, worker_id: str, limit: int) -> Dict:
+        """
+        Lease up to limit claimable jobs of a change set to worker_id.
+
+        The conditional update flips each job on its own, so concurrent claims
+        never share a job; the token then reads back exactly what this claim won.
+
+        Returns:
+            {'token': str, 'jobs': List[Dict]} (no jobs when the change set is drained)
+        """
+        now = datetime.utcnow()
+        # Jobs whose worker died on their last attempt will not be claimed again
+        self.collection.update_many(
+            {'change_date': change_date, 'status': 'sending', 'lease_expires_at': {'$lt': now},
+             'attempts': {'$gte': self.max_attempts}},
+            {'$set': {'status': 'failed', 'error': 'Lease expired on the last attempt', 'claim_token': None,
+                      'lease_owner': None, 'lease_expires_at': None, 'updated_at': now}}
+        )
+        claimable = {
+            'change_date': change_date,
+            'attempts': {'$lt': self.max_attempts},
+            '$or': [
+                {'status': 'pending'},
+                {'status': 'sending', 'lease_expires_at': {'$lt': now}}
+            ]
+        }
+        token = secrets.token_hex(16)
+        candidates = [doc['_id'] for doc in self.collection.find(claimable, {'_id': 1}).limit(limit)]
+        if candidates:
+            self.collection.update_many(
+                {**claimable, '_id': {'$in': candidates}},
+                {
+                    '$set': {
+                        'status': 'sending',
+                        'claim_token': token,
+                        'lease_owner': worker_id,
+                        'lease_expires_at': now + timedelta(seconds=self.lease_seconds),
+                        'claimed_at': now
+                    },
+                    '$inc': {'attempts': 1}
+                }
+            )
+        jobs = list(self.collection.find({'claim_token': token})) if candidates else []
+        return {'token': token, 'jobs': jobs}
+
+    def retries_left(self, claim: Dict) -> int:
+        """Retries a delivery of the claim's jobs may make within their remaining attempts"""
+        # The claim already counted the first call of every job
+        return max(0, min((self.max_attempts - job['attempts'] for job in claim['jobs']), default=0))
+
+    def complete(self, claim: Dict, results: Dict[str, Dict]):
+        """
+        Record the delivery results of a claim ({email: {status, attempts, status_code, error}}).
+
+        Retries made during delivery are added to each job's attempts. Sent
+        jobs are final. Failed jobs go back to pending if the error is
+        retryable and attempts remain, otherwise they are marked failed. Jobs
+        missing from results count as a retryable failure.
+        """
+        now = datetime.utcnow()
+        sent, retry, failed = {}, {}, {}
+        for job in claim['jobs']:
+            result = results.get(job['email']) or {'status': 'failed', 'status_code': None, 'error': 'Not attempted'}
+            retries = max(0, result.get('attempts', 1) - 1)
+            if result['status'] == 'sent':
+                sent.setdefault(retries, []).append(job['_id'])
+            elif is_retryable(result.get('status_code')) and job['attempts'] + retries < self.max_attempts:
+                retry.setdefault(retries, []).append(job['_id'])
+            else:
+                failed.setdefault((retries, result.get('status_code'), result.get('error')), []).append(job['_id'])
+
+        # Only touch jobs this claim still holds (its lease may have expired and been reclaimed)
+        held = {'claim_token': claim['token']}
+        release = {'claim_token': None, 'lease_owner': None, 'lease_expires_at': None, 'updated_at': now}
+        for retries, ids in sent.items():
+            self.collection.update_many({**held, '_id': {'$in': ids}},
+                                        {'$set': {**release, 'status': 'sent', 'sent_at': now},
+                                         '$inc': {'attempts': retries}})
+        for retries, ids in retry.items():
+            self.collection.update_many({**held, '_id': {'$in': ids}},
+                                        {'$set': {**release, 'status': 'pending'}, '$inc': {'attempts': retries}})
+        for (retries, status_code, error), ids in failed.items():
+            self.collection.update_many({**held, '_id': {'$in': ids}},
+                                        {'$set': {**release, 'status': 'failed', 'status_code': status_code,
+                                                  'error': error},
+                                         '$inc': {'attempts': retries}})
+
+    def release(self, claim: Dict):
+        """Hand a claim's jobs back without counting the attempt (nothing was sent)"""
+        self.collection.update_many(
+            {'claim_token': claim['token']},
+            {
+                '$set': {'status': 'pending', 'claim_token': None, 'lease_owner': None, 'lease_expires_at': None},
+                '$inc': {'attempts': -1}
+            }
+        )
+
+    def progress(self, change_date: str) -> Dict[str, int]:
+        """Job counts by status for a change set"""
+        counts = {'pending': 0, 'sending': 0, 'sent': 0, 'failed': 0}
+        for row in self.collection.aggregate([
+            {'$match': {'change_date': change_date}},
+            {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+        ]):
+            counts[row['_id']] = row['count']
+        return counts
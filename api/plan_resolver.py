@@ -0,0 +1,151 @@
+"""
+Plan Resolution
+One place to answer "what plan is this email on", with an in-process TTL cache.
+
+The plan of record is an active premium account, else the user's plan, else a
+legacy subscription record's, else free. It is resolved in a single
+aggregation and cached per email for PLAN_CACHE_TTL_SECONDS, in an LRU of at
+most PLAN_CACHE_SIZE entries.
+
+Writes that change a plan (UserManager.set_premium_active,
+upsert_premium_with_password, create_user) invalidate the email's entry. An
+invalidation also bumps the email's generation, so a lookup that was already
+in flight when the plan changed is returned but not cached. The cache lives
+per process, so another warm instance may serve a stale plan for up to the
+TTL.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from .db_config import db_config
+
+PLAN_CACHE_TTL_SECONDS = float(os.getenv('PLAN_CACHE_TTL_SECONDS', '60'))
+PLAN_CACHE_SIZE = int(os.getenv('PLAN_CACHE_SIZE', '1024'))
+
+FREE_PLAN = {'plan': 'free', 'plan_status': 'inactive', 'plan_expires_at': None}
+
+
+def _plan_of(rank: int, plan: str, status_field: str, status_default: str) -> Dict:
+    """Project a source document to a plan ranked by source precedence"""
+    return {'$project': {
+        '_id': 0,
+        'rank': {'$literal': rank},
+        'plan': {'$ifNull': ['$plan', plan]},
+        'plan_status': {'$ifNull': ['$' + status_field, status_default]},
+        'plan_expires_at': {'$ifNull': ['$plan_expires_at', None]}
+    }}
+
+
+def lookup_plan(email: str) -> Dict:
+    """Resolve an email's plan from the database in one round-trip (no cache)"""
+    candidates = db_config.get_collection('premium_accounts').aggregate([
+        {'$match': {'email': email, 'status': 'active'}},
+        _plan_of(0, 'premium', 'status', 'active'),
+        {'$unionWith': {'coll': 'users', 'pipeline': [
+            {'$match': {'email': email}},
+            {'$limit': 1},
+            _plan_of(1, 'free', 'plan_status', 'inactive')
+        ]}},
+        {'$unionWith': {'coll': 'subscriptions', 'pipeline': [
+            {'$match': {'email': email}},
+            {'$limit': 1},
+            _plan_of(2, 'free', 'plan_status', 'inactive')
+        ]}},
+        {'$sort': {'rank': 1}},
+        {'$limit': 1}
+    ])
+    for plan in candidates:
+        plan.pop('rank')
+        return plan
+    return dict(FREE_PLAN)
+
+
+class PlanResolver:
+    """Cached plan lookups with hit-rate counters"""
+
+    def __init__(self, ttl_seconds: float = PLAN_CACHE_TTL_SECONDS, max_entries: int = PLAN_CACHE_SIZE,
+                 lookup: Callable[[str], Dict] = lookup_plan, clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lookup = lookup
+        self.clock = clock
+        self._cache: 'OrderedDict[str, Tuple[float, Dict]]' = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by invalidate(); a lookup is cached only if its email's generation did not move
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def resolve(self, email: str) -> Dict:
+        """Plan info for an email ({plan, plan_status, plan_expires_at})"""
+        email = (email or '').strip().lower()
+        now = self.clock()
+        with self._lock:
+            entry = self._cache.get(email)
+            if entry and entry[0] > now:
+                self._cache.move_to_end(email)
+                self.hits += 1
+                return dict(entry[1])
+            self.misses += 1
+            generation = self._generation(email)
+
+        plan = self.lookup(email)
+
+        if self.ttl_seconds > 0 and self.max_entries > 0:
+            with self._lock:
+                if self._generation(email) != generation:
+                    # Invalidated during the lookup, which may have read the old plan
+                    return plan
+                self._cache[email] = (now + self.ttl_seconds, dict(plan))
+                self._cache.move_to_end(email)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+                    self.evictions += 1
+        return plan
+
+    def _generation(self, email: str) -> Tuple[int, int]:
+        return self._epoch, self._generations.get(email, 0)
+
+    def invalidate(self, email: Optional[str] = None):
+        """Forget one email's cached plan, or every plan if email is None"""
+        with self._lock:
+            if email is None:
+                self._cache.clear()
+                self._bump_epoch()
+            else:
+                email = (email or '').strip().lower()
+                self._cache.pop(email, None)
+                self._generations[email] = self._generations.get(email, 0) + 1
+                if len(self._generations) > max(self.max_entries, 1):
+                    # Keeps the counters bounded; in-flight lookups of every email skip the cache once
+                    self._bump_epoch()
+            self.invalidations += 1
+
+    def _bump_epoch(self):
+        self._generations.clear()
+        self._epoch += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'size': len(self._cache),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+# Shared by every request a warm instance serves
+plan_resolver = PlanResolver()
@@ -0,0 +1,76 @@
+"""
+MongoDB Connection Pool Metrics
+Counters fed by pymongo's connection pool (CMAP) events.
+
+Kept out of db_config so that importing the API package does not import
+pymongo; DatabaseConfig loads this module with the first client.
+"""
+
+import threading
+
+from pymongo import monitoring
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters fed by pymongo's CMAP events"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checked_out = 0
+        self.checkout_seconds = 0.0
+        self.pools_cleared = 0
+    
+    def _add(self, **deltas):
+        with self.lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+    
+    def connection_created(self, event):
+        self._add(connections_created=1)
+    
+    def connection_closed(self, event):
+        self._add(connections_closed=1)
+    
+    def connection_checked_out(self, event):
+        self._add(checkouts=1, checked_out=1, checkout_seconds=getattr(event, 'duration', None) or 0.0)
+    
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+    
+    def connection_check_out_failed(self, event):
+        self._add(checkout_failures=1)
+    
+    def pool_cleared(self, event):
+        self._add(pools_cleared=1)
+    
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_closed(self, event):
+        pass
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_check_out_started(self, event):
+        pass
+    
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'open_connections': self.connections_created - self.connections_closed,
+                'in_use': self.checked_out,
+                'connections_created': self.connections_created,
+                'connections_closed': self.connections_closed,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'avg_checkout_ms': round(self.checkout_seconds / self.checkouts * 1000, 3) if self.checkouts else None,
+                'pools_cleared': self.pools_cleared
+            }
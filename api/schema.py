@@ -0,0 +1,190 @@
+"""
+Database Schema
+Declares the indexes the application's queries rely on and applies them once
+per schema version.
+
+Handlers and managers never create indexes; scripts/migrate_db.py creates the
+declared set, verifies it and records SCHEMA_VERSION in the schema_metadata
+collection. Bump SCHEMA_VERSION whenever INDEXES changes, then run the script.
+
+Data that would violate a new unique index is repaired first: databases from
+before version 2 can hold several active subscriptions for one email, and
+migrate() keeps only the most recent of them before creating
+email_active_unique.
+"""
+
+from datetime import datetime
+from typing import Dict, List
+
+from pymongo import ASCENDING, IndexModel
+
+from .db_config import db_config
+
+SCHEMA_VERSION = 2
+METADATA_COLLECTION = 'schema_metadata'
+METADATA_ID = 'indexes'
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    'subscriptions': [
+        # Active-subscription checks, reactivation and the legacy plan lookup (email prefix)
+        IndexModel([('email', ASCENDING), ('status', ASCENDING)]),
+        # At most one active subscription per email (makes the subscribe upsert race-free)
+        IndexModel([('email', ASCENDING)], name='email_active_unique', unique=True,
+                   partialFilterExpression={'status': 'active'}),
+        # Unsubscribe by email link
+        IndexModel([('email', ASCENDING), ('unsubscribe_token', ASCENDING), ('status', ASCENDING)]),
+        IndexModel([('unsubscribe_token', ASCENDING)], unique=True),
+        # Unsubscribe by emailed verification link
+        IndexModel([('unsubscribe_verification_token', ASCENDING)], sparse=True),
+        # Active subscribers by type (notifier, listings)
+        IndexModel([('status', ASCENDING), ('subscriptionType', ASCENDING)])
+    ],
+    'users': [
+        IndexModel([('email', ASCENDING)], unique=True)
+    ],
+    'premium_accounts': [
+        IndexModel([('email', ASCENDING)], unique=True)
+    ],
+    'notification_outbox': [
+        # One job per (change set, recipient)
+        IndexModel([('change_date', ASCENDING), ('email', ASCENDING)], unique=True),
+        # Claims scan by change set, status and lease
+        IndexModel([('change_date', ASCENDING), ('status', ASCENDING), ('lease_expires_at', ASCENDING)]),
+        IndexModel([('claim_token', ASCENDING)], sparse=True)
+    ]
+}
+
+# Index options that must match for an existing index to count
+INDEX_OPTIONS = ('unique', 'sparse', 'partialFilterExpression')
+
+
+def _matches(model: IndexModel, existing: Dict) -> bool:
+    spec = model.document
+    if list(spec['key'].items()) != [tuple(key) for key in existing.get('key', [])]:
+        return False
+    return all(spec.get(option) == existing.get(option) for option in INDEX_OPTIONS)
+
+
+def _missing_indexes(db) -> Dict[str, List[str]]:
+    """Declared indexes (by name) that are absent or differ, per collection"""
+    missing = {}
+    for collection_name, models in INDEXES.items():
+        existing = list(db[collection_name].index_information().values())
+        absent = [model.document['name'] for model in models
+                  if not any(_matches(model, index) for index in existing)]
+        if absent:
+            missing[collection_name] = absent
+    return missing
+
+
+def schema_status(db=None) -> Dict:
+    """
+    Compare the database against the declared schema without changing it
+
+    Returns:
+        Dict with recorded and expected version and the missing indexes
+    """
+    db = db if db is not None else db_config.get_database()
+    metadata = db[METADATA_COLLECTION].find_one({'_id': METADATA_ID}) or {}
+    missing = _missing_indexes(db)
+    return {
+        'success': True,
+        'version': metadata.get('version'),
+        'expected_version': SCHEMA_VERSION,
+        'migrated_at': metadata.get('migrated_at'),
+        'missing': missing,
+        'up_to_date': metadata.get('version') == SCHEMA_VERSION and not missing
+    }
+
+
+def deduplicate_active_subscriptions(db) -> int:
+    """
+    Keep one active subscription per email so email_active_unique can be built
+
+    The most recently updated record stays active; the others are marked
+    unsubscribed.
+
+    Returns:
+        Number of subscriptions unsubscribed
+    """
+    subscriptions = db['subscriptions']
+    duplicates = subscriptions.aggregate([
+        {'$match': {'status': 'active'}},
+        {'$sort': {'updated_at': -1, 'created_at': -1, '_id': -1}},
+        {'$group': {'_id': '$email', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+
+    now = datetime.utcnow()
+    unsubscribed = 0
+    for duplicate in duplicates:
+        result = subscriptions.update_many(
+            {'_id': {'$in': duplicate['ids'][1:]}, 'status': 'active'},
+            {
+                '$set': {
+                    'status': 'unsubscribed',
+                    'unsubscribed_at': now,
+                    'updated_at': now,
+                    'unsubscribe_method': 'duplicate_cleanup'
+                }
+            }
+        )
+        unsubscribed += result.modified_count
+    return unsubscribed
+
+
+def migrate(db=None, force: bool = False) -> Dict:
+    """
+    Create the declared indexes, verify them and record SCHEMA_VERSION
+
+    Duplicate active subscriptions are resolved first (see
+    deduplicate_active_subscriptions). Does nothing when the recorded version
+    is current, unless force is set.
+
+    Returns:
+        Dict with success, version and what was done
+    """
+    db = db if db is not None else db_config.get_database()
+    metadata = db[METADATA_COLLECTION]
+    recorded = (metadata.find_one({'_id': METADATA_ID}) or {}).get('version')
+    if recorded == SCHEMA_VERSION and not force:
+        return {'success': True, 'version': recorded, 'migrated': False, 'created': {}}
+
+    try:
+        deduplicated = deduplicate_active_subscriptions(db)
+        created = {}
+        for collection_name, models in INDEXES.items():
+            # create_indexes is a no-op for indexes that already exist with the same spec
+            created[collection_name] = db[collection_name].create_indexes(models)
+
+        missing = _missing_indexes(db)
+        if missing:
+            return {
+                'success': False,
+                'error': 'Indexes missing after migration',
+                'missing': missing,
+                'version': recorded
+            }
+
+        metadata.update_one(
+            {'_id': METADATA_ID},
+            {
+                '$set': {
+                    'version': SCHEMA_VERSION,
+                    'indexes': {name: [model.document['name'] for model in models]
+                                for name, models in INDEXES.items()},
+                    'migrated_at': datetime.utcnow()
+                },
+                '$setOnInsert': {'created_at': datetime.utcnow()}
+            },
+            upsert=True
+        )
+        return {'success': True, 'version': SCHEMA_VERSION, 'previous_version': recorded,
+                'migrated': True, 'created': created, 'deduplicated': deduplicated}
+
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f'Database error: {str(e)}',
+            'version': recorded
+        }
@@ -6,11 +6,21 @@ Handles CRUD operations for email subscriptions in MongoDB Atlas.
 import secrets
 import hashlib
 from datetime import datetime
-from typing import Dict, List, Optional
-from pymongo.errors import DuplicateKeyError
+from typing import Dict, Iterator, List, Optional
 from .db_config import db_config
 from .user_manager import user_manager
 
+# Subscription fields a change notification is rendered from
+NOTIFICATION_PROJECTION = {
+    '_id': 0,
+    'email': 1,
+    'subscriptionType': 1,
+    'selectedServices': 1,
+    'selectedRegions': 1,
+    'ip_queries': 1,
+    'unsubscribe_token': 1
+}
+
 
 class SubscriptionManager:
     """Manage email subscriptions in MongoDB"""
@@ -42,6 +52,13 @@ class SubscriptionManager:
         """
         Create new subscription or reactivate existing unsubscribed one
         
+        One atomic upsert does both: it reactivates the email's unsubscribed
+        record if there is one and inserts a new record otherwise. An email
+        that is already active is rejected up front, before the plan checks;
+        the unique partial index on active emails (api/schema.py) also rejects
+        a second active subscription from concurrent signups once
+        scripts/migrate_db.py has created it.
+        
         Args:
             subscription_data: {
                 'email': str,
@@ -53,6 +70,10 @@ class SubscriptionManager:
         Returns:
             Dict with subscription details or error
         """
+        # pymongo is already loaded by the time a handler gets here (see db_config)
+        from pymongo import ReturnDocument
+        from pymongo.errors import DuplicateKeyError
+        
         try:
             email = subscription_data.get('email', '').lower().strip()
             
@@ -61,7 +82,7 @@ class SubscriptionManager:
 
             user_id = (subscription_data.get('user_id') or '').strip()
 
-            # Check if email already has an active subscription
+            # Check if email already has an active subscription (the only guard where the index is missing)
             if self.is_email_subscribed(email):
                 return {
                     'success': False,
@@ -104,99 +125,88 @@ class SubscriptionManager:
                         'code': 'MISSING_USER_ID'
                     }
             
-            # Check if there's an unsubscribed record to reactivate
-            existing = self.collection.find_one({
-                'email': email,
-                'status': 'unsubscribed'
-            })
+            now = datetime.utcnow()
+            new_id = self.generate_subscription_id()
+            inserting = {'$eq': [{'$ifNull': ['$id', None]}, None]}
+            
+            def keep(field, default):
+                """Existing value on reactivation, default on insert"""
+                return {'$ifNull': ['$' + field, {'$literal': default}]}
             
-            if existing:
-                # Reactivate existing subscription with updated preferences
-                result = self.collection.update_one(
-                    {'_id': existing['_id']},
+            # Pipeline update: user input is wrapped in $literal so it is never read as an expression
+            subscription = self.collection.find_one_and_update(
+                {'email': email, 'status': 'unsubscribed'},
+                [
                     {
                         '$set': {
                             'status': 'active',
-                            'subscriptionType': requested_type,
-                            'selectedServices': subscription_data.get('selectedServices', []),
-                            'selectedRegions': subscription_data.get('selectedRegions', []),
-                            'ip_queries': subscription_data.get('ip_queries', []),
-                            'user_id': user_id or existing.get('user_id'),
-                            'updated_at': datetime.utcnow(),
-                            'resubscribed_at': datetime.utcnow()
-                        },
-                        '$unset': {
-                            'unsubscribed_at': '',
-                            'unsubscribe_method': ''
+                            'subscriptionType': {'$literal': requested_type},
+                            'selectedServices': {'$literal': subscription_data.get('selectedServices', [])},
+                            'selectedRegions': {'$literal': subscription_data.get('selectedRegions', [])},
+                            'ip_queries': {'$literal': subscription_data.get('ip_queries', [])},
+                            'user_id': {'$literal': user_id} if user_id else keep('user_id', None),
+                            'updated_at': now,
+                            'resubscribed_at': {'$cond': [inserting, '$$REMOVE', now]},
+                            # Only set when the record is new
+                            'id': keep('id', new_id),
+                            'email_hash': keep('email_hash', self.hash_email(email)),  # For analytics without exposing emails
+                            'timestamp': keep('timestamp', now.isoformat()),
+                            'unsubscribe_token': keep('unsubscribe_token', self.generate_unsubscribe_token()),
+                            'created_at': keep('created_at', now),
+                            'plan': keep('plan', 'free'),
+                            'plan_status': keep('plan_status', 'inactive'),
+                            'plan_expires_at': keep('plan_expires_at', None),
+                            'plan_source': keep('plan_source', None),
+                            'provider_customer_id': keep('provider_customer_id', None),
+                            'provider_subscription_id': keep('provider_subscription_id', None),
+                            'unsubscribed_at': '$$REMOVE',
+                            'unsubscribe_method': '$$REMOVE'
                         }
                     }
-                )
-                
-                if result.modified_count > 0:
-                    return {
-                        'success': True,
-                        'subscription': {
-                            'id': existing['id'],
-                            'email': existing['email'],
-                            'unsubscribe_token': existing['unsubscribe_token'],
-                            'timestamp': datetime.utcnow().isoformat(),
-                            'reactivated': True
-                        }
-                    }
-            
-            # Create new subscription if no existing record
-            subscription = {
-                'id': self.generate_subscription_id(),
-                'email': email,
-                'email_hash': self.hash_email(email),  # For analytics without exposing emails
-                'subscriptionType': requested_type,
-                'selectedServices': subscription_data.get('selectedServices', []),
-                'selectedRegions': subscription_data.get('selectedRegions', []),
-                'ip_queries': subscription_data.get('ip_queries', []),
-                'user_id': subscription_data.get('user_id'),
-                'timestamp': datetime.utcnow().isoformat(),
-                'status': 'active',
-                'unsubscribe_token': self.generate_unsubscribe_token(),
-                'created_at': datetime.utcnow(),
-                'updated_at': datetime.utcnow(),
-                'plan': 'free',
-                'plan_status': 'inactive',
-                'plan_expires_at': None,
-                'plan_source': None,
-                'provider_customer_id': None,
-                'provider_subscription_id': None
-            }
-            
-            # Insert into database
-            result = self.collection.insert_one(subscription)
+                ],
+                upsert=True,
+                sort=[('updated_at', -1)],
+                return_document=ReturnDocument.AFTER
+            )
             
-            if result.inserted_id:
-                return {
-                    'success': True,
-                    'subscription': {
-                        'id': subscription['id'],
-                        'email': subscription['email'],
-                        'unsubscribe_token': subscription['unsubscribe_token'],
-                        'timestamp': subscription['timestamp']
-                    }
-                }
-            else:
+            if not subscription:
                 return {
                     'success': False,
                     'error': 'Failed to create subscription'
                 }
+            
+            result = {
+                'id': subscription['id'],
+                'email': subscription['email'],
+                'unsubscribe_token': subscription['unsubscribe_token'],
+                'timestamp': now.isoformat()
+            }
+            if subscription['id'] != new_id:
+                result['reactivated'] = True
+            return {
+                'success': True,
+                'subscription': result
+            }
                 
         except DuplicateKeyError:
+            # The unique index on active emails: a concurrent signup subscribed this email first
             return {
                 'success': False,
-                'error': 'Subscription already exists',
-                'code': 'DUPLICATE_KEY'
+                'error': 'Email already subscribed',
+                'code': 'DUPLICATE_EMAIL'
             }
         except Exception as e:
-            return {
-                'success': False,
-                'error': f'Database error: {str(e)}'
-            }
+            return self._database_error(e)
+    
+    @staticmethod
+    def _database_error(error: Exception) -> Dict:
+        """Failure result for a database error; an unreachable cluster is left to the handler"""
+        if db_config.is_unreachable(error):
+            raise error
+        return {
+            'success': False,
+            'error': f'Database error: {str(error)}'
+        }
     
     def is_email_subscribed(self, email: str) -> bool:
         """Check if email is already subscribed and active"""
@@ -204,25 +214,13 @@ class SubscriptionManager:
         existing = self.collection.find_one({
             'email': email,
             'status': 'active'
-        })
+        }, {'_id': 1})
         return existing is not None
 
     def get_plan(self, email: str) -> Dict:
         """Return plan info for an email (defaults to free)."""
-        email = email.lower().strip()
-        # Plan of record now stored on users collection
-        plan = user_manager.get_plan(email)
-        if plan:
-            return plan
-        # Fallback for legacy data
-        doc = self.collection.find_one({'email': email})
-        if not doc:
-            return {'plan': 'free', 'plan_status': 'inactive', 'plan_expires_at': None}
-        return {
-            'plan': doc.get('plan', 'free'),
-            'plan_status': doc.get('plan_status', 'inactive'),
-            'plan_expires_at': doc.get('plan_expires_at')
-        }
+        # Cached; one lookup across premium accounts, users and legacy subscription records on a miss
+        return user_manager.get_plan(email)
 
     def _plan_allows_filtered(self, plan: Dict) -> bool:
         if not plan:
@@ -294,10 +292,7 @@ class SubscriptionManager:
                 }
                 
         except Exception as e:
-            return {
-                'success': False,
-                'error': f'Database error: {str(e)}'
-            }
+            return self._database_error(e)
     
     def create_unsubscribe_verification(self, email: str) -> Dict:
         """
@@ -357,10 +352,7 @@ class SubscriptionManager:
                 }
                 
         except Exception as e:
-            return {
-                'success': False,
-                'error': f'Database error: {str(e)}'
-            }
+            return self._database_error(e)
     
     def verify_and_unsubscribe(self, email: str, verification_token: str) -> Dict:
         """
@@ -426,10 +418,7 @@ class SubscriptionManager:
                 }
                 
         except Exception as e:
-            return {
-                'success': False,
-                'error': f'Database error: {str(e)}'
-            }
+            return self._database_error(e)
     
     def get_active_subscriptions(self, filters: Dict = None) -> List[Dict]:
         """
@@ -447,6 +436,33 @@ class SubscriptionManager:
             query.update(filters)
         
         return list(self.collection.find(query).sort('created_at', -1))
+
+    def iter_active_subscriptions(self, filters: Dict = None, projection: Dict = None,
+                                  batch_size: int = 1000) -> Iterator[Dict]:
+        """
+        Stream active subscriptions, unsorted, a server batch at a time
+        
+        Served by the (status, subscriptionType) index; memory stays at one
+        batch however many subscriptions there are.
+        
+        Args:
+            filters: Optional filters (e.g., {'subscriptionType': 'filtered'})
+            projection: Fields to return (e.g., NOTIFICATION_PROJECTION); all if None
+            batch_size: Documents per server round-trip
+        
+        Yields:
+            Active subscription documents
+        """
+        query = {'status': 'active'}
+        
+        if filters:
+            query.update(filters)
+        
+        cursor = self.collection.find(query, projection).batch_size(batch_size)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
     
     def get_filtered_subscriptions(self, service_name: str = None, region: str = None) -> List[Dict]:
         # Deprecated: filtered subscription lookups are handled client-side using
@@ -4,13 +4,16 @@ Deploy on Vercel: /api/unsubscribe
 """
 
 import json
-from http.server import BaseHTTPRequestHandler
 from urllib.parse import parse_qs, urlparse
+from api.http_utils import JSONRequestHandler
 from api.db_config import db_config
 from api.subscription_manager import SubscriptionManager
 
 
-class handler(BaseHTTPRequestHandler):
+class handler(JSONRequestHandler):
+    allowed_methods = 'GET, POST, OPTIONS'
+    allowed_headers = 'Content-Type'
+
     def do_POST(self):
         """Handle POST request to unsubscribe"""
         try:
@@ -83,9 +86,7 @@ class handler(BaseHTTPRequestHandler):
         except json.JSONDecodeError:
             self.send_error_response(400, "Invalid JSON")
         except Exception as e:
-            self.send_error_response(500, str(e))
-        finally:
-            db_config.close()
+            self.send_exception_response(e)
     
     def do_GET(self):
         """Handle GET request to verify subscription"""
@@ -127,45 +128,4 @@ class handler(BaseHTTPRequestHandler):
                 })
             
         except Exception as e:
-            self.send_error_response(500, str(e))
-        finally:
-            db_config.close()
-    
-    def do_OPTIONS(self):
-        """Handle CORS preflight request"""
-        self.send_response(200)
-        self.send_cors_headers()
-        self.end_headers()
-    
-    def send_json_response(self, status_code, data):
-        """Send JSON response with CORS headers"""
-        self.send_response(status_code)
-        self.send_cors_headers()
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
-    
-    def send_error_response(self, status_code, message):
-        """Send error response"""
-        self.send_json_response(status_code, {
-            'success': False,
-            'error': message
-        })
-    
-    def send_cors_headers(self):
-        """Send CORS headers for GitHub Pages"""
-        origin = self.headers.get('Origin', '*')
-        allowed_origins = [
-            'https://eliaquimbrandao.github.io',
-            'http://localhost:8000',
-            'http://127.0.0.1:8000'
-        ]
-        
-        if origin in allowed_origins or origin == '*':
-            self.send_header('Access-Control-Allow-Origin', origin)
-        else:
-            self.send_header('Access-Control-Allow-Origin', allowed_origins[0])
-        
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.send_header('Access-Control-Max-Age', '86400')
+            self.send_exception_response(e)
@@ -6,12 +6,15 @@ Otherwise we provide a waitlist mailto so users have a path forward.
 
 import json
 import os
-from http.server import BaseHTTPRequestHandler
+from .http_utils import JSONRequestHandler
 from .auth_utils import create_action_token
-from .email_service import EmailService
+from .email_service import shared_email_service
 
 
-class handler(BaseHTTPRequestHandler):
+class handler(JSONRequestHandler):
+    allowed_methods = 'POST, OPTIONS'
+    allowed_headers = 'Content-Type'
+
     def do_POST(self):
         try:
             content_length = int(self.headers.get('Content-Length', 0))
@@ -25,7 +28,7 @@ class handler(BaseHTTPRequestHandler):
             token = create_action_token(email, 'upgrade')
             link = f"{app_url.rstrip('/')}/upgrade-confirm.html?token={token}"
 
-            email_service = EmailService()
+            email_service = shared_email_service()
             email_service.send_upgrade_magic_link(email, link)
 
             return self.send_json_response(200, {
@@ -33,33 +36,4 @@ class handler(BaseHTTPRequestHandler):
                 'message': 'Check your email for the upgrade link to set a password and activate premium.'
             })
         except Exception as e:
-            return self.send_json_response(500, {'success': False, 'error': str(e)})
-
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_cors_headers()
-        self.end_headers()
-
-    def send_json_response(self, status_code, data):
-        self.send_response(status_code)
-        self.send_cors_headers()
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
-
-    def send_cors_headers(self):
-        origin = self.headers.get('Origin', '*')
-        allowed_origins = [
-            'https://eliaquimbrandao.github.io',
-            'http://localhost:8000',
-            'http://127.0.0.1:8000',
-            'http://localhost:3000',
-            'http://127.0.0.1:3000'
-        ]
-        if origin in allowed_origins or origin == '*':
-            self.send_header('Access-Control-Allow-Origin', origin)
-        else:
-            self.send_header('Access-Control-Allow-Origin', allowed_origins[0])
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.send_header('Access-Control-Max-Age', '86400')
+            return self.send_exception_response(e)
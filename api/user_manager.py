@@ -3,25 +3,29 @@ User management for authentication and plan tracking.
 """
 from datetime import datetime
 from typing import Optional, Dict
-from bson.objectid import ObjectId
-from pymongo.errors import DuplicateKeyError
 
 from .db_config import db_config
 from .auth_utils import hash_password, verify_password
+from .plan_resolver import plan_resolver
+
+
+def _error_result(error: Exception) -> Dict:
+    """Failure result for a database error; an unreachable cluster is left to the handler"""
+    if db_config.is_unreachable(error):
+        raise error
+    return {"success": False, "error": str(error)}
 
 
 class UserManager:
-    def __init__(self):
-        self.collection = db_config.get_collection('users')
-        self.premium_collection = db_config.get_collection('premium_accounts')
-        self.ensure_indexes()
+    # Nothing touches the database (or imports pymongo) until first use, so importing this module is free.
+    # Indexes (unique email on both collections) are created by scripts/migrate_db.py.
+    @property
+    def collection(self):
+        return db_config.get_collection('users')
 
-    def ensure_indexes(self):
-        try:
-            self.collection.create_index('email', unique=True)
-            self.premium_collection.create_index('email', unique=True)
-        except Exception:
-            pass
+    @property
+    def premium_collection(self):
+        return db_config.get_collection('premium_accounts')
 
     def create_user(self, email: str, password: str) -> Dict:
         email_norm = (email or '').strip().lower()
@@ -29,6 +33,7 @@ class UserManager:
             return {"success": False, "error": "Email is required"}
         if not password:
             return {"success": False, "error": "Password is required"}
+        from pymongo.errors import DuplicateKeyError
         try:
             user = {
                 "email": email_norm,
@@ -41,11 +46,12 @@ class UserManager:
             }
             res = self.collection.insert_one(user)
             user["_id"] = res.inserted_id
+            plan_resolver.invalidate(email_norm)
             return {"success": True, "user": user}
         except DuplicateKeyError:
             return {"success": False, "error": "Email already exists", "code": "DUPLICATE"}
         except Exception as e:
-            return {"success": False, "error": str(e)}
+            return _error_result(e)
 
     def authenticate(self, email: str, password: str) -> Dict:
         email_norm = (email or '').strip().lower()
@@ -59,6 +65,7 @@ class UserManager:
         return {"success": True, "user": user}
 
     def get_user(self, user_id: str) -> Optional[Dict]:
+        from bson.objectid import ObjectId
         try:
             return self.collection.find_one({"_id": ObjectId(user_id)})
         except Exception:
@@ -68,22 +75,11 @@ class UserManager:
         return self.collection.find_one({"email": (email or '').strip().lower()})
 
     def get_plan(self, email: str) -> Dict:
-        email_norm = (email or '').strip().lower()
-        premium = self.premium_collection.find_one({"email": email_norm})
-        if premium and premium.get("status", "inactive") == "active":
-            return {
-                "plan": premium.get("plan", "premium"),
-                "plan_status": premium.get("status", "active"),
-                "plan_expires_at": premium.get("plan_expires_at"),
-            }
-        user = self.get_by_email(email_norm)
-        if not user:
-            return {"plan": "free", "plan_status": "inactive", "plan_expires_at": None}
-        return {
-            "plan": user.get("plan", "free"),
-            "plan_status": user.get("plan_status", "inactive"),
-            "plan_expires_at": user.get("plan_expires_at"),
-        }
+        """
+        Plan of record: an active premium account, else the user's plan, else a
+        legacy subscription record's, else free. Served from the shared plan cache.
+        """
+        return plan_resolver.resolve(email)
 
     def upsert_premium_with_password(self, email: str, password: str) -> Dict:
         """
@@ -134,7 +130,10 @@ class UserManager:
             )
             return {"success": True, "user": user}
         except Exception as e:
-            return {"success": False, "error": str(e)}
+            return _error_result(e)
+        finally:
+            # Even a partial write may have changed the plan
+            plan_resolver.invalidate(email_norm)
 
     def set_premium_active(self, email: str, status: str = "active", expires_at=None) -> Dict:
         email_norm = (email or '').strip().lower()
@@ -158,7 +157,9 @@ class UserManager:
             )
             return {"success": True, "premium": doc}
         except Exception as e:
-            return {"success": False, "error": str(e)}
+            return _error_result(e)
+        finally:
+            plan_resolver.invalidate(email_norm)
 
 
 user_manager = UserManager()
@@ -1023,14 +1023,37 @@ class AzureServiceTagsDashboard {
 
             const timelineData = [];
 
+            // The history chain index lists the changeNumber of every recorded date in one file
+            const chainChangeNumbers = new Map();
+            try {
+                const chainResponse = await fetch('data/chain/index.json');
+                if (chainResponse.ok) {
+                    const chainIndex = await chainResponse.json();
+                    (chainIndex.entries || []).forEach(entry => chainChangeNumbers.set(entry.date, entry.changeNumber));
+                }
+            } catch (err) {
+                console.log('History chain index not available, falling back to snapshots');
+            }
+
             // Load historical files with Microsoft metadata
             for (const fileInfo of manifest.files) {
                 try {
-                    const historyResponse = await fetch(`data/history/${fileInfo.date}.json`);
+                    let historyData = null;
+                    if (chainChangeNumbers.has(fileInfo.date)) {
+                        historyData = { changeNumber: chainChangeNumbers.get(fileInfo.date) };
+                    } else {
+                        // Older dates may only exist as snapshot manifests or full history copies
+                        let historyResponse = await fetch(`data/store/snapshots/${fileInfo.date}.json`);
+                        if (!historyResponse.ok) {
+                            historyResponse = await fetch(`data/history/${fileInfo.date}.json`);
+                        }
+                        if (historyResponse.ok) {
+                            historyData = await historyResponse.json();
+                        }
+                    }
                     const changesResponse = await fetch(`data/changes/${fileInfo.date}-changes.json`);
 
-                    if (historyResponse.ok) {
-                        const historyData = await historyResponse.json();
+                    if (historyData) {
                         if (historyData.changeNumber) {
                             const item = {
                                 date: fileInfo.date,
@@ -14,14 +14,26 @@ import json
 import logging
 import os
 import re
+import sys
 import requests
 import hashlib
 import time
 import argparse
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+from prefix_diff import diff_prefixes
+from snapshot_store import SnapshotStore, calculate_tag_hash
+from history_chain import HistoryChain, build_tag_change
+from ip_index import IPIndex
+from run_metrics import METRICS_FILE, RunMetrics, write_prometheus_textfile
+from tag_stream import (CHUNK_SIZE, ServiceTagsReader, ServiceTagsWriter, index_service_tags,
+                        load_service_tags, read_header)
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -34,17 +46,126 @@ MAX_RETRIES = 3
 RETRY_DELAY = 2
 USER_AGENT = "Azure-Service-Tags-Tracker/1.0"
 
-def download_latest_json() -> Tuple[Dict, Dict]:
+# Microsoft publishes one Service Tags file per cloud, each behind its own confirmation page.
+# Each URL can be overridden (e.g. SERVICE_TAGS_URL_AZUREGOVERNMENT) to point at a local stand-in.
+CLOUDS = {
+    'Public': os.getenv('SERVICE_TAGS_URL_PUBLIC', AZURE_PUBLIC_IP_JSON_URL),
+    'AzureGovernment': os.getenv('SERVICE_TAGS_URL_AZUREGOVERNMENT',
+                                 "https://www.microsoft.com/en-us/download/confirmation.aspx?id=57063"),
+    'AzureChina': os.getenv('SERVICE_TAGS_URL_AZURECHINA',
+                            "https://www.microsoft.com/en-us/download/confirmation.aspx?id=57062"),
+}
+MAX_CLOUD_WORKERS = int(os.getenv('SERVICE_TAGS_CLOUD_WORKERS', '3'))
+
+# Optional Prometheus textfile (node_exporter textfile collector) with the per-phase run metrics
+PROMETHEUS_TEXTFILE = os.getenv('SERVICE_TAGS_PROMETHEUS_TEXTFILE')
+
+# Dashboard data (Public cloud); other clouds live under DATA_DIR/clouds/<cloud>/
+DATA_DIR = Path('docs/data')
+
+# Local download cache (kept out of git, restored between CI runs by actions/cache)
+CACHE_DIR = Path(os.getenv('SERVICE_TAGS_CACHE_DIR', '.cache/service-tags'))
+
+def cloud_paths(cloud: str) -> Tuple[Path, Path]:
+    """Return (data_dir, cache_dir) for a cloud.
+    Public keeps the original docs/data layout the dashboard reads."""
+    if cloud == 'Public':
+        return DATA_DIR, CACHE_DIR
+    return DATA_DIR / 'clouds' / cloud, CACHE_DIR / 'clouds' / cloud
+
+def _cached_body_path(json_url: str, cache_dir: Path = CACHE_DIR) -> Path:
+    """Return the cache file used for the body of a given JSON URL."""
+    return cache_dir / f"{hashlib.sha256(json_url.encode('utf-8')).hexdigest()[:16]}.json"
+
+def load_download_cache(cache_dir: Path = CACHE_DIR) -> Dict:
+    """Load the download cache index (JSON URL -> ETag, Last-Modified, changeNumber)."""
+    index_file = cache_dir / 'index.json'
+    if index_file.exists():
+        try:
+            with open(index_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.warning(f"Could not read download cache, ignoring it: {e}")
+    return {}
+
+def stream_body_to_cache(response: requests.Response, json_url: str, cache_dir: Path = CACHE_DIR) -> Path:
+    """Write a streamed download to the cache file chunk by chunk and return its path."""
+    body_path = _cached_body_path(json_url, cache_dir)
+    body_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = body_path.with_suffix('.part')
+    with open(part_path, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            f.write(chunk)
+    os.replace(part_path, body_path)
+    return body_path
+
+def save_download_cache(json_url: str, entry: Dict, cache_dir: Path = CACHE_DIR):
+    """Record the validators of a cached body, dropping entries for older URLs."""
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Microsoft publishes a new URL per release, so only the latest one is worth keeping
+        for stale_url in load_download_cache(cache_dir):
+            if stale_url != json_url:
+                _cached_body_path(stale_url, cache_dir).unlink(missing_ok=True)
+
+        with open(cache_dir / 'index.json', 'w') as f:
+            json.dump({json_url: entry}, f, indent=2)
+    except OSError as e:
+        logging.warning(f"Could not update download cache: {e}")
+
+def load_last_change_number(data_dir: Path = DATA_DIR) -> Optional[int]:
+    """Return the top-level changeNumber of the last processed publish, if known."""
+    summary_file = data_dir / 'summary.json'
+    if summary_file.exists():
+        try:
+            with open(summary_file, 'r') as f:
+                return json.load(f).get('change_number')
+        except Exception as e:
+            logging.warning(f"Could not read last changeNumber: {e}")
+    return None
+
+def write_checked_marker(metadata: Dict, status: str, data_dir: Path = DATA_DIR):
+    """Record when Microsoft was last checked, without touching any other data file."""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    marker = {
+        'checked_at': datetime.now(timezone.utc).isoformat(),
+        'status': status,
+        'change_number': metadata.get('change_number'),
+        'version': metadata.get('version'),
+        'date_published': metadata.get('date_published'),
+        'json_url': metadata.get('json_url')
+    }
+    marker_file = data_dir / 'last-checked.json'
+    with open(marker_file, 'w') as f:
+        json.dump(marker, f, indent=2)
+    logging.info(f"Saved {marker_file}")
+
+def download_latest_json(known_change_number: Optional[int] = None, use_cache: bool = True,
+                         confirmation_url: str = AZURE_PUBLIC_IP_JSON_URL,
+                         cache_dir: Path = CACHE_DIR,
+                         metrics: Optional[RunMetrics] = None) -> Tuple[Optional[Path], Dict]:
     """Download the latest Azure Service Tags JSON with retry logic.
-    Returns: (json_data, metadata) where metadata contains version and published date"""
+
+    The body is streamed into the local download cache and never parsed as a
+    whole; use tag_stream to read it. The request is revalidated with
+    ETag/If-Modified-Since against that cache. confirmation_url selects the
+    cloud (see CLOUDS) and cache_dir keeps each cloud's cache separate. When known_change_number is given
+    and the publish still carries that changeNumber, metadata['unchanged'] is set;
+    if the server also answered 304 Not Modified, json_path is None.
+
+    Returns: (json_path, metadata) where metadata contains version, published date,
+    json_url, change_number and cache_status"""
+    metrics = metrics or RunMetrics(trace_memory=False)
     session = requests.Session()
     session.headers.update({'User-Agent': USER_AGENT})
     
     for attempt in range(MAX_RETRIES):
         try:
             logging.info(f"Downloading metadata page (attempt {attempt + 1}/{MAX_RETRIES})...")
-            r = session.get(AZURE_PUBLIC_IP_JSON_URL, timeout=60)
-            r.raise_for_status()
+            with metrics.phase('fetch_metadata'):
+                r = session.get(confirmation_url, timeout=60)
+                r.raise_for_status()
             
             # Extract metadata from the confirmation page
             metadata = {}
@@ -79,7 +200,7 @@ def download_latest_json() -> Tuple[Dict, Dict]:
             
             # Extract metadata from filename as fallback (e.g., ServiceTags_Public_20251020.json)
             if not metadata.get('version'):
-                filename_match = re.search(r'ServiceTags_Public_(\d{8})\.json', json_url, re.IGNORECASE)
+                filename_match = re.search(r'ServiceTags_[A-Za-z]+_(\d{8})\.json', json_url, re.IGNORECASE)
                 if filename_match:
                     date_str = filename_match.group(1)  # e.g., "20251020"
                     # Convert YYYYMMDD to YYYY.MM.DD format for version
@@ -93,18 +214,58 @@ def download_latest_json() -> Tuple[Dict, Dict]:
                         metadata['date_published'] = date_published_from_filename
                         logging.info(f"Extracted date published from filename: {metadata['date_published']}")
             
-            r2 = session.get(json_url, timeout=120)
-            r2.raise_for_status()
+            metadata['json_url'] = json_url
             
-            data = r2.json()
-            if not data or not isinstance(data, dict):
-                raise ValueError("Downloaded JSON is empty or invalid.")
+            # Revalidate against the cached copy instead of always pulling the full body
+            cache_entry = load_download_cache(cache_dir).get(json_url) if use_cache else None
+            cached_body = _cached_body_path(json_url, cache_dir)
+            conditional_headers = {}
+            if cache_entry and cached_body.exists():
+                if cache_entry.get('etag'):
+                    conditional_headers['If-None-Match'] = cache_entry['etag']
+                if cache_entry.get('last_modified'):
+                    conditional_headers['If-Modified-Since'] = cache_entry['last_modified']
             
-            if "values" not in data:
-                raise ValueError("JSON missing 'values' key.")
+            with metrics.phase('download'):
+                r2 = session.get(json_url, timeout=120, headers=conditional_headers, stream=True)
+                
+                if r2.status_code == 304 and conditional_headers:
+                    r2.close()
+                    metadata['cache_status'] = 'not_modified'
+                    metadata['change_number'] = cache_entry.get('change_number')
+                    logging.info("JSON not modified since last download (cache hit)")
+                    
+                    if known_change_number is not None and metadata['change_number'] == known_change_number:
+                        metadata['unchanged'] = True
+                        return None, metadata
+                    
+                    json_path = cached_body
+                else:
+                    r2.raise_for_status()
+                    metadata['cache_status'] = 'downloaded'
+                    # Stream to disk instead of holding the body and a parsed copy in memory
+                    json_path = stream_body_to_cache(r2, json_url, cache_dir)
+                    metrics.count('bytes_downloaded', json_path.stat().st_size)
             
-            logging.info(f"Successfully downloaded JSON with {len(data.get('values', []))} tags.")
-            return data, metadata
+            # Only the fields before "values" are parsed here; raises if "values" is missing
+            with metrics.phase('parse_header'):
+                header = read_header(json_path)
+            
+            metadata['change_number'] = header.get('changeNumber')
+            if metadata['cache_status'] == 'downloaded' and use_cache:
+                save_download_cache(json_url, {
+                    'etag': r2.headers.get('ETag'),
+                    'last_modified': r2.headers.get('Last-Modified'),
+                    'change_number': metadata['change_number'],
+                    'downloaded_at': datetime.now(timezone.utc).isoformat()
+                }, cache_dir)
+            
+            if known_change_number is not None and metadata['change_number'] == known_change_number:
+                metadata['unchanged'] = True
+            
+            logging.info(f"Successfully downloaded JSON ({json_path.stat().st_size} bytes, "
+                         f"changeNumber {metadata['change_number']}, {metadata['cache_status']}).")
+            return json_path, metadata
             
         except (requests.RequestException, ValueError, RuntimeError) as e:
             logging.error(f"Attempt {attempt + 1} failed: {e}")
@@ -120,24 +281,90 @@ def calculate_data_hash(data: Dict) -> str:
     json_str = json.dumps(data, sort_keys=True)
     return hashlib.sha256(json_str.encode('utf-8')).hexdigest()
 
-def load_previous_data() -> Optional[Dict]:
-    """Load the previous week's data for comparison."""
-    current_file = Path('docs/data/current.json')
+def is_tag_unchanged(old_service: Dict, new_service: Dict) -> bool:
+    """Return True when a tag can be skipped without diffing its prefixes.
+    
+    Microsoft bumps properties.changeNumber whenever a tag changes, so an equal
+    changeNumber means the tag is unchanged and it is not hashed. Only tags whose
+    changeNumber moved (or that have none) are compared by content hash, so a
+    bump without a change is skipped as well."""
+    if _same_change_number(old_service.get('properties', {}).get('changeNumber'), new_service):
+        return True
+    return calculate_tag_hash(old_service) == calculate_tag_hash(new_service)
+
+def _same_change_number(old_change_number: Optional[int], new_service: Dict) -> bool:
+    return old_change_number is not None and old_change_number == new_service.get('properties', {}).get('changeNumber')
+
+def locate_previous_data(data_dir: Path = DATA_DIR, cache_dir: Path = CACHE_DIR) -> Optional[Path]:
+    """Return the file holding the previous week's data, for streaming comparison.
+    Falls back to reconstructing the latest state from the history chain (into the
+    download cache) when current.json is missing."""
+    current_file = data_dir / 'current.json'
     if current_file.exists():
+        return current_file
+    
+    chain = HistoryChain(data_dir / 'chain', SnapshotStore(data_dir / 'store'))
+    dates = chain.list_dates()
+    if dates:
         try:
-            with open(current_file, 'r') as f:
-                return json.load(f)
+            logging.info(f"Reconstructing previous data from history chain ({dates[-1]})")
+            previous_file = cache_dir / 'previous.json'
+            previous_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(previous_file, 'w') as f:
+                json.dump(chain.reconstruct(dates[-1]), f)
+            return previous_file
         except Exception as e:
-            logging.warning(f"Could not load previous data: {e}")
+            logging.warning(f"Could not reconstruct history for {dates[-1]}: {e}")
     return None
 
-def detect_changes(old_data: Optional[Dict], new_data: Dict) -> List[Dict]:
-    """Detect changes between old and new data."""
+def _service_added_record(service: Dict) -> Dict:
+    return {
+        'type': 'service_added',
+        'service': service['name'],
+        'ip_count': len(service.get('properties', {}).get('addressPrefixes', [])),
+        'region': service.get('properties', {}).get('region'),
+        'system_service': service.get('properties', {}).get('systemService')
+    }
+
+def _ip_change_record(old_service: Dict, new_service: Dict) -> Optional[Dict]:
+    # Check for IP prefix changes (integer-encoded, see prefix_diff.py)
+    added_prefixes, removed_prefixes = diff_prefixes(
+        old_service.get('properties', {}).get('addressPrefixes', []),
+        new_service.get('properties', {}).get('addressPrefixes', [])
+    )
+    if not added_prefixes and not removed_prefixes:
+        return None
+    return {
+        'type': 'ip_changes',
+        'service': new_service['name'],
+        'added_prefixes': added_prefixes,
+        'removed_prefixes': removed_prefixes,
+        'added_count': len(added_prefixes),
+        'removed_count': len(removed_prefixes),
+        'region': new_service.get('properties', {}).get('region'),
+        'system_service': new_service.get('properties', {}).get('systemService')
+    }
+
+def _service_removed_record(service_name: str, region: Optional[str], system_service: Optional[str]) -> Dict:
+    return {
+        'type': 'service_removed',
+        'service': service_name,
+        'region': region,
+        'system_service': system_service
+    }
+
+def detect_changes(old_data: Optional[Dict], new_data: Dict, stats: Optional[Dict] = None) -> List[Dict]:
+    """Detect changes between old and new data.
+    
+    Tags whose changeNumber and content are unchanged are skipped without building
+    prefix sets. If a stats dict is given, it is filled with tags_skipped/tags_diffed."""
     if not old_data:
         logging.info("No previous data found - this is the first run")
         return []
     
     changes = []
+    tags_skipped = 0
+    tags_diffed = 0
     old_services = {v['name']: v for v in old_data.get('values', [])}
     new_services = {v['name']: v for v in new_data.get('values', [])}
     
@@ -146,54 +373,198 @@ def detect_changes(old_data: Optional[Dict], new_data: Dict) -> List[Dict]:
         
         if not old_service:
             # New service added
-            changes.append({
-                'type': 'service_added',
-                'service': service_name,
-                'ip_count': len(new_service.get('properties', {}).get('addressPrefixes', [])),
-                'region': new_service.get('properties', {}).get('region'),
-                'system_service': new_service.get('properties', {}).get('systemService')
-            })
+            changes.append(_service_added_record(new_service))
             continue
         
-        # Check for IP prefix changes
-        old_prefixes = set(old_service.get('properties', {}).get('addressPrefixes', []))
-        new_prefixes = set(new_service.get('properties', {}).get('addressPrefixes', []))
-        
-        added_prefixes = new_prefixes - old_prefixes
-        removed_prefixes = old_prefixes - new_prefixes
+        if is_tag_unchanged(old_service, new_service):
+            tags_skipped += 1
+            continue
+        tags_diffed += 1
         
-        if added_prefixes or removed_prefixes:
-            changes.append({
-                'type': 'ip_changes',
-                'service': service_name,
-                'added_prefixes': sorted(list(added_prefixes)),
-                'removed_prefixes': sorted(list(removed_prefixes)),
-                'added_count': len(added_prefixes),
-                'removed_count': len(removed_prefixes),
-                'region': new_service.get('properties', {}).get('region'),
-                'system_service': new_service.get('properties', {}).get('systemService')
-            })
+        record = _ip_change_record(old_service, new_service)
+        if record:
+            changes.append(record)
     
     # Check for removed services
-    for service_name in old_services:
+    for service_name, old_service in old_services.items():
         if service_name not in new_services:
-            changes.append({
-                'type': 'service_removed',
-                'service': service_name,
-                'region': old_services[service_name].get('properties', {}).get('region'),
-                'system_service': old_services[service_name].get('properties', {}).get('systemService')
-            })
-    
-    logging.info(f"Detected {len(changes)} changes")
+            properties = old_service.get('properties', {})
+            changes.append(_service_removed_record(service_name, properties.get('region'),
+                                                   properties.get('systemService')))
+    
+    if stats is not None:
+        stats['tags_skipped'] = tags_skipped
+        stats['tags_diffed'] = tags_diffed
+    
+    logging.info(f"Detected {len(changes)} changes ({tags_diffed} tags diffed, {tags_skipped} unchanged tags skipped)")
     return changes
 
-def generate_summary_stats(data: Dict, changes: List[Dict]) -> Dict:
-    """Generate summary statistics for the dashboard."""
-    total_services = len(data.get('values', []))
-    total_ip_ranges = sum(
-        len(service.get('properties', {}).get('addressPrefixes', []))
-        for service in data.get('values', [])
-    )
+def ingest_service_tags(json_path: Path, previous_path: Optional[Path], today: str,
+                       diff_stats: Optional[Dict] = None, data_dir: Path = DATA_DIR,
+                       metrics: Optional[RunMetrics] = None) -> Tuple[List[Dict], Dict]:
+    """Stream a downloaded Service Tags file through every stage, one tag at a time.
+    
+    The previous file is first reduced to a {name: changeNumber} index. A single pass
+    over the new file then writes current.json, feeds the IP index and (when due) the
+    snapshot store, and sorts tags into unchanged/changed/added by changeNumber, as
+    is_tag_unchanged does. A second pass over the previous file loads only the tags
+    whose changeNumber moved, drops those whose content hash did not, and diffs the
+    prefixes of the rest. Memory is bounded by the size of the change, not of either
+    document.
+    
+    Returns (changes, totals) where totals holds change_number, total_services and
+    total_ip_ranges for generate_summary_stats."""
+    metrics = metrics or RunMetrics(trace_memory=False)
+    old_header, old_index = {}, None
+    if previous_path:
+        try:
+            with metrics.phase('parse_previous'):
+                old_header, old_index = index_service_tags(previous_path)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load previous data: {e}")
+    if old_index is None:
+        logging.info("No previous data found - this is the first run")
+    
+    chain = HistoryChain(data_dir / 'chain', SnapshotStore(data_dir / 'store'))
+    checkpoint_tags = [] if chain.checkpoint_due(today) else None
+    ip_index = IPIndex()
+    totals = {'total_services': 0, 'total_ip_ranges': 0}
+    order = []
+    pending = []  # change records in publish order; a tag name stands for a changed tag
+    added, changed = {}, {}
+    tags_skipped = 0
+    new_objects = 0
+    
+    data_dir.mkdir(parents=True, exist_ok=True)
+    current_tmp = data_dir / 'current.json.tmp'
+    # Parse and classify each tag while writing current.json.tmp and feeding the IP index
+    with metrics.phase('parse_and_classify'):
+        with open(json_path, 'r', encoding='utf-8-sig') as src, open(current_tmp, 'w') as dst:
+            reader = ServiceTagsReader(src)
+            leading = dict(reader.read_header())
+            writer = ServiceTagsWriter(dst)
+            writer.begin(leading)
+            for service in reader:
+                name = service['name']
+                writer.write(service)
+                ip_index.add(service)
+                order.append(name)
+                totals['total_services'] += 1
+                totals['total_ip_ranges'] += len(service.get('properties', {}).get('addressPrefixes', []))
+                
+                if checkpoint_tags is not None:
+                    tag_hash = calculate_tag_hash(service)
+                    new_objects += chain.store.put_object(service, tag_hash)
+                    checkpoint_tags.append([name, tag_hash])
+                
+                if old_index is None:
+                    continue
+                old_entry = old_index.get(name)
+                if old_entry is None:
+                    added[name] = service
+                    pending.append(_service_added_record(service))
+                elif _same_change_number(old_entry[0], service):
+                    tags_skipped += 1
+                else:
+                    changed[name] = service
+                    pending.append(name)
+            header = reader.header
+            writer.end({key: value for key, value in header.items() if key not in leading})
+    totals['change_number'] = header.get('changeNumber')
+    metrics.count('tags_processed', totals['total_services'])
+    metrics.count('prefixes_processed', totals['total_ip_ranges'])
+    
+    changes = []
+    delta = None
+    if old_index is not None:
+        with metrics.phase('diff'):
+            candidates = len(changed)
+            changes, delta = _diff_changed_tags(previous_path, old_index, header, order, pending, added, changed)
+            tags_skipped += candidates - len(changed)
+        metrics.count('tags_diffed', len(changed))
+        logging.info(f"Detected {len(changes)} changes ({len(changed)} tags diffed, {tags_skipped} unchanged tags skipped)")
+    
+    if diff_stats is not None:
+        diff_stats['tags_skipped'] = tags_skipped
+        diff_stats['tags_diffed'] = len(changed)
+    
+    # Record history as a prefix-level delta (periodically a full checkpoint in the snapshot store)
+    if checkpoint_tags is not None:
+        logging.info(f"Stored {new_objects} new tag objects for checkpoint {today}")
+    with metrics.phase('write_history'):
+        entry = chain.append_delta(today, delta or {'header': header}, old_header.get('changeNumber'), checkpoint_tags)
+        if entry is None:
+            logging.info("History chain head does not match the previous file - appending from the full document")
+            with open(json_path, 'r', encoding='utf-8-sig') as f:
+                chain.append(today, json.load(f))
+    for history_file in (chain.deltas_dir / f'{today}.json', chain.index_file):
+        if history_file.exists():
+            metrics.wrote(history_file, data_dir)
+    
+    # Longest-prefix-match index for "which tags cover this IP?" lookups
+    with metrics.phase('write_ip_index'):
+        ip_index.change_number = header.get('changeNumber')
+        ip_index.cloud = header.get('cloud')
+        ip_index.finish().save(data_dir / 'ip-index.bin')
+        ip_index.save_ranges(data_dir / 'ip-ranges.bin', today)
+    metrics.wrote(data_dir / 'ip-index.bin', data_dir)
+    metrics.wrote(data_dir / 'ip-ranges.bin', data_dir)
+    
+    # Replace current.json only after the previous copy is no longer needed
+    os.replace(current_tmp, data_dir / 'current.json')
+    metrics.wrote(data_dir / 'current.json', data_dir)
+    logging.info("Saved current.json")
+    return changes, totals
+
+def _diff_changed_tags(previous_path: Path, old_index: Dict, header: Dict, order: List[str],
+                       pending: List, added: Dict[str, Dict], changed: Dict[str, Dict]) -> Tuple[List[Dict], Dict]:
+    """Turn the tags classified by ingest_service_tags into change records and a history delta.
+    Only the changed tags are loaded from the previous file; those whose content did not
+    change despite a new changeNumber are removed from changed."""
+    old_changed = load_service_tags(previous_path, changed)
+    for name in [name for name, service in changed.items() if is_tag_unchanged(old_changed[name], service)]:
+        del changed[name]
+    changes = []
+    for item in pending:
+        if isinstance(item, str) and item not in changed:
+            continue
+        record = _ip_change_record(old_changed[item], changed[item]) if isinstance(item, str) else item
+        if record:
+            changes.append(record)
+    
+    published = set(order)
+    removed = [name for name in old_index if name not in published]
+    for name in removed:
+        _, region, system_service = old_index[name]
+        changes.append(_service_removed_record(name, region, system_service))
+    
+    # Same delta history_chain.build_delta would produce, without either full document
+    delta = {
+        'header': header,
+        'added': added,
+        'removed': removed,
+        'changed': {name: build_tag_change(old_changed[name], service) for name, service in changed.items()}
+    }
+    if order != list(old_index):
+        delta['order'] = order
+    return changes, delta
+
+def generate_summary_stats(data: Optional[Dict], changes: List[Dict], diff_stats: Optional[Dict] = None,
+                           totals: Optional[Dict] = None, data_dir: Path = DATA_DIR) -> Dict:
+    """Generate summary statistics for the dashboard.
+    totals (change_number, total_services, total_ip_ranges) can be given instead of data,
+    as ingest_service_tags does."""
+    if totals is None:
+        totals = {
+            'change_number': data.get('changeNumber'),
+            'total_services': len(data.get('values', [])),
+            'total_ip_ranges': sum(
+                len(service.get('properties', {}).get('addressPrefixes', []))
+                for service in data.get('values', [])
+            )
+        }
+    total_services = totals['total_services']
+    total_ip_ranges = totals['total_ip_ranges']
     
     # Count changes by type
     ip_changes = [c for c in changes if c['type'] == 'ip_changes']
@@ -223,15 +594,18 @@ def generate_summary_stats(data: Dict, changes: List[Dict]) -> Dict:
         reverse=True
     )[:10]
     
-    # Get list of available historical dates
-    history_dir = 'docs/data/history'
-    available_dates = []
+    # Get list of available historical dates (history chain, snapshot store and legacy full copies)
+    history_dir = data_dir / 'history'
+    store = SnapshotStore(data_dir / 'store')
+    available_dates = set(HistoryChain(data_dir / 'chain', store).list_dates()) | set(store.list_snapshots())
     if os.path.exists(history_dir):
-        history_files = sorted([f for f in os.listdir(history_dir) if f.endswith('.json')])
-        available_dates = [f.replace('.json', '') for f in history_files]
+        history_files = [f for f in os.listdir(history_dir) if f.endswith('.json')]
+        available_dates.update(f.replace('.json', '') for f in history_files)
+    available_dates = sorted(available_dates)
     
     return {
         'last_updated': datetime.now(timezone.utc).isoformat(),
+        'change_number': totals['change_number'],
         'total_services': total_services,
         'total_ip_ranges': total_ip_ranges,
         'changes_this_week': len(changes),
@@ -243,28 +617,38 @@ def generate_summary_stats(data: Dict, changes: List[Dict]) -> Dict:
             {'service': service, 'change_count': count}
             for service, count in top_active_services
         ],
-        'available_dates': available_dates
+        'available_dates': available_dates,
+        'diff_stats': diff_stats or {}
     }
 
-def save_data_files(data: Dict, changes: List[Dict], summary: Dict, metadata: Dict):
-    """Save all data files for the dashboard."""
-    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-    
-    # Ensure data directories exist
-    Path('docs/data').mkdir(exist_ok=True)
-    Path('docs/data/history').mkdir(exist_ok=True)
-    Path('docs/data/changes').mkdir(exist_ok=True)
+def save_change_files(changes: List[Dict], summary: Dict, metadata: Dict, today: str,
+                      data_dir: Path = DATA_DIR, metrics: Optional[RunMetrics] = None):
+    """Save the change reports, summary and manifest for the dashboard.
+    current.json, the IP index and history are written by ingest_service_tags."""
+    metrics = metrics or RunMetrics(trace_memory=False)
+    with metrics.phase('write_changes'):
+        _save_changes(changes, metadata, today, data_dir)
+    for changes_file in (f'{today}-changes.json', 'latest-changes.json'):
+        metrics.wrote(data_dir / 'changes' / changes_file, data_dir)
     
-    # Save current data
-    with open('docs/data/current.json', 'w') as f:
-        json.dump(data, f, indent=2)
-    logging.info("Saved current.json")
+    # Save summary statistics
+    with metrics.phase('write_summary'):
+        with open(data_dir / 'summary.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+    metrics.wrote(data_dir / 'summary.json', data_dir)
+    logging.info("Saved summary.json")
     
-    # Save historical snapshot
-    history_file = f'docs/data/history/{today}.json'
-    with open(history_file, 'w') as f:
-        json.dump(data, f, indent=2)
-    logging.info(f"Saved {history_file}")
+    # Generate manifest of all change files for historical analysis
+    with metrics.phase('manifest'):
+        generate_changes_manifest(data_dir)
+    if (data_dir / 'changes' / 'manifest.json').exists():
+        metrics.wrote(data_dir / 'changes' / 'manifest.json', data_dir)
+
+def _save_changes(changes: List[Dict], metadata: Dict, today: str, data_dir: Path):
+    """Write the dated and latest change reports (an empty report when nothing changed)."""
+    # Ensure data directories exist
+    changes_dir = data_dir / 'changes'
+    changes_dir.mkdir(parents=True, exist_ok=True)
     
     # Save changes if any
     if changes:
@@ -277,13 +661,13 @@ def save_data_files(data: Dict, changes: List[Dict], summary: Dict, metadata: Di
         }
         
         # Save dated changes file
-        changes_file = f'docs/data/changes/{today}-changes.json'
+        changes_file = changes_dir / f'{today}-changes.json'
         with open(changes_file, 'w') as f:
             json.dump(changes_data, f, indent=2)
         logging.info(f"Saved {changes_file}")
         
         # Save latest changes (for dashboard)
-        with open('docs/data/changes/latest-changes.json', 'w') as f:
+        with open(changes_dir / 'latest-changes.json', 'w') as f:
             json.dump(changes_data, f, indent=2)
         logging.info("Saved latest-changes.json")
     else:
@@ -298,28 +682,20 @@ def save_data_files(data: Dict, changes: List[Dict], summary: Dict, metadata: Di
         }
         
         # Save dated changes file (even if empty, we need it for timeline)
-        changes_file = f'docs/data/changes/{today}-changes.json'
+        changes_file = changes_dir / f'{today}-changes.json'
         with open(changes_file, 'w') as f:
             json.dump(empty_changes, f, indent=2)
         logging.info(f"Saved {changes_file} (no changes)")
         
         # Save latest changes
-        with open('docs/data/changes/latest-changes.json', 'w') as f:
+        with open(changes_dir / 'latest-changes.json', 'w') as f:
             json.dump(empty_changes, f, indent=2)
         logging.info("No changes detected - saved empty changes file with metadata")
-    
-    # Save summary statistics
-    with open('docs/data/summary.json', 'w') as f:
-        json.dump(summary, f, indent=2)
-    logging.info("Saved summary.json")
-    
-    # Generate manifest of all change files for historical analysis
-    generate_changes_manifest()
 
-def generate_changes_manifest():
+def generate_changes_manifest(data_dir: Path = DATA_DIR):
     """Generate a manifest file listing all available change files for the dashboard."""
     try:
-        changes_dir = Path('docs/data/changes')
+        changes_dir = data_dir / 'changes'
         
         # Find all change files (exclude latest-changes.json and manifest.json)
         change_files = []
@@ -358,15 +734,100 @@ def generate_changes_manifest():
     except Exception as e:
         logging.warning(f"Could not generate manifest: {e}")
 
-def cleanup_old_files(keep_weeks: int = 12):
-    """Clean up old history files to prevent repository bloat."""
+def import_history(remove_legacy: bool = True, data_dir: Path = DATA_DIR) -> int:
+    """Build the history chain from legacy full copies and stored snapshot manifests.
+    Returns the number of dates appended to the chain."""
+    store = SnapshotStore(data_dir / 'store')
+    legacy_files = {path.stem: path for path in (data_dir / 'history').glob('*.json')}
+    dates = sorted(set(legacy_files) | set(store.list_snapshots()))
+    
+    def snapshots():
+        for date in dates:
+            if date in legacy_files:
+                with open(legacy_files[date], 'r') as f:
+                    yield date, json.load(f)
+            else:
+                yield date, store.read_snapshot(date)
+    
+    imported = HistoryChain(data_dir / 'chain', store).import_snapshots(snapshots())
+    if remove_legacy:
+        for path in legacy_files.values():
+            path.unlink()
+            logging.info(f"Removed legacy history file {path}")
+    return imported
+
+def print_history_diff(from_date: str, to_date: Optional[str] = None, output: Optional[str] = None,
+                       data_dir: Path = DATA_DIR):
+    """Print (or write as JSON) the net changes between two dates from the history chain."""
+    chain = HistoryChain(data_dir / 'chain', SnapshotStore(data_dir / 'store'))
+    try:
+        changes = chain.diff(from_date, to_date)
+    except ValueError as e:
+        dates = chain.list_dates()
+        print(f"❌ {e}")
+        print(f"   Earliest recorded date: {dates[0]}" if dates
+              else "   No history recorded yet (run the watcher or --import-history first)")
+        return
+    if output:
+        with open(output, 'w') as f:
+            json.dump({
+                'from_date': from_date,
+                'to_date': to_date or chain.list_dates()[-1],
+                'changes': changes
+            }, f, indent=2)
+        print(f"💾 Wrote {len(changes)} changes to {output}")
+        return
+    
+    print(f"📅 Changes from {from_date} to {to_date or 'latest'}: {len(changes)}")
+    for change in changes:
+        if change['type'] == 'ip_changes':
+            print(f"🔄 {change['service']}: +{change['added_count']} / -{change['removed_count']} prefixes")
+            for prefix in change['added_prefixes']:
+                print(f"    + {prefix}")
+            for prefix in change['removed_prefixes']:
+                print(f"    - {prefix}")
+        elif change['type'] == 'service_added':
+            print(f"➕ {change['service']} ({change['ip_count']} prefixes)")
+        else:
+            print(f"➖ {change['service']}")
+
+def print_ip_lookups(queries: List[str], input_file: Optional[str] = None, as_json: bool = False,
+                     data_dir: Path = DATA_DIR):
+    """Print the service tags covering each address or CIDR using the saved ip-index.bin."""
+    index = IPIndex.load(data_dir / 'ip-index.bin')
+    if input_file:
+        with (sys.stdin if input_file == '-' else open(input_file, 'r')) as f:
+            queries = list(queries) + [line.strip() for line in f if line.strip()]
+    
+    for query in queries:
+        try:
+            matches = index.lookup(query)
+        except ValueError as e:
+            matches = None
+            error = str(e)
+        if as_json:
+            print(json.dumps({'query': query, 'matches': matches} if matches is not None
+                             else {'query': query, 'error': error}))
+        elif matches is None:
+            print(f"❌ {query}: {error}")
+        elif not matches:
+            print(f"➖ {query}: not covered by any service tag")
+        else:
+            print(f"✅ {query}: {len(matches)} service tags")
+            for match in matches:
+                details = ', '.join(value for value in (match['region'], match['system_service']) if value)
+                print(f"    {match['prefix']:<43} {match['service']}" + (f" ({details})" if details else ''))
+
+def cleanup_old_files(keep_weeks: int = 12, data_dir: Path = DATA_DIR):
+    """Clean up old history files to prevent repository bloat.
+    The history chain (docs/data/chain + store checkpoints) is never cleaned up."""
     import glob
     from datetime import datetime, timedelta
     
     cutoff_date = datetime.now() - timedelta(weeks=keep_weeks)
     
-    history_files = glob.glob('docs/data/history/*.json')
-    changes_files = glob.glob('docs/data/changes/*-changes.json')
+    history_files = glob.glob(str(data_dir / 'history' / '*.json'))
+    changes_files = glob.glob(str(data_dir / 'changes' / '*-changes.json'))
     
     for file_path in history_files + changes_files:
         try:
@@ -382,14 +843,203 @@ def cleanup_old_files(keep_weeks: int = 12):
         except Exception as e:
             logging.warning(f"Could not process file {file_path}: {e}")
 
+def update_cloud(cloud: str = 'Public', baseline: bool = False, force: bool = False,
+                 metrics: Optional[RunMetrics] = None) -> Dict:
+    """Download, diff and publish one cloud's Service Tags into its data directory.
+    Per-phase timings are written to run-metrics.json next to summary.json, also for
+    unchanged and failed runs.
+    Returns {'cloud', 'status' ('updated' or 'unchanged'), 'metadata', 'summary', 'changes'}."""
+    data_dir, cache_dir = cloud_paths(cloud)
+    metrics = metrics or RunMetrics(cloud)
+    try:
+        result = _update_cloud(cloud, data_dir, cache_dir, baseline, force, metrics)
+    except Exception:
+        metrics.finish('failed')
+        metrics.save(data_dir / METRICS_FILE)
+        raise
+    report = metrics.finish(result['status'])
+    metrics.save(data_dir / METRICS_FILE)
+    logging.info(f"Saved {METRICS_FILE} ({report['wall_seconds']}s wall, {report['cpu_seconds']}s CPU)")
+    return result
+
+def _update_cloud(cloud: str, data_dir: Path, cache_dir: Path, baseline: bool, force: bool,
+                  metrics: RunMetrics) -> Dict:
+    # Download latest data (short-circuits when the publish has not changed)
+    known_change_number = None if (baseline or force) else load_last_change_number(data_dir)
+    json_path, metadata = download_latest_json(known_change_number=known_change_number,
+                                               confirmation_url=CLOUDS[cloud], cache_dir=cache_dir,
+                                               metrics=metrics)
+    
+    if metadata.get('unchanged'):
+        write_checked_marker(metadata, status='unchanged', data_dir=data_dir)
+        logging.info(f"=== No new {cloud} publish (changeNumber {metadata.get('change_number')}) - skipping update ===")
+        return {'cloud': cloud, 'status': 'unchanged', 'metadata': metadata, 'summary': None, 'changes': []}
+    
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    diff_stats = {}
+    
+    # Compare with the previous data and write current.json, IP index and history, tag by tag
+    with metrics.phase('locate_previous'):
+        previous_path = locate_previous_data(data_dir, cache_dir)
+    changes, totals = ingest_service_tags(json_path, previous_path, today, diff_stats,
+                                          data_dir=data_dir, metrics=metrics)
+    if baseline:
+        # For baseline setup, don't record any changes
+        logging.info("Baseline mode: Skipping change reports")
+        changes = []
+        diff_stats = {}
+    metrics.count('changes', len(changes))
+    
+    # Generate summary statistics
+    with metrics.phase('stats'):
+        summary = generate_summary_stats(None, changes, diff_stats, totals=totals, data_dir=data_dir)
+    
+    # Save change reports, summary and manifest
+    save_change_files(changes, summary, metadata, today, data_dir=data_dir, metrics=metrics)
+    
+    # Cleanup old files
+    with metrics.phase('cleanup'):
+        cleanup_old_files(data_dir=data_dir)
+    
+    write_checked_marker(metadata, status='updated', data_dir=data_dir)
+    return {'cloud': cloud, 'status': 'updated', 'metadata': metadata, 'summary': summary, 'changes': changes}
+
+def update_clouds(clouds: List[str], baseline: bool = False, force: bool = False,
+                  max_workers: int = MAX_CLOUD_WORKERS, prometheus_file: Optional[str] = None) -> Dict:
+    """Update several clouds concurrently and write the combined docs/data/clouds/summary.json.
+    
+    Downloads dominate a run, so a small thread pool brings wall-clock time close to
+    the slowest cloud. A failing cloud is recorded and does not stop the others.
+    The run metrics of every cloud go to prometheus_file when given."""
+    # Tell interleaved log lines apart by cloud
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s [%(threadName)s]: %(message)s',
+                                               datefmt='%Y-%m-%d %H:%M:%S'))
+    
+    runs = {cloud: RunMetrics(cloud) for cloud in clouds}
+    
+    def run(cloud: str) -> Dict:
+        threading.current_thread().name = cloud
+        return update_cloud(cloud, baseline=baseline, force=force, metrics=runs[cloud])
+    
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(clouds)))) as pool:
+        futures = {pool.submit(run, cloud): cloud for cloud in clouds}
+        for future in as_completed(futures):
+            cloud = futures[future]
+            try:
+                results[cloud] = future.result()
+            except Exception as e:
+                logging.error(f"{cloud} update failed: {e}")
+                results[cloud] = {'cloud': cloud, 'status': 'failed', 'error': str(e)}
+    
+    combined = {'last_updated': datetime.now(timezone.utc).isoformat(), 'clouds': {}}
+    for cloud in clouds:
+        data_dir, _ = cloud_paths(cloud)
+        entry = {
+            'status': results[cloud]['status'],
+            'data_path': data_dir.relative_to(DATA_DIR.parent).as_posix()
+        }
+        # Unchanged and failed clouds still report their last published numbers
+        summary = results[cloud].get('summary')
+        if summary is None and (data_dir / 'summary.json').exists():
+            with open(data_dir / 'summary.json', 'r') as f:
+                summary = json.load(f)
+        if summary:
+            for key in ('change_number', 'last_updated', 'total_services', 'total_ip_ranges', 'changes_this_week'):
+                entry[key] = summary.get(key)
+        if 'error' in results[cloud]:
+            entry['error'] = results[cloud]['error']
+        entry['run_seconds'] = (runs[cloud].finished or {}).get('wall_seconds')
+        combined['clouds'][cloud] = entry
+    
+    for key in ('total_services', 'total_ip_ranges', 'changes_this_week'):
+        combined[key] = sum(entry.get(key) or 0 for entry in combined['clouds'].values())
+    
+    combined_file = DATA_DIR / 'clouds' / 'summary.json'
+    combined_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(combined_file, 'w') as f:
+        json.dump(combined, f, indent=2)
+    logging.info(f"Saved {combined_file}")
+    
+    if prometheus_file:
+        write_prometheus_textfile(prometheus_file, list(runs.values()))
+        logging.info(f"Saved run metrics to {prometheus_file}")
+    return combined
+
 def main():
     """Main execution function."""
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Azure Service Tags & IP Ranges Watcher - Dashboard Data Generator')
     parser.add_argument('--baseline', action='store_true', 
                        help='Setup initial baseline (no changes recorded)')
+    parser.add_argument('--force', action='store_true',
+                       help='Regenerate all files even if Microsoft has not published a new changeNumber')
+    parser.add_argument('--import-history', action='store_true',
+                       help='Move legacy docs/data/history/*.json full copies into the history chain and exit')
+    parser.add_argument('--cloud', action='append', choices=list(CLOUDS) + ['all'],
+                       help='Cloud to track (repeatable, or "all"); several clouds are updated concurrently. '
+                            'Defaults to Public')
+    parser.add_argument('--workers', type=int, default=MAX_CLOUD_WORKERS,
+                       help='Maximum number of clouds updated at the same time')
+    parser.add_argument('--prometheus-textfile', default=PROMETHEUS_TEXTFILE,
+                       help='Also write the run metrics to this Prometheus textfile '
+                            '(e.g. for the node_exporter textfile collector)')
+    parser.add_argument('--trace-memory', action='store_true',
+                       help='Record per-phase peak memory in run-metrics.json with tracemalloc '
+                            '(makes allocation-heavy phases several times slower; '
+                            'otherwise only the process peak RSS is recorded)')
+    subparsers = parser.add_subparsers(dest='command')
+    diff_parser = subparsers.add_parser('diff', help='Show the net changes between two recorded dates')
+    diff_parser.add_argument('from_date', help='Start date (YYYY-MM-DD), e.g. the last firewall review')
+    diff_parser.add_argument('to_date', nargs='?', help='End date (YYYY-MM-DD), defaults to the latest run')
+    diff_parser.add_argument('--output', help='Write the change list as JSON to this file')
+    lookup_parser = subparsers.add_parser('lookup', help='Show the service tags covering IP addresses or CIDRs')
+    lookup_parser.add_argument('queries', nargs='*', help='IPv4/IPv6 addresses or CIDRs')
+    lookup_parser.add_argument('--input', help='Read one address or CIDR per line from this file ("-" for stdin)')
+    lookup_parser.add_argument('--json', action='store_true', help='Print one JSON object per query')
     args = parser.parse_args()
     
+    clouds = list(CLOUDS) if 'all' in (args.cloud or []) else list(dict.fromkeys(args.cloud or ['Public']))
+    if len(clouds) > 1 and (args.command or args.import_history):
+        parser.error('diff, lookup and --import-history work on a single --cloud')
+    data_dir, _ = cloud_paths(clouds[0])
+    
+    if args.command == 'diff':
+        print_history_diff(args.from_date, args.to_date, args.output, data_dir=data_dir)
+        return
+    
+    if args.command == 'lookup':
+        print_ip_lookups(args.queries, args.input, args.json, data_dir=data_dir)
+        return
+    
+    if args.import_history:
+        imported = import_history(data_dir=data_dir)
+        print(f"📦 Imported {imported} historical snapshots into {data_dir / 'chain'}")
+        return
+    
+    if args.trace_memory:
+        tracemalloc.start()
+    
+    if len(clouds) > 1:
+        logging.info(f"=== Azure Service Tags & IP Ranges Watcher - Multi-cloud Update ({', '.join(clouds)}) ===")
+        combined = update_clouds(clouds, baseline=args.baseline, force=args.force, max_workers=args.workers,
+                                 prometheus_file=args.prometheus_textfile)
+        failed = []
+        for cloud, entry in combined['clouds'].items():
+            if entry['status'] == 'failed':
+                failed.append(cloud)
+                print(f"❌ {cloud}: {entry['error']}")
+            elif entry['status'] == 'unchanged':
+                print(f"✨ {cloud}: no new publish since changeNumber {entry.get('change_number')}")
+            else:
+                print(f"✅ {cloud}: {entry['total_services']} services, {entry['total_ip_ranges']} IP ranges, "
+                      f"{entry['changes_this_week']} changes")
+        print(f"📊 All clouds: {combined['total_services']} services, {combined['total_ip_ranges']} IP ranges")
+        if failed:
+            raise RuntimeError(f"Update failed for: {', '.join(failed)}")
+        return
+    
     try:
         if args.baseline:
             logging.info("=== Azure Service Tags & IP Ranges Watcher - Baseline Setup ===")
@@ -397,28 +1047,18 @@ def main():
         else:
             logging.info("=== Azure Service Tags & IP Ranges Watcher Update ===")
         
-        # Download latest data
-        new_data, metadata = download_latest_json()
-        
-        if args.baseline:
-            # For baseline setup, don't load previous data or detect changes
-            logging.info("Baseline mode: Skipping change detection")
-            old_data = None
-            changes = []
-        else:
-            # Load previous data for comparison
-            old_data = load_previous_data()
-            # Detect changes
-            changes = detect_changes(old_data, new_data)
-        
-        # Generate summary statistics
-        summary = generate_summary_stats(new_data, changes)
-        
-        # Save all files (including metadata)
-        save_data_files(new_data, changes, summary, metadata)
+        metrics = RunMetrics(clouds[0])
+        try:
+            result = update_cloud(clouds[0], baseline=args.baseline, force=args.force, metrics=metrics)
+        finally:
+            if args.prometheus_textfile:
+                write_prometheus_textfile(args.prometheus_textfile, [metrics])
+                logging.info(f"Saved run metrics to {args.prometheus_textfile}")
+        summary, changes = result['summary'], result['changes']
         
-        # Cleanup old files
-        cleanup_old_files()
+        if result['status'] == 'unchanged':
+            print(f"✨ No new Azure Service Tags publish since changeNumber {result['metadata'].get('change_number')}")
+            return
         
         if args.baseline:
             logging.info("=== Baseline setup completed successfully ===")
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the watcher pipeline on synthetic Service Tags documents.
+
+For each scale (a multiple of today's Public cloud file) a base document and
+one week of churn are generated with synthetic_service_tags.py, then each stage
+is timed on the week's update:
+
+    detect_changes           in-memory diff of two parsed documents
+    ingest_service_tags      streaming diff + current.json, IP index and history
+    generate_summary_stats
+    save_change_files        change reports, summary and manifest
+    generate_changes_manifest
+
+Each stage reports wall time (best of --repeat), throughput (tags/s and MB/s of
+the document) and traced peak memory from a separate tracemalloc run. Times are
+also divided by a fixed pure-Python calibration workload, so results from
+different machines can be compared against the committed baseline. With
+--baseline, the run fails (exit 1) if any stage is slower or uses more memory
+than the baseline by more than --threshold.
+
+    python scripts/benchmark.py --scales 1,10,100
+    python scripts/benchmark.py --scales 1,10 --baseline scripts/benchmark-baseline.json
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import azure_watcher
+from synthetic_service_tags import DEFAULT_CHURN, write_synthetic_document
+
+DEFAULT_SCALES = [1, 10, 100]
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_BASELINE_FILE = Path(__file__).parent / 'benchmark-baseline.json'
+
+# detect_changes needs both documents parsed in memory; beyond this scale that is the bottleneck itself
+IN_MEMORY_MAX_SCALE = 10
+
+# Differences smaller than this are noise, whatever the relative change
+MIN_SECONDS_DELTA = 0.02
+MIN_PEAK_MB_DELTA = 1.0
+
+BASE_DATE = '2025-01-06'
+WEEK_DATE = '2025-01-13'
+HISTORY_WEEKS = 52
+DOCUMENT_STAGES = ('ingest_service_tags', 'detect_changes')
+
+
+def calibrate(rounds: int = 5) -> float:
+    """Time a fixed pure-Python workload (JSON, hashing, sorting) to normalize results across machines."""
+    payload = [{'name': f'tag{i}', 'prefixes': [f'10.{i % 256}.{j}.0/24' for j in range(40)]} for i in range(2000)]
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for service in json.loads(json.dumps(payload)):
+            hashlib.sha256(json.dumps(service, sort_keys=True).encode('utf-8')).hexdigest()
+            sorted(service['prefixes'], reverse=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure(run: Callable[[], object], setup: Optional[Callable[[], None]] = None,
+            repeat: int = 3, trace_memory: bool = True) -> Dict:
+    """Best wall time over repeat runs, plus traced peak memory of one more run."""
+    best = float('inf')
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    result = {'seconds': round(best, 4)}
+    if trace_memory:
+        if setup:
+            setup()
+        tracemalloc.start()
+        try:
+            run()
+            result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def benchmark_scale(scale: float, work_dir: Path, repeat: int, trace_memory: bool,
+                    churn: float = DEFAULT_CHURN) -> Dict:
+    """Generate documents for one scale and measure every stage."""
+    base_file = work_dir / 'base.json'
+    week_file = work_dir / 'week.json'
+    base = write_synthetic_document(base_file, scale=scale, churn=churn)
+    week = write_synthetic_document(week_file, scale=scale, week=1, churn=churn)
+    logging.warning(f"Scale {scale}x: {week['tags']} tags, {week['prefixes']} prefixes, {week['bytes']} bytes")
+
+    # Recorded state after the base week, restored before each measured run
+    base_state = work_dir / 'base-state'
+    azure_watcher.ingest_service_tags(base_file, None, BASE_DATE, data_dir=base_state)
+    changes_dir = base_state / 'changes'
+    changes_dir.mkdir(parents=True, exist_ok=True)
+    for weeks_ago in range(1, HISTORY_WEEKS + 1):
+        with open(changes_dir / f'2024-{(weeks_ago % 12) + 1:02d}-{(weeks_ago % 28) + 1:02d}-changes.json', 'w') as f:
+            json.dump({'date': BASE_DATE, 'changes': [], 'total_changes': 0}, f)
+
+    data_dir = work_dir / 'data'
+
+    def restore():
+        shutil.rmtree(data_dir, ignore_errors=True)
+        shutil.copytree(base_state, data_dir)
+
+    stages = {}
+    state = {}
+
+    def ingest():
+        state['diff_stats'] = {}
+        state['changes'], state['totals'] = azure_watcher.ingest_service_tags(
+            week_file, data_dir / 'current.json', WEEK_DATE, state['diff_stats'], data_dir=data_dir)
+
+    stages['ingest_service_tags'] = measure(ingest, restore, repeat, trace_memory)
+    changes = state['changes']
+
+    if scale <= IN_MEMORY_MAX_SCALE:
+        with open(base_file, 'r') as f:
+            old_data = json.load(f)
+        with open(week_file, 'r') as f:
+            new_data = json.load(f)
+        stages['detect_changes'] = measure(lambda: azure_watcher.detect_changes(old_data, new_data),
+                                           repeat=repeat, trace_memory=trace_memory)
+        del old_data, new_data
+
+    summary_args = (None, changes, state['diff_stats'])
+    stages['generate_summary_stats'] = measure(
+        lambda: state.update(summary=azure_watcher.generate_summary_stats(
+            *summary_args, totals=state['totals'], data_dir=data_dir)),
+        repeat=repeat, trace_memory=trace_memory)
+    stages['save_change_files'] = measure(
+        lambda: azure_watcher.save_change_files(changes, state['summary'], {'version': 'synthetic'},
+                                                WEEK_DATE, data_dir=data_dir),
+        repeat=repeat, trace_memory=trace_memory)
+    stages['generate_changes_manifest'] = measure(
+        lambda: azure_watcher.generate_changes_manifest(data_dir),
+        repeat=repeat, trace_memory=trace_memory)
+
+    # Throughput only means something for the stages that read the whole document
+    for name, stage in stages.items():
+        document_stage = name in DOCUMENT_STAGES and stage['seconds']
+        stage['tags_per_s'] = round(week['tags'] / stage['seconds']) if document_stage else None
+        stage['mb_per_s'] = round(week['bytes'] / 1e6 / stage['seconds'], 2) if document_stage else None
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'document': {'tags': week['tags'], 'prefixes': week['prefixes'], 'bytes': week['bytes'],
+                     'base_tags': base['tags'], 'changes': len(changes)},
+        'stages': stages
+    }
+
+
+def run_benchmarks(scales: List[float], repeat: int = 3, trace_memory: bool = True) -> Dict:
+    calibration = calibrate()
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'calibration_seconds': round(calibration, 4),
+        'scales': {}
+    }
+    for scale in scales:
+        work_dir = Path(tempfile.mkdtemp(prefix=f'service-tags-bench-{scale}x-'))
+        result = benchmark_scale(scale, work_dir, repeat, trace_memory)
+        for stage in result['stages'].values():
+            stage['normalized'] = round(stage['seconds'] / calibration, 2)
+        results['scales'][f'{scale:g}'] = result
+    return results
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Return a description of every stage that regressed beyond threshold."""
+    regressions = []
+    base_calibration = baseline['calibration_seconds']
+    for scale, result in results['scales'].items():
+        base_result = baseline.get('scales', {}).get(scale)
+        if not base_result:
+            continue
+        for name, stage in result['stages'].items():
+            base_stage = base_result['stages'].get(name)
+            if not base_stage:
+                continue
+            # Compare in calibration units, so a slower runner is not a regression
+            expected = base_stage['normalized'] * (1 + threshold)
+            slack = MIN_SECONDS_DELTA / results['calibration_seconds']
+            if stage['normalized'] > expected and stage['normalized'] - base_stage['normalized'] > slack:
+                regressions.append(f"{scale}x {name}: {stage['normalized']} vs baseline {base_stage['normalized']} "
+                                   f"calibration units ({stage['seconds']}s, baseline {base_stage['seconds']}s "
+                                   f"at calibration {base_calibration}s)")
+            if 'peak_mb' in stage and 'peak_mb' in base_stage:
+                if (stage['peak_mb'] > base_stage['peak_mb'] * (1 + threshold)
+                        and stage['peak_mb'] - base_stage['peak_mb'] > MIN_PEAK_MB_DELTA):
+                    regressions.append(f"{scale}x {name}: peak {stage['peak_mb']} MB vs baseline {base_stage['peak_mb']} MB")
+    return regressions
+
+
+def print_report(results: Dict):
+    print(f"Python {results['python']} ({results['machine']}), calibration {results['calibration_seconds']}s")
+    for scale, result in results['scales'].items():
+        document = result['document']
+        print(f"\n📦 {scale}x: {document['tags']} tags, {document['prefixes']} prefixes, "
+              f"{document['bytes'] / 1e6:.1f} MB, {document['changes']} changes")
+        print(f"   {'stage':<28}{'seconds':>10}{'tags/s':>12}{'MB/s':>9}{'peak MB':>10}{'norm':>8}")
+        for name, stage in result['stages'].items():
+            print(f"   {name:<28}{stage['seconds']:>10}{stage['tags_per_s'] or '-':>12}{stage['mb_per_s'] or '-':>9}"
+                  f"{stage.get('peak_mb', '-'):>10}{stage['normalized']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Service Tags watcher pipeline on synthetic data')
+    parser.add_argument('--scales', default=','.join(str(scale) for scale in DEFAULT_SCALES),
+                        help="Comma-separated multiples of today's file size (default: 1,10,100)")
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage (best is kept)')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc peak memory runs')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against this results file and fail on regressions')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Allowed relative slowdown or memory growth (default: 0.25)')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help=f'Write the results to {DEFAULT_BASELINE_FILE.name}')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    scales = [float(scale) for scale in args.scales.split(',')]
+    results = run_benchmarks(scales, repeat=args.repeat, trace_memory=not args.no_memory)
+    print_report(results)
+
+    for output in filter(None, [args.output, DEFAULT_BASELINE_FILE if args.update_baseline else None]):
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Saved results to {output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regressions beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"   {regression}")
+            sys.exit(1)
+        print(f"\n✅ No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
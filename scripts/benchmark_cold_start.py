@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the Vercel Python functions.
+
+Every route in vercel.json is started in a fresh interpreter, as a cold
+instance would be, and measured:
+
+    import          importing the function module (api/<name>.py and the api package)
+    preflight       serving the CORS preflight the browser sends before every
+                    subscribe, login or plan-status call
+    heavy modules   which of pymongo, bson, sendgrid, jwt, bcrypt and dotenv are
+                    loaded by then (none of them are needed to answer a preflight)
+    first request   serving the first real request (FIRST_REQUESTS). This is where the
+                    lazily imported modules load and the MongoDB client is created,
+                    so it is budgeted separately from the preflight.
+
+Interpreter startup is not included. Figures are the median of --runs fresh
+processes. The run fails (exit 1) if an endpoint exceeds a budget, answers the
+preflight with an error or the first request with a 5xx, or loads a heavy
+module before it needs one.
+
+Children run with VERCEL=1, as deployed functions do, so .env is not loaded.
+They talk to the MongoDB at --mongodb-uri (a local stand-in, never the
+production cluster: the requests sign up and subscribe COLD_START_EMAIL), send
+email through the stub transport and look up IPs in a small generated range
+file. --preflight-only skips the first requests when no MongoDB is at hand.
+
+    docker run -d -p 27017:27017 mongo:7
+    python scripts/benchmark_cold_start.py
+    python scripts/benchmark_cold_start.py --runs 10 --import-budget-ms 75 --output cold-start.json
+    python scripts/benchmark_cold_start.py --preflight-only
+"""
+
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).parent.parent
+VERCEL_CONFIG = ROOT / 'vercel.json'
+
+DEFAULT_RUNS = 5
+# Imports took 180-250 ms when the api package loaded every dependency up front
+DEFAULT_IMPORT_BUDGET_MS = 100.0
+DEFAULT_PREFLIGHT_BUDGET_MS = 50.0
+# Importing pymongo (~300 ms) and one bcrypt hash or check (~350 ms) dominate signup and login
+DEFAULT_REQUEST_BUDGET_MS = 1000.0
+DEFAULT_MONGODB_URI = 'mongodb://localhost:27017'
+
+# Dependencies that are slow to import and only needed once a request reaches them
+HEAVY_MODULES = ('pymongo', 'bson', 'sendgrid', 'jwt', 'bcrypt', 'dotenv')
+
+PREFLIGHT_ORIGIN = 'https://eliaquimbrandao.github.io'
+
+# The first real request per route: (method, path, JSON body). Each reaches the
+# dependencies its endpoint loads lazily; repeated runs answer 400/401/404 where
+# the first one created the record, which is fine as long as it is not a 5xx.
+COLD_START_EMAIL = 'cold-start@example.com'
+FIRST_REQUESTS = {
+    '/api/subscribe': ('POST', '/api/subscribe', {'email': COLD_START_EMAIL, 'subscriptionType': 'all'}),
+    '/api/unsubscribe': ('GET', f'/api/unsubscribe?email={COLD_START_EMAIL}&token=cold-start', None),
+    '/api/request-unsubscribe': ('POST', '/api/request-unsubscribe', {'email': COLD_START_EMAIL}),
+    '/api/plan-status': ('GET', f'/api/plan-status?email={COLD_START_EMAIL}', None),
+    '/api/upgrade': ('POST', '/api/upgrade', {'email': COLD_START_EMAIL}),
+    '/api/upgrade_confirm': ('POST', '/api/upgrade_confirm', {'token': 'cold-start', 'password': 'cold-start'}),
+    '/api/auth/signup': ('POST', '/api/auth/signup', {'email': COLD_START_EMAIL, 'password': 'cold-start'}),
+    '/api/auth/login': ('POST', '/api/auth/login', {'email': COLD_START_EMAIL, 'password': 'cold-start'}),
+    '/api/auth/me': ('GET', '/api/auth/me', None),
+    '/api/lookup': ('GET', '/api/lookup?ip=20.42.65.92', None),
+}
+# Sent with every first request, as the site does once logged in; decoding it loads jwt
+SESSION_TOKEN = 'cold-start'
+
+# The range file /api/lookup answers from (written to a temporary directory)
+LOOKUP_DOCUMENT = {
+    'changeNumber': 1,
+    'cloud': 'Public',
+    'values': [
+        {'name': 'AzureCloud', 'properties': {'region': '', 'systemService': '',
+                                              'addressPrefixes': ['20.0.0.0/8', '2603:1000::/24']}},
+        {'name': 'AzureMonitor.EastUS', 'properties': {'region': 'eastus', 'systemService': 'AzureMonitor',
+                                                       'addressPrefixes': ['20.42.64.0/19']}},
+    ]
+}
+
+
+def load_endpoints(config_path: Path = VERCEL_CONFIG) -> List[Tuple[str, str]]:
+    """(route, module) for every Python function routed in vercel.json"""
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+    endpoints = []
+    for route in config.get('routes', []):
+        dest = route['dest'].lstrip('/')
+        if dest.endswith('.py'):
+            endpoints.append((route['src'], dest[:-3].replace('/', '.')))
+    return endpoints
+
+
+def _serve_one(handler_class, method: str, path: str, headers: Dict, body: Optional[bytes] = None) -> Tuple[float, int, bytes]:
+    """Serve a single request with handler_class; returns (milliseconds, status, body)"""
+    # Already imported by the handler module, so not part of the import figures
+    import http.client
+    from http.server import HTTPServer
+
+    server = HTTPServer(('127.0.0.1', 0), handler_class)
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=30)
+    try:
+        start = time.perf_counter()
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        payload = response.read()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    finally:
+        connection.close()
+        thread.join()
+        server.server_close()
+    return elapsed_ms, response.status, payload
+
+
+def cold_start(module_name: str, route: str, first_request: bool = True) -> Dict:
+    """Import one function module and serve its preflight and first request (runs in a fresh interpreter)"""
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_ms = (time.perf_counter() - start) * 1000
+
+    preflight_ms, preflight_status, _ = _serve_one(module.handler, 'OPTIONS', route, {
+        'Origin': PREFLIGHT_ORIGIN,
+        'Access-Control-Request-Method': 'POST',
+        'Access-Control-Request-Headers': 'Content-Type, Authorization'
+    })
+    result = {
+        'import_ms': round(import_ms, 2),
+        'preflight_ms': round(preflight_ms, 2),
+        'preflight_status': preflight_status,
+        'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules]
+    }
+    if not first_request:
+        return result
+
+    method, path, data = FIRST_REQUESTS[route]
+    headers = {'Origin': PREFLIGHT_ORIGIN, 'Authorization': f'Bearer {SESSION_TOKEN}'}
+    body = None
+    if data is not None:
+        body = json.dumps(data).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    request_ms, status, payload = _serve_one(module.handler, method, path, headers, body)
+    result.update({
+        'first_request_ms': round(request_ms, 2),
+        'status': status,
+        'request_modules': [name for name in HEAVY_MODULES if name in sys.modules]
+    })
+    if status >= 500:
+        try:
+            result['error'] = json.loads(payload).get('error')
+        except (ValueError, AttributeError):
+            result['error'] = payload.decode('utf-8', 'replace')[:200]
+    return result
+
+
+def write_lookup_ranges(directory: Path) -> Path:
+    """Write the range file the /api/lookup children answer from"""
+    from ip_index import IPIndex
+
+    path = directory / 'ip-ranges.bin'
+    IPIndex.build(LOOKUP_DOCUMENT).save_ranges(path)
+    return path
+
+
+def mongodb_reachable(uri: str) -> Optional[str]:
+    """None if a server answers at uri, else why not"""
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+
+    client = MongoClient(uri, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command('ping')
+        return None
+    except PyMongoError as e:
+        return str(e).split(' (configured')[0]
+    finally:
+        client.close()
+
+
+def measure_endpoint(module_name: str, route: str, runs: int, env: Dict, first_request: bool) -> Dict:
+    """Median cold start over runs fresh interpreters"""
+    command = [sys.executable, __file__, '--child', module_name, route]
+    if not first_request:
+        command.append('--preflight-only')
+    samples = []
+    for _ in range(runs):
+        completed = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed'}
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    result = {
+        'import_ms': round(statistics.median(s['import_ms'] for s in samples), 2),
+        'preflight_ms': round(statistics.median(s['preflight_ms'] for s in samples), 2),
+        'preflight_status': samples[-1]['preflight_status'],
+        'heavy_modules': sorted({name for s in samples for name in s['heavy_modules']})
+    }
+    if first_request:
+        result.update({
+            'first_request_ms': round(statistics.median(s['first_request_ms'] for s in samples), 2),
+            'status': max(s['status'] for s in samples),
+            'request_modules': sorted({name for s in samples for name in s['request_modules']})
+        })
+        errors = [s['error'] for s in samples if 'error' in s]
+        if errors:
+            result['request_error'] = errors[-1]
+    return result
+
+
+def check_budget(results: Dict, import_budget_ms: float, preflight_budget_ms: float,
+                 request_budget_ms: float) -> List[str]:
+    """Return a description of every endpoint over budget."""
+    violations = []
+    for route, result in results['endpoints'].items():
+        if 'error' in result:
+            violations.append(f"{route}: {result['error']}")
+            continue
+        if result['import_ms'] > import_budget_ms:
+            violations.append(f"{route}: import {result['import_ms']} ms > {import_budget_ms:g} ms")
+        if result['preflight_ms'] > preflight_budget_ms:
+            violations.append(f"{route}: preflight {result['preflight_ms']} ms > {preflight_budget_ms:g} ms")
+        if result['preflight_status'] >= 400:
+            violations.append(f"{route}: preflight returned {result['preflight_status']}")
+        if result['heavy_modules']:
+            violations.append(f"{route}: loaded {', '.join(result['heavy_modules'])} before it needed them")
+        if 'first_request_ms' not in result:
+            continue
+        if result['first_request_ms'] > request_budget_ms:
+            violations.append(f"{route}: first request {result['first_request_ms']} ms > {request_budget_ms:g} ms")
+        if result['status'] >= 500:
+            violations.append(f"{route}: first request returned {result['status']} ({result.get('request_error')})")
+    return violations
+
+
+def print_report(results: Dict):
+    print(f"Python {results['python']}, median of {results['runs']} cold starts per endpoint")
+    print(f"   {'route':<26}{'import ms':>11}{'preflight ms':>14}{'request ms':>12}{'status':>8}  loaded by the request")
+    for route, result in results['endpoints'].items():
+        if 'error' in result:
+            print(f"   {route:<26}  ❌ {result['error']}")
+            continue
+        request_ms = result.get('first_request_ms', '-')
+        status = result.get('status', '-')
+        loaded = ', '.join(result.get('request_modules', [])) or '-'
+        print(f"   {route:<26}{result['import_ms']:>11}{result['preflight_ms']:>14}{request_ms:>12}{status:>8}  {loaded}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold-start import time and first-request latency of the API')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help='Fresh interpreters per endpoint (median is kept)')
+    parser.add_argument('--import-budget-ms', type=float, default=DEFAULT_IMPORT_BUDGET_MS,
+                        help=f'Maximum import time per endpoint (default: {DEFAULT_IMPORT_BUDGET_MS:g})')
+    parser.add_argument('--preflight-budget-ms', type=float, default=DEFAULT_PREFLIGHT_BUDGET_MS,
+                        help=f'Maximum preflight latency per endpoint (default: {DEFAULT_PREFLIGHT_BUDGET_MS:g})')
+    parser.add_argument('--request-budget-ms', type=float, default=DEFAULT_REQUEST_BUDGET_MS,
+                        help=f'Maximum first-request latency per endpoint (default: {DEFAULT_REQUEST_BUDGET_MS:g})')
+    parser.add_argument('--mongodb-uri', default=DEFAULT_MONGODB_URI,
+                        help=f'Local MongoDB stand-in for the first requests (default: {DEFAULT_MONGODB_URI})')
+    parser.add_argument('--preflight-only', action='store_true',
+                        help='Only measure import and preflight (no MongoDB needed)')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--child', nargs=2, metavar=('MODULE', 'ROUTE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, str(ROOT))
+        print(json.dumps(cold_start(*args.child, first_request=not args.preflight_only)))
+        return
+
+    first_request = not args.preflight_only
+    if first_request:
+        unreachable = mongodb_reachable(args.mongodb_uri)
+        if unreachable:
+            print(f"❌ No MongoDB at {args.mongodb_uri}: {unreachable}")
+            print("   Start a local stand-in (e.g. docker run -d -p 27017:27017 mongo:7) or pass --preflight-only")
+            sys.exit(1)
+
+    results = {
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'budget': {'import_ms': args.import_budget_ms, 'preflight_ms': args.preflight_budget_ms},
+        'endpoints': {}
+    }
+    if first_request:
+        results['budget']['first_request_ms'] = args.request_budget_ms
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = {
+            **os.environ,
+            'VERCEL': '1',
+            'PYTHONDONTWRITEBYTECODE': '1',
+            'MONGODB_URI': args.mongodb_uri,
+            'MONGODB_TLS': os.getenv('MONGODB_TLS', 'false'),
+            'EMAIL_TRANSPORT': 'stub',
+            'JWT_SECRET': os.getenv('JWT_SECRET') or 'cold-start-benchmark',
+            'IP_RANGES_FILE': str(write_lookup_ranges(Path(work_dir)))
+        }
+        env.pop('EMAIL_STUB_DIR', None)
+        for route, module_name in load_endpoints():
+            results['endpoints'][route] = {'module': module_name,
+                                           **measure_endpoint(module_name, route, args.runs, env, first_request)}
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Saved results to {args.output}")
+
+    violations = check_budget(results, args.import_budget_ms, args.preflight_budget_ms, args.request_budget_ms)
+    if violations:
+        print(f"\n❌ {len(violations)} cold-start budget violations:")
+        for violation in violations:
+            print(f"   {violation}")
+        sys.exit(1)
+    budgets = f"import ≤ {args.import_budget_ms:g} ms, preflight ≤ {args.preflight_budget_ms:g} ms"
+    if first_request:
+        budgets += f", first request ≤ {args.request_budget_ms:g} ms"
+    print(f"\n✅ All endpoints within budget ({budgets}, no heavy modules before the first request)")
+
+
+if __name__ == '__main__':
+    main()
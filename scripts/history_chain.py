@@ -0,0 +1,372 @@
+"""
+Delta-encoded Service Tags history with time-travel reconstruction.
+
+History is kept as one base snapshot followed by a chain of prefix-level
+deltas, one per run. Every CHECKPOINT_INTERVAL entries a full checkpoint is
+also written to the snapshot store, so reconstruct(date) loads one checkpoint
+and applies at most CHECKPOINT_INTERVAL - 1 deltas no matter how far back the
+date is. Because every entry after the base has a delta, diff(from, to) can
+compose them into a net change set without materializing either snapshot.
+
+Layout:
+    docs/data/chain/index.json              {"entries": [{"date", "kind", "changeNumber"}, ...]}
+    docs/data/chain/deltas/YYYY-MM-DD.json  one delta per entry after the base (see build_delta)
+    docs/data/store/snapshots/YYYY-MM-DD.json  checkpoints (see snapshot_store.py)
+
+Unlike the weekly -changes.json files, nothing here is removed by
+cleanup_old_files, so any past date stays answerable.
+"""
+
+import copy
+import json
+import logging
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from prefix_diff import parse_prefix
+from snapshot_store import SnapshotStore
+
+DEFAULT_CHAIN_DIR = Path('docs/data/chain')
+CHECKPOINT_INTERVAL = 8
+
+
+def _prefix_sort_key(prefix: str) -> Tuple:
+    """Order prefixes the way Microsoft publishes them: by family, network, then length."""
+    try:
+        family, key = parse_prefix(prefix)
+        return (family, key >> 8, key & 0xFF, prefix)
+    except ValueError:
+        return (99, 0, 0, prefix)
+
+
+def _skeleton(service: Dict) -> Dict:
+    """Copy of a tag with addressPrefixes blanked out (keeping its key position)."""
+    skeleton = copy.deepcopy(service)
+    if 'addressPrefixes' in skeleton.get('properties', {}):
+        skeleton['properties']['addressPrefixes'] = None
+    return skeleton
+
+
+def build_delta(old_data: Dict, new_data: Dict) -> Dict:
+    """Compute the prefix-level delta that turns old_data into new_data.
+
+    {
+      "header":  top-level fields of new_data (changeNumber, cloud, ...),
+      "order":   tag names in publish order (only present when it changed),
+      "added":   {name: full tag} for new tags,
+      "removed": [name, ...],
+      "changed": {name: {"tag": tag without prefixes, "added": [...], "removed": [...]}}
+    }
+    Prefixes are compared as exact strings so reconstruction is byte-for-byte.
+    """
+    old_services = {v['name']: v for v in old_data.get('values', [])}
+    new_order = [v['name'] for v in new_data.get('values', [])]
+    new_names = set(new_order)
+
+    delta = {
+        'header': {key: value for key, value in new_data.items() if key != 'values'},
+        'added': {},
+        'removed': [name for name in old_services if name not in new_names],
+        'changed': {}
+    }
+    if new_order != list(old_services):
+        delta['order'] = new_order
+
+    for service in new_data.get('values', []):
+        old_service = old_services.get(service['name'])
+        if old_service is None:
+            delta['added'][service['name']] = service
+            continue
+        if old_service == service:
+            continue
+        delta['changed'][service['name']] = build_tag_change(old_service, service)
+    return delta
+
+
+def build_tag_change(old_service: Dict, new_service: Dict) -> Dict:
+    """The "changed" delta record for one tag: its new body without prefixes plus prefix changes."""
+    old_prefixes = set(old_service.get('properties', {}).get('addressPrefixes', []))
+    new_prefixes = set(new_service.get('properties', {}).get('addressPrefixes', []))
+    return {
+        'tag': _skeleton(new_service),
+        'added': sorted(new_prefixes - old_prefixes, key=_prefix_sort_key),
+        'removed': sorted(old_prefixes - new_prefixes, key=_prefix_sort_key)
+    }
+
+
+def apply_delta(data: Dict, delta: Dict) -> Dict:
+    """Apply a delta produced by build_delta and return the new document."""
+    services = {v['name']: v for v in data.get('values', [])}
+    order = delta.get('order') or [v['name'] for v in data.get('values', [])]
+
+    for name in delta.get('removed', []):
+        services.pop(name, None)
+    services.update(delta.get('added', {}))
+
+    for name, change in delta.get('changed', {}).items():
+        prefixes = set(services[name].get('properties', {}).get('addressPrefixes', []))
+        prefixes.difference_update(change['removed'])
+        prefixes.update(change['added'])
+        service = copy.deepcopy(change['tag'])
+        service['properties']['addressPrefixes'] = sorted(prefixes, key=_prefix_sort_key)
+        services[name] = service
+
+    result = dict(delta.get('header', {}))
+    result['values'] = [services[name] for name in order if name in services]
+    return result
+
+
+def _single_tag_delta(delta: Dict, name: str) -> Dict:
+    """Restrict a delta to one tag so it can be applied to a one-tag document."""
+    single = {'removed': [name] if name in delta.get('removed', []) else [], 'added': {}, 'changed': {}}
+    if name in delta.get('added', {}):
+        single['added'][name] = delta['added'][name]
+    if name in delta.get('changed', {}):
+        single['changed'][name] = delta['changed'][name]
+    single['order'] = [name]
+    return single
+
+
+class HistoryChain:
+    """Append runs to the delta chain and reconstruct the state at any recorded date"""
+
+    def __init__(self, root: Path = DEFAULT_CHAIN_DIR, store: Optional[SnapshotStore] = None):
+        self.root = Path(root)
+        self.deltas_dir = self.root / 'deltas'
+        self.index_file = self.root / 'index.json'
+        self.store = store or SnapshotStore()
+
+    def load_index(self) -> List[Dict]:
+        if not self.index_file.exists():
+            return []
+        with open(self.index_file, 'r') as f:
+            return json.load(f).get('entries', [])
+
+    def _save_index(self, entries: List[Dict]):
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.index_file, 'w') as f:
+            json.dump({
+                'checkpoint_interval': CHECKPOINT_INTERVAL,
+                'entries': entries
+            }, f, indent=2)
+
+    def list_dates(self) -> List[str]:
+        """Return every date the chain can reconstruct, oldest first."""
+        return [entry['date'] for entry in self.load_index()]
+
+    def load_delta(self, date: str) -> Dict:
+        with open(self.deltas_dir / f'{date}.json', 'r') as f:
+            return json.load(f)
+
+    def _tail(self, date: str) -> Tuple[List[Dict], bool]:
+        """Entries a new entry for date follows, and whether it replaces one for the same date."""
+        entries = self.load_index()
+        replaced = bool(entries) and entries[-1]['date'] == date
+        if replaced:
+            entries.pop()
+        if entries and entries[-1]['date'] > date:
+            raise ValueError(f"Cannot append {date}: chain already has {entries[-1]['date']}")
+        return entries, replaced
+
+    @staticmethod
+    def _is_checkpoint_due(entries: List[Dict]) -> bool:
+        since_checkpoint = 0
+        for entry in reversed(entries):
+            if entry['kind'] == 'checkpoint':
+                break
+            since_checkpoint += 1
+        return not entries or since_checkpoint >= CHECKPOINT_INTERVAL - 1
+
+    def checkpoint_due(self, date: str) -> bool:
+        """Whether appending date will write a full checkpoint to the snapshot store."""
+        return self._is_checkpoint_due(self._tail(date)[0])
+
+    def _record(self, entries: List[Dict], date: str, change_number, delta: Optional[Dict],
+                write_checkpoint: Callable[[], object]) -> Dict:
+        entry = {'date': date, 'changeNumber': change_number}
+        if delta is not None:
+            self.deltas_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.deltas_dir / f'{date}.json', 'w') as f:
+                json.dump(delta, f, separators=(',', ':'))
+            logging.info(f"Saved history delta {date} ({len(delta['changed'])} changed, "
+                         f"{len(delta['added'])} added, {len(delta['removed'])} removed tags)")
+
+        if self._is_checkpoint_due(entries):
+            entry['kind'] = 'checkpoint'
+            write_checkpoint()
+        else:
+            entry['kind'] = 'delta'
+
+        entries.append(entry)
+        self._save_index(entries)
+        return entry
+
+    def append(self, date: str, data: Dict, previous: Optional[Dict] = None) -> Dict:
+        """Record the state for a date as a delta, or as a checkpoint when one is due.
+
+        previous must be the state of the latest chain entry; it is reconstructed
+        when not given. Re-running for the latest recorded date replaces that entry.
+        Returns the index entry that was written.
+        """
+        entries, replaced = self._tail(date)
+        delta = None
+        if entries:
+            if previous is None or replaced:
+                previous = self.reconstruct(entries[-1]['date'])
+            delta = build_delta(previous, data)
+        return self._record(entries, date, data.get('changeNumber'), delta,
+                            lambda: self.store.write_snapshot(date, data))
+
+    def append_delta(self, date: str, delta: Dict, base_change_number,
+                     checkpoint_tags: Optional[List[List[str]]] = None) -> Optional[Dict]:
+        """Record a delta computed elsewhere (e.g. while streaming) against base_change_number.
+
+        checkpoint_tags is the [[name, hash], ...] manifest to write if a checkpoint
+        is due; the tag objects must already be in the store. Returns None, writing
+        nothing, when the delta does not apply to the chain head (a re-run of the
+        same date, a different base, or a missing checkpoint manifest), in which
+        case the caller should fall back to append().
+        """
+        entries, replaced = self._tail(date)
+        if replaced or (entries and entries[-1]['changeNumber'] != base_change_number):
+            return None
+        if self._is_checkpoint_due(entries) and checkpoint_tags is None:
+            return None
+        return self._record(entries, date, delta['header'].get('changeNumber'),
+                            delta if entries else None,
+                            lambda: self.store.write_manifest(date, delta['header'], checkpoint_tags))
+
+    def reconstruct(self, date: Optional[str] = None) -> Optional[Dict]:
+        """Materialize the Service Tags document as it was on a date (latest when None).
+
+        Dates between runs resolve to the most recent entry on or before them.
+        Returns None when the chain has nothing that early.
+        """
+        entries = self.load_index()
+        if date is not None:
+            entries = [entry for entry in entries if entry['date'] <= date]
+        if not entries:
+            return None
+
+        start = max(i for i, entry in enumerate(entries) if entry['kind'] == 'checkpoint')
+        data = self.store.read_snapshot(entries[start]['date'])
+        if data is None:
+            raise FileNotFoundError(f"Missing checkpoint {entries[start]['date']}")
+        for entry in entries[start + 1:]:
+            data = apply_delta(data, self.load_delta(entry['date']))
+        return data
+
+    def _resolve(self, date: str) -> int:
+        """Index of the latest entry on or before a date."""
+        entries = self.load_index()
+        positions = [i for i, entry in enumerate(entries) if entry['date'] <= date]
+        if not positions:
+            raise ValueError(f"No history recorded on or before {date}")
+        return positions[-1]
+
+    def reconstruct_tag(self, name: str, date: str) -> Optional[Dict]:
+        """Materialize a single tag as it was on a date, or None if it did not exist.
+
+        Only the checkpoint manifest, one tag object and the deltas are read.
+        """
+        entries = self.load_index()[:self._resolve(date) + 1]
+        start = max(i for i, entry in enumerate(entries) if entry['kind'] == 'checkpoint')
+        manifest = self.store.read_manifest(entries[start]['date']) or {}
+        tag_hash = dict(manifest.get('tags', [])).get(name)
+        service = self.store.get_object(tag_hash) if tag_hash else None
+        for entry in entries[start + 1:]:
+            service = apply_delta({'values': [service] if service else []},
+                                  _single_tag_delta(self.load_delta(entry['date']), name)).get('values')
+            service = service[0] if service else None
+        return service
+
+    def diff(self, from_date: str, to_date: Optional[str] = None) -> List[Dict]:
+        """Compose the stored deltas between two dates into one net change per tag.
+
+        Returns records in the same shape as detect_changes (ip_changes,
+        service_added, service_removed). Prefixes added and removed again inside
+        the range cancel out, as do tags that appeared and disappeared. Neither
+        full snapshot is loaded; only the deltas in (from_date, to_date] are read.
+        """
+        entries = self.load_index()
+        start = self._resolve(from_date)
+        end = len(entries) - 1 if to_date is None else self._resolve(to_date)
+
+        # name -> {'existed': bool, 'present': bool, 'added': set, 'removed': set, 'tag': latest tag}
+        net: Dict[str, Dict] = {}
+        for entry in entries[start + 1:end + 1]:
+            delta = self.load_delta(entry['date'])
+            for name in delta.get('removed', []):
+                record = net.setdefault(name, {'existed': True, 'added': set(), 'removed': set(), 'tag': None})
+                record['present'] = False
+            for name, service in delta.get('added', {}).items():
+                prefixes = set(service.get('properties', {}).get('addressPrefixes', []))
+                record = net.get(name)
+                if record is not None and record['existed']:
+                    # Removed and re-added: compare against the tag as it was at from_date
+                    original = self.reconstruct_tag(name, entries[start]['date']) or {}
+                    original_prefixes = set(original.get('properties', {}).get('addressPrefixes', []))
+                    record.update(present=True, tag=service,
+                                  added=prefixes - original_prefixes, removed=original_prefixes - prefixes)
+                else:
+                    net[name] = {'existed': False, 'present': True, 'added': prefixes, 'removed': set(), 'tag': service}
+            for name, change in delta.get('changed', {}).items():
+                record = net.setdefault(name, {'existed': True, 'present': True, 'added': set(), 'removed': set()})
+                record['tag'] = change['tag']
+                for prefix in change['added']:
+                    if prefix in record['removed']:
+                        record['removed'].discard(prefix)
+                    else:
+                        record['added'].add(prefix)
+                for prefix in change['removed']:
+                    if prefix in record['added']:
+                        record['added'].discard(prefix)
+                    else:
+                        record['removed'].add(prefix)
+
+        changes = []
+        removed = []
+        for name, record in net.items():
+            if record['existed'] and not record['present']:
+                tag = record['tag'] or self.reconstruct_tag(name, entries[start]['date']) or {}
+                removed.append({
+                    'type': 'service_removed',
+                    'service': name,
+                    'region': tag.get('properties', {}).get('region'),
+                    'system_service': tag.get('properties', {}).get('systemService')
+                })
+            elif not record['existed'] and record['present']:
+                properties = record['tag'].get('properties', {})
+                changes.append({
+                    'type': 'service_added',
+                    'service': name,
+                    'ip_count': len(record['added']),
+                    'region': properties.get('region'),
+                    'system_service': properties.get('systemService')
+                })
+            elif record['existed'] and (record['added'] or record['removed']):
+                properties = record['tag'].get('properties', {})
+                changes.append({
+                    'type': 'ip_changes',
+                    'service': name,
+                    'added_prefixes': sorted(record['added']),
+                    'removed_prefixes': sorted(record['removed']),
+                    'added_count': len(record['added']),
+                    'removed_count': len(record['removed']),
+                    'region': properties.get('region'),
+                    'system_service': properties.get('systemService')
+                })
+        return changes + removed
+
+    def import_snapshots(self, snapshots: Iterable[Tuple[str, Dict]]) -> int:
+        """Append (date, data) pairs newer than the chain head, oldest first."""
+        imported = 0
+        previous = None
+        for date, data in snapshots:
+            entries = self.load_index()
+            if entries and date <= entries[-1]['date']:
+                continue
+            self.append(date, data, previous=previous)
+            previous = data
+            imported += 1
+        return imported
@@ -0,0 +1,497 @@
+"""
+Longest-prefix-match IP lookup index for Azure Service Tags.
+
+Every address prefix of a snapshot is inserted into a path-compressed binary
+(Patricia) trie, one per address family. A lookup walks from the root towards
+the queried address and collects every node on the way that carries tags, so
+the answer lists all covering prefixes - from AzureCloud down to the most
+specific regional tag - in at most 33 (IPv4) or 129 (IPv6) steps.
+
+The trie is flattened into column arrays and saved as a single binary file
+next to summary.json:
+
+    8 bytes   magic b'STIDX\\x00\\x01\\x00'
+    4 bytes   header length (uint32, little-endian)
+    n bytes   JSON header: changeNumber, cloud, tags [[name, region, systemService]],
+              tag_sets [[tag id, ...]], and the node count of each family
+    ...       per family (IPv4 then IPv6), padded to 4 bytes:
+              left, right, tag_set (uint32 each, 0xFFFFFFFF = none),
+              prefix length (uint8), network (4 or 16 bytes big-endian)
+
+The API (/api/lookup) answers from a second file derived from the tries,
+ip-ranges.bin, laid out to be memory-mapped and searched without parsing:
+every tagged prefix as a range sorted by (start, length), binary-searched on
+its start, with a pointer to the nearest enclosing range so all covering
+prefixes are found by following parents. Each (prefix, tag) pair also carries
+the date it first appeared, carried forward from the previous ip-ranges.bin.
+
+    8 bytes   magic b'STRNG\x00\x01\x00'
+    4 bytes   header length (uint32, little-endian)
+    n bytes   JSON header, padded to 8 bytes: changeNumber, cloud, trackedSince,
+              tags, dates [first-seen dates], and columns {name: [offset, typecode,
+              count]} with offsets relative to the end of the header
+    ...       little-endian columns, each padded to 8 bytes:
+              4.lo (uint32) / 6.hi, 6.lo (uint64)   range start
+              <family>.length (uint8), <family>.parent (uint32, 0xFFFFFFFF = none),
+              <family>.entries (uint32, count + 1 offsets into the entry columns)
+              entry_tag (uint32 tag id), entry_date (uint16 index into dates)
+"""
+
+import ipaddress
+import json
+import logging
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, chain
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple
+
+from prefix_diff import parse_prefix
+
+DEFAULT_INDEX_FILE = Path('docs/data/ip-index.bin')
+DEFAULT_RANGES_FILE = Path('docs/data/ip-ranges.bin')
+
+MAGIC = b'STIDX\x00\x01\x00'
+# Read by api/ip_ranges.py; keep the two in sync
+RANGES_MAGIC = b'STRNG\x00\x01\x00'
+NONE = 0xFFFFFFFF
+# Bits of a pending entry that hold the tag id (keys are at most 136 bits, 40 for IPv4)
+TAG_BITS = 20
+TAG_MASK = (1 << TAG_BITS) - 1
+_BITS = {4: 32, 6: 128}
+
+
+class _FamilyTrie:
+    """Flattened Patricia trie for one address family"""
+
+    __slots__ = ('bits', 'width', 'left', 'right', 'tag_set', 'length', 'network')
+
+    def __init__(self, family: int):
+        self.bits = _BITS[family]
+        self.width = self.bits // 8
+        self.left = array('I')
+        self.right = array('I')
+        self.tag_set = array('I')
+        self.length = array('B')
+        self.network: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.length)
+
+    def build(self, items: List[Tuple[int, int, int]]):
+        """Build from (network, prefix_length, tag_set) tuples with unique (network, length)."""
+        items.sort()
+        if items:
+            self._build(items, 0, len(items))
+
+    def _build(self, items: List[Tuple[int, int, int]], lo: int, hi: int) -> int:
+        bits = self.bits
+        first, last = items[lo][0], items[hi - 1][0]
+        common = bits - (first ^ last).bit_length()
+        length = min(common, min(items[i][1] for i in range(lo, hi)))
+        network = first >> (bits - length) << (bits - length) if length else 0
+
+        node = len(self.length)
+        self.left.append(NONE)
+        self.right.append(NONE)
+        self.tag_set.append(NONE)
+        self.length.append(length)
+        self.network.append(network)
+
+        # Items are sorted by (network, length), so the one equal to this node comes first
+        if items[lo][1] == length:
+            self.tag_set[node] = items[lo][2]
+            lo += 1
+        if lo < hi and length < bits:
+            split = bisect_left(items, (network | (1 << (bits - 1 - length)), -1), lo, hi)
+            if lo < split:
+                self.left[node] = self._build(items, lo, split)
+            if split < hi:
+                self.right[node] = self._build(items, split, hi)
+        return node
+
+    def walk(self, network: int, length: int) -> List[Tuple[int, int, int]]:
+        """Return (node network, node length, tag_set) for every tagged prefix covering the query."""
+        bits = self.bits
+        matches = []
+        node = 0 if len(self.length) else NONE
+        while node != NONE:
+            node_length = self.length[node]
+            if node_length > length:
+                break
+            if node_length and (network ^ self.network[node]) >> (bits - node_length):
+                break
+            if self.tag_set[node] != NONE:
+                matches.append((self.network[node], node_length, self.tag_set[node]))
+            if node_length == bits:
+                break
+            if (network >> (bits - 1 - node_length)) & 1:
+                node = self.right[node]
+            else:
+                node = self.left[node]
+        return matches
+
+    def ranges(self) -> Tuple[List[int], array]:
+        """Return the tagged nodes in (network, length) order and the parent of each.
+
+        parent is the position, in this order, of the nearest tagged node above
+        it (the most specific enclosing prefix), or NONE.
+        """
+        # _build numbers nodes in pre-order, lower addresses first, which is (network, length) order
+        nodes = [node for node, tag_set in enumerate(self.tag_set) if tag_set != NONE]
+        bits, network, length = self.bits, self.network, self.length
+        parents = array('I')
+        # The innermost range containing the current one, starting from one that contains everything
+        enclosing, top_network, top_shift, top = [], 0, bits, NONE
+        last_network = last_shift = 0
+        for position, node in enumerate(nodes):
+            node_network = network[node]
+            if position and not (node_network ^ last_network) >> last_shift:
+                enclosing.append((top_network, top_shift, top))
+                top_network, top_shift, top = last_network, last_shift, position - 1
+            else:
+                while (node_network ^ top_network) >> top_shift:
+                    top_network, top_shift, top = enclosing.pop()
+            parents.append(top)
+            last_network, last_shift = node_network, bits - length[node]
+        return nodes, parents
+
+    def write_to(self, f: BinaryIO) -> int:
+        """Write the node columns to a binary file and return the number of bytes written."""
+        written = 0
+        for column in (self.left, self.right, self.tag_set):
+            if sys.byteorder == 'big':
+                column = array('I', column)
+                column.byteswap()
+            written += f.write(column.tobytes())
+        written += f.write(self.length.tobytes())
+        written += f.write(b'\x00' * (-written % 4))
+        width = self.width
+        for start in range(0, len(self.network), 4096):
+            written += f.write(b''.join(network.to_bytes(width, 'big')
+                                        for network in self.network[start:start + 4096]))
+        return written + f.write(b'\x00' * (-written % 4))
+
+    def from_bytes(self, blob: bytes, offset: int, count: int) -> int:
+        """Load count nodes starting at offset and return the offset after them."""
+        for column in (self.left, self.right, self.tag_set):
+            column.frombytes(blob[offset:offset + 4 * count])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            offset += 4 * count
+        self.length.frombytes(blob[offset:offset + count])
+        offset += count + (-count % 4)
+        width = self.width
+        self.network = [int.from_bytes(blob[offset + i * width:offset + (i + 1) * width], 'big')
+                        for i in range(count)]
+        offset += width * count
+        return offset + (-offset % 4)
+
+
+class IPIndex:
+    """Answer "which service tags cover this IP/CIDR?" from a snapshot or a saved index"""
+
+    def __init__(self):
+        self.change_number = None
+        self.cloud = None
+        self.tags: List[List[str]] = []
+        self.tag_sets: List[List[int]] = []
+        self.tries = {4: _FamilyTrie(4), 6: _FamilyTrie(6)}
+        # (key << TAG_BITS) | tag id per prefix, collected by add() until finish()
+        self._pending = {4: array('Q'), 6: []}
+
+    @classmethod
+    def build(cls, data: Dict) -> 'IPIndex':
+        """Build the index from a full Service Tags document."""
+        index = cls()
+        index.change_number = data.get('changeNumber')
+        index.cloud = data.get('cloud')
+        for service in data.get('values', []):
+            index.add(service)
+        return index.finish()
+
+    def add(self, service: Dict):
+        """Add one tag; call finish() once every tag has been added."""
+        tag_id = len(self.tags)
+        if tag_id > TAG_MASK:
+            raise ValueError(f"Too many service tags for the index ({tag_id + 1})")
+        properties = service.get('properties', {})
+        self.tags.append([service['name'], properties.get('region', ''), properties.get('systemService', '')])
+        for prefix in properties.get('addressPrefixes', []):
+            try:
+                # Bypass the memo: every prefix is seen once here and caching would pin them all
+                family, key = parse_prefix.__wrapped__(prefix)
+            except ValueError:
+                logging.warning(f"Skipping unparsable prefix {prefix!r} in {service['name']}")
+                continue
+            self._pending[family].append((key << TAG_BITS) | tag_id)
+
+    def finish(self) -> 'IPIndex':
+        """Build the tries from the tags added so far."""
+        # Many prefixes are shared by the same group of tags; store each group once
+        tag_set_ids: Dict[Tuple[int, ...], int] = {}
+        for family, trie in self.tries.items():
+            items = []
+            key, tag_ids = None, []
+            for entry in sorted(self._pending[family]) + [None]:
+                entry_key = None if entry is None else entry >> TAG_BITS
+                if entry_key != key and tag_ids:
+                    tag_set = tag_set_ids.setdefault(tuple(tag_ids), len(tag_set_ids))
+                    items.append((key >> 8, key & 0xFF, tag_set))
+                    tag_ids = []
+                if entry is None:
+                    break
+                key = entry_key
+                tag_id = entry & TAG_MASK
+                if not tag_ids or tag_ids[-1] != tag_id:
+                    tag_ids.append(tag_id)
+            self._pending[family] = array('Q') if family == 4 else []
+            trie.build(items)
+        self.tag_sets = [list(tag_ids) for tag_ids in tag_set_ids]
+        return self
+
+    def save(self, path: Path = DEFAULT_INDEX_FILE) -> int:
+        """Write the index as a binary file and return its size in bytes."""
+        header = json.dumps({
+            'changeNumber': self.change_number,
+            'cloud': self.cloud,
+            'tags': self.tags,
+            'tag_sets': self.tag_sets,
+            'nodes': {str(family): len(trie) for family, trie in self.tries.items()}
+        }, separators=(',', ':')).encode('utf-8')
+        header += b' ' * (-len(header) % 4)
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            size = f.write(MAGIC + struct.pack('<I', len(header)) + header)
+            for family in (4, 6):
+                size += self.tries[family].write_to(f)
+        logging.info(f"Saved {path} ({len(self.tries[4])} IPv4 + {len(self.tries[6])} IPv6 nodes, {size} bytes)")
+        return size
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_INDEX_FILE) -> 'IPIndex':
+        """Load an index written by save()."""
+        with open(path, 'rb') as f:
+            blob = f.read()
+        if blob[:8] != MAGIC:
+            raise ValueError(f"{path} is not a service tags IP index")
+        header_length, = struct.unpack_from('<I', blob, 8)
+        header = json.loads(blob[12:12 + header_length])
+
+        index = cls()
+        index.change_number = header.get('changeNumber')
+        index.cloud = header.get('cloud')
+        index.tags = header['tags']
+        index.tag_sets = header['tag_sets']
+        offset = 12 + header_length
+        for family in (4, 6):
+            offset = index.tries[family].from_bytes(blob, offset, header['nodes'][str(family)])
+        return index
+
+    def save_ranges(self, path: Path = DEFAULT_RANGES_FILE, today: Optional[str] = None) -> int:
+        """Write the memory-mappable range file served by /api/lookup and return its size in bytes.
+
+        First-seen dates are carried forward from the file being replaced; pairs
+        not in it are dated today. Without a previous file every pair is dated
+        today and trackedSince records that dates start there.
+        """
+        path = Path(path)
+        previous = _PreviousRanges(path)
+        tracked_since = previous.tracked_since or today
+        # Tag ids and dates of the previous file, renumbered as in this one
+        tag_ids = {tag[0]: tag_id for tag_id, tag in enumerate(self.tags)}
+        previous_tag_ids = [tag_ids.get(name, NONE) for name, _, _ in previous.tags]
+
+        dates: Dict[str, int] = {today: 0}
+        previous_dates = [dates.setdefault(date, len(dates)) for date in previous.dates]
+        if len(dates) > 0xFFFF:
+            # entry_date stores date indexes as 16-bit integers
+            previous.close()
+            raise ValueError(f"Too many first-seen dates for the range file ({len(dates)})")
+        columns: Dict[str, array] = {}
+        entry_tag, entry_date = array('I'), array('H')
+        for family, trie in self.tries.items():
+            nodes, parent = trie.ranges()
+            networks = [trie.network[node] for node in nodes]
+            length = array('B', [trie.length[node] for node in nodes])
+            tag_sets = [self.tag_sets[trie.tag_set[node]] for node in nodes]
+            if family == 6:
+                columns['6.hi'] = array('Q', [network >> 64 for network in networks])
+                columns['6.lo'] = array('Q', [network & 0xFFFFFFFFFFFFFFFF for network in networks])
+            else:
+                columns['4.lo'] = array('I', networks)
+            entries = array('I', accumulate(map(len, tag_sets), initial=len(entry_tag)))
+            columns.update({f'{family}.length': length, f'{family}.parent': parent, f'{family}.entries': entries})
+            entry_tag.extend(chain.from_iterable(tag_sets))
+
+            # Both files list ranges in (start, length) order, so one forward pass pairs them up
+            seen_network, seen_length, seen_entries = previous.ranges(family)
+            seen, seen_count = 0, len(seen_length)
+            for network, prefix_length, tag_set in zip(networks, length, tag_sets):
+                # Most ranges are unchanged, so the next previous range is usually the same one
+                if seen < seen_count and (seen_network[seen] != network or seen_length[seen] != prefix_length):
+                    seen = bisect_left(seen_network, network, seen)
+                    while seen < seen_count and seen_network[seen] == network and seen_length[seen] < prefix_length:
+                        seen += 1
+                if seen == seen_count or seen_network[seen] != network or seen_length[seen] != prefix_length:
+                    entry_date.extend([0] * len(tag_set))
+                    continue
+                first, end = seen_entries[seen], seen_entries[seen + 1]
+                seen += 1
+                for tag_id in tag_set:
+                    for entry in range(first, end):
+                        if previous_tag_ids[previous.entry_tag[entry]] == tag_id:
+                            entry_date.append(previous_dates[previous.entry_date[entry]])
+                            break
+                    else:
+                        entry_date.append(0)
+        columns.update({'entry_tag': entry_tag, 'entry_date': entry_date})
+        # The file is rewritten in place below; let go of the mapping first
+        previous.close()
+
+        layout, offset = {}, 0
+        for name, column in columns.items():
+            layout[name] = [offset, column.typecode, len(column)]
+            offset += len(column) * column.itemsize
+            offset += -offset % 8
+        header = json.dumps({
+            'changeNumber': self.change_number,
+            'cloud': self.cloud,
+            'trackedSince': tracked_since,
+            'tags': self.tags,
+            'dates': list(dates),
+            'columns': layout
+        }, separators=(',', ':')).encode('utf-8')
+        header += b' ' * (-(12 + len(header)) % 8)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            size = f.write(RANGES_MAGIC + struct.pack('<I', len(header)) + header)
+            for column in columns.values():
+                if sys.byteorder == 'big':
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                written = f.write(column.tobytes())
+                size += written + f.write(b'\x00' * (-written % 8))
+        ranges = len(columns['4.length']) + len(columns['6.length'])
+        logging.info(f"Saved {path} ({ranges} ranges, {len(entry_tag)} tag entries, {size} bytes)")
+        return size
+
+    def lookup(self, query: str) -> List[Dict]:
+        """Return every service tag covering an IPv4/IPv6 address or CIDR, most specific first.
+
+        Each match is {'service', 'region', 'system_service', 'prefix'}. For a CIDR
+        only prefixes covering the whole range are returned. Raises ValueError
+        for anything that is not an address or prefix.
+        """
+        family, key = parse_prefix(query)
+        trie = self.tries[family]
+        matches = []
+        for network, length, tag_set in reversed(trie.walk(key >> 8, key & 0xFF)):
+            prefix = f"{_format_network(family, network)}/{length}"
+            for tag_id in self.tag_sets[tag_set]:
+                name, region, system_service = self.tags[tag_id]
+                matches.append({
+                    'service': name,
+                    'region': region,
+                    'system_service': system_service,
+                    'prefix': prefix
+                })
+        return matches
+
+
+def _format_network(family: int, network: int) -> str:
+    if family == 4:
+        return str(ipaddress.IPv4Address(network))
+    return str(ipaddress.IPv6Address(network))
+
+
+class _PreviousRanges:
+    """The range file being replaced, memory-mapped so save_ranges can read its first-seen dates.
+
+    Its sorted columns are read in place, the way api/ip_ranges.py serves them,
+    and merge-joined with the new ranges; only the IPv6 starts are joined into
+    integers. A missing or unusable file reads as empty, so dating starts over.
+    """
+
+    def __init__(self, path: Path):
+        self.tracked_since = None
+        self.tags: List[List[str]] = []
+        self.dates: List[str] = []
+        self.entry_tag = self.entry_date = ()
+        self._columns = {}
+        self._map = self._view = None
+        try:
+            with open(path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: an empty file cannot be mapped
+            return
+        if self._map[:8] != RANGES_MAGIC:
+            logging.warning(f"{path} is not a service tags range file; first-seen dates start over")
+            self.close()
+            return
+        header_length, = struct.unpack_from('<I', self._map, 8)
+        header = json.loads(self._map[12:12 + header_length])
+        self.tracked_since = header.get('trackedSince')
+        self.tags = header['tags']
+        self.dates = header['dates']
+
+        base = 12 + header_length
+        self._view = memoryview(self._map)
+        for name, (offset, typecode, count) in header['columns'].items():
+            column = self._view[base + offset:base + offset + count * struct.calcsize(typecode)].cast(typecode)
+            if sys.byteorder == 'big':
+                column = array(typecode, column)
+                column.byteswap()
+            self._columns[name] = column
+        self.entry_tag = self._columns['entry_tag']
+        self.entry_date = self._columns['entry_date']
+
+    def ranges(self, family: int) -> Tuple[Sequence[int], Sequence[int], Sequence[int]]:
+        """Return the network, length and entries columns of a family, in file order."""
+        columns = self._columns
+        if f'{family}.length' not in columns:
+            return (), (), ()
+        network = columns[f'{family}.lo']
+        if family == 6:
+            # Only IPv6 starts are split in two; join them so the networks can be binary-searched
+            network = [high << 64 | low for high, low in zip(columns['6.hi'], network)]
+        return network, columns[f'{family}.length'], columns[f'{family}.entries']
+
+    def close(self):
+        """Release the columns and unmap the file"""
+        for column in self._columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self._columns = {}
+        self.entry_tag = self.entry_date = ()
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+def build_ip_index(data: Dict, path: Path = DEFAULT_INDEX_FILE) -> IPIndex:
+    """Build the lookup index for a snapshot and save it next to summary.json."""
+    index = IPIndex.build(data)
+    index.save(path)
+    return index
+
+
+_loaded: Optional[IPIndex] = None
+
+
+def lookup(query: str, path: Path = DEFAULT_INDEX_FILE) -> List[Dict]:
+    """Look up an address or CIDR in the saved index (loaded once per process)."""
+    global _loaded
+    if _loaded is None:
+        _loaded = IPIndex.load(path)
+    return _loaded.lookup(query)
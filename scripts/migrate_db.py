@@ -0,0 +1,62 @@
+"""
+Apply the database schema (indexes) declared in api/schema.py
+Run once after deploying a new SCHEMA_VERSION; a no-op when it is current.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from api import db_config
+from api.schema import SCHEMA_VERSION, migrate, schema_status
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Create and verify the declared MongoDB indexes')
+    parser.add_argument('--check', action='store_true',
+                        help='Only report the recorded version and missing indexes (exit 1 if out of date)')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-apply the indexes even if the recorded version is current')
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("🗄️ Database Schema Migration")
+    print("="*60 + "\n")
+
+    if not db_config.connect(verify=True):
+        print("❌ Failed to connect to database")
+        return 1
+
+    try:
+        if args.check:
+            status = schema_status()
+            print(f"📋 Recorded version: {status['version']} (expected {status['expected_version']})")
+            for collection, names in status['missing'].items():
+                print(f"   ⚠️ {collection}: missing {', '.join(names)}")
+            print("\n✅ Schema is up to date" if status['up_to_date'] else "\n⚠️ Schema is out of date")
+            return 0 if status['up_to_date'] else 1
+
+        result = migrate(force=args.force)
+        if not result['success']:
+            print(f"❌ Migration failed: {result['error']}")
+            for collection, names in result.get('missing', {}).items():
+                print(f"   - {collection}: missing {', '.join(names)}")
+            return 1
+
+        if not result['migrated']:
+            print(f"✅ Schema already at version {SCHEMA_VERSION}, nothing to do")
+        else:
+            if result['deduplicated']:
+                print(f"🧹 Unsubscribed {result['deduplicated']} duplicate active subscriptions (kept the newest per email)")
+            for collection, names in result['created'].items():
+                print(f"   - {collection}: {', '.join(names)}")
+            print(f"\n✅ Schema migrated to version {result['version']} (was {result['previous_version']})")
+        return 0
+
+    finally:
+        db_config.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+Per-phase run metrics for the watcher.
+
+A RunMetrics records, for each phase of an update (metadata fetch, download,
+parse, diff, each file write, ...), its wall time, CPU time and - when
+tracemalloc is tracing - the peak traced memory reached during the phase.
+Counters (bytes downloaded and written, tags and prefixes processed) and the
+size of every file written are collected alongside.
+
+Tracing slows allocation-heavy phases several times over, so it is opt-in
+(azure_watcher.py --trace-memory). Without it the run's peak memory is the
+process's maximum resident set size from getrusage, which costs nothing but
+has no per-phase breakdown.
+
+    metrics = RunMetrics('Public')
+    with metrics.phase('download'):
+        ...
+    metrics.count('bytes_downloaded', size)
+    metrics.save(data_dir / 'run-metrics.json')
+
+CPU time is the calling thread's, so clouds updated concurrently each report
+their own. Both kinds of peak are process-wide: with several clouds in flight a
+peak includes what the other threads allocated at the same time.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+METRICS_FILE = 'run-metrics.json'
+PROMETHEUS_PREFIX = 'service_tags'
+
+# Phase peaks are measured by resetting the tracemalloc peak, which is global
+_peak_lock = threading.Lock()
+
+
+def max_rss_bytes() -> Optional[int]:
+    """Peak resident set size of this process so far, or None where getrusage is unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RunMetrics:
+    """Phase timings, peak memory, counters and written file sizes of one update"""
+
+    def __init__(self, cloud: str = 'Public', trace_memory: bool = True):
+        self.cloud = cloud
+        # Phase peaks reset the tracemalloc peak; turn off when the caller measures it itself
+        self.trace_memory = trace_memory
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.status = 'running'
+        self.phases: List[Dict] = []
+        self.counters: Dict[str, int] = {}
+        self.files: Dict[str, int] = {}
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.thread_time()
+        self._stack: List[Dict] = []
+        self._peak = 0
+        self.finished: Optional[Dict] = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Measure the enclosed block; nested phases are recorded as 'outer/inner'."""
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            self._fold_peak()
+        if self._stack:
+            name = f"{self._stack[-1]['name']}/{name}"
+        frame = {'name': name, 'peak': 0}
+        # Listed in start order, so an outer phase comes before its nested ones
+        record = {'name': frame['name']}
+        self.phases.append(record)
+        self._stack.append(frame)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            record['wall_seconds'] = round(time.perf_counter() - wall, 4)
+            record['cpu_seconds'] = round(time.thread_time() - cpu, 4)
+            if tracing and tracemalloc.is_tracing():
+                self._fold_peak()
+                record['peak_memory_bytes'] = frame['peak']
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], frame['peak'])
+
+    def _fold_peak(self):
+        """Credit the peak since the last reset to every open phase, then reset it."""
+        with _peak_lock:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+        self._peak = max(self._peak, peak)
+        for frame in self._stack:
+            frame['peak'] = max(frame['peak'], peak)
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def wrote(self, path: Path, root: Optional[Path] = None):
+        """Record the size of a file just written (and add it to bytes_written)."""
+        path = Path(path)
+        size = path.stat().st_size
+        key = path.relative_to(root).as_posix() if root else path.as_posix()
+        self.files[key] = self.files.get(key, 0) + size
+        self.count('bytes_written', size)
+
+    def finish(self, status: str) -> Dict:
+        """Stop the run clock and return the report."""
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            self._fold_peak()
+        self.status = status
+        self.finished = {
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'wall_seconds': round(time.perf_counter() - self._start_wall, 4),
+            'cpu_seconds': round(time.thread_time() - self._start_cpu, 4),
+            'peak_memory_bytes': self._peak if tracing else max_rss_bytes(),
+            'peak_memory_source': 'tracemalloc' if tracing else 'max_rss'
+        }
+        return self.to_dict()
+
+    def to_dict(self) -> Dict:
+        return {
+            'cloud': self.cloud,
+            'status': self.status,
+            'started_at': self.started_at,
+            **(self.finished or {}),
+            'phases': self.phases,
+            'counters': self.counters,
+            'files': self.files
+        }
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _merge_phases(phases: List[Dict]) -> Dict[str, Dict]:
+    """One entry per phase name (a retried phase is summed), as Prometheus series must be unique."""
+    merged = {}
+    for phase in phases:
+        if 'wall_seconds' not in phase:
+            continue  # still running
+        total = merged.setdefault(phase['name'], {'wall_seconds': 0, 'cpu_seconds': 0})
+        total['wall_seconds'] = round(total['wall_seconds'] + phase['wall_seconds'], 4)
+        total['cpu_seconds'] = round(total['cpu_seconds'] + phase['cpu_seconds'], 4)
+        if 'peak_memory_bytes' in phase:
+            total['peak_memory_bytes'] = max(total.get('peak_memory_bytes', 0), phase['peak_memory_bytes'])
+    return merged
+
+
+def prometheus_text(runs: List[RunMetrics]) -> str:
+    """Render runs in the Prometheus text exposition format (for the node_exporter textfile collector)."""
+    series: Dict[str, List[str]] = {}
+    help_text = {}
+
+    def add(name: str, help_line: str, labels: Dict[str, str], value):
+        if value is None:
+            return
+        metric = f'{PROMETHEUS_PREFIX}_{name}'
+        help_text[metric] = help_line
+        label_text = ','.join(f'{key}="{_label(str(label))}"' for key, label in labels.items())
+        series.setdefault(metric, []).append(f'{metric}{{{label_text}}} {value}')
+
+    for run in runs:
+        report = run.to_dict()
+        cloud = {'cloud': run.cloud}
+        add('run_success', 'Whether the last run succeeded (1) or failed (0)', cloud,
+            0 if run.status == 'failed' else 1)
+        add('run_timestamp_seconds', 'Unix time the last run finished', cloud,
+            round(datetime.fromisoformat(report['finished_at']).timestamp()) if 'finished_at' in report else None)
+        add('run_wall_seconds', 'Wall time of the last run', cloud, report.get('wall_seconds'))
+        add('run_cpu_seconds', 'CPU time of the last run', cloud, report.get('cpu_seconds'))
+        add('run_peak_memory_bytes', 'Peak memory of the last run (traced, or process max RSS)', cloud,
+            report.get('peak_memory_bytes'))
+        for name, phase in _merge_phases(run.phases).items():
+            labels = {**cloud, 'phase': name}
+            add('phase_wall_seconds', 'Wall time of a run phase', labels, phase['wall_seconds'])
+            add('phase_cpu_seconds', 'CPU time of a run phase', labels, phase['cpu_seconds'])
+            add('phase_peak_memory_bytes', 'Peak traced memory of a run phase', labels,
+                phase.get('peak_memory_bytes'))
+        for name, value in run.counters.items():
+            add(f'run_{_metric_name(name)}', f'{name.replace("_", " ").capitalize()} in the last run', cloud, value)
+
+    lines = []
+    for metric, samples in series.items():
+        lines.append(f'# HELP {metric} {help_text[metric]}')
+        lines.append(f'# TYPE {metric} gauge')
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_textfile(path: Path, runs: List[RunMetrics]):
+    """Write the textfile atomically so the collector never reads a partial file."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w') as f:
+        f.write(prometheus_text(runs))
+    os.replace(tmp, path)
@@ -1,12 +1,22 @@
 """
 Send Email Notifications for Azure Service Tags Changes
 Run this script when changes are detected to notify subscribers.
+
+Recipients are queued in the notification outbox (one job per change set and
+recipient) and sent from there, so rerunning after a crash only sends what is
+still pending. Extra workers can drain the same change set in parallel with
+--drain-only.
 """
 
+import argparse
 import json
 import sys
 from pathlib import Path
 from api import db_config, SubscriptionManager, EmailService
+from api.change_index import ChangeIndex
+from api.email_service import MAX_PERSONALIZATIONS
+from api.notification_outbox import NotificationOutbox, default_worker_id
+from api.subscription_manager import NOTIFICATION_PROJECTION
 
 
 def load_changes():
@@ -34,7 +44,76 @@ def load_changes():
     return changes
 
 
-def send_notifications():
+def iter_recipients(sub_manager: SubscriptionManager, change_index: ChangeIndex, counts: dict):
+    """
+    Stream recipients with their subscription context: filtered subscribers
+    whose services, regions or IP ranges changed, then everyone subscribed to
+    all changes. An email in both comes first with its filtered context, which
+    is the one kept. counts ('all', 'filtered') is updated as they go.
+    """
+    filtered = sub_manager.iter_active_subscriptions({'subscriptionType': 'filtered'},
+                                                     projection=NOTIFICATION_PROJECTION)
+    for sub in filtered:
+        selected_services = sub.get('selectedServices', []) or []
+        selected_regions = sub.get('selectedRegions', []) or []
+        ip_queries = sub.get('ip_queries', []) or []
+        if change_index.matches(selected_services, selected_regions, ip_queries):
+            counts['filtered'] += 1
+            yield {
+                'email': sub['email'],
+                'subscriptionType': 'filtered',
+                'selectedServices': selected_services,
+                'selectedRegions': selected_regions,
+                'ip_queries': ip_queries,
+                'unsubscribe_token': sub.get('unsubscribe_token')
+            }
+
+    for sub in sub_manager.iter_active_subscriptions({'subscriptionType': 'all'}, projection=NOTIFICATION_PROJECTION):
+        counts['all'] += 1
+        yield {
+            'email': sub['email'],
+            'subscriptionType': 'all',
+            'selectedServices': [],
+            'unsubscribe_token': sub.get('unsubscribe_token')
+        }
+
+
+def change_set_id(changes: dict) -> str:
+    """
+    Key of a change set in the outbox: its date plus the publish's changeNumber,
+    so two publishes on the same day get separate jobs. Change files written
+    before the watcher recorded the changeNumber are keyed by date alone.
+    """
+    date = changes.get('date') or changes.get('generated_at')
+    change_number = (changes.get('metadata') or {}).get('change_number')
+    return date if change_number is None else f"{date}#{change_number}"
+
+
+def drain_outbox(outbox: NotificationOutbox, email_service: EmailService, changes: dict,
+                 change_index: ChangeIndex, worker_id: str, claim_size: int, batched: bool = True) -> bool:
+    """Claim and send outbox jobs of the change set until none are left"""
+    change_set = change_set_id(changes)
+    while True:
+        claim = outbox.claim(change_set, worker_id, claim_size)
+        if not claim['jobs']:
+            break
+        # Engine retries count against the jobs' outbox attempts
+        email_service.send_change_notification(claim['jobs'], changes, batched=batched, change_index=change_index,
+                                               max_retries=outbox.retries_left(claim))
+        if email_service.last_delivery is None:
+            # Nothing went out (e.g. SendGrid not configured): leave the jobs for a later run
+            outbox.release(claim)
+            return False
+        outbox.complete(claim, email_service.last_delivery['results'])
+
+    progress = outbox.progress(change_set)
+    print(f"\n📮 Outbox {change_set}: {progress['sent']} sent, {progress['failed']} failed, "
+          f"{progress['pending']} pending, {progress['sending']} in flight")
+    return progress['failed'] == 0 and progress['pending'] == 0
+
+
+def send_notifications(batched: bool = True, use_outbox: bool = True, drain_only: bool = False,
+                       worker_id: str = None, claim_size: int = MAX_PERSONALIZATIONS):
     """Send email notifications to all subscribers"""
     
     print("\n" + "="*60)
@@ -42,7 +121,7 @@ def send_notifications():
     print("="*60 + "\n")
     
     # Connect to database
-    if not db_config.connect():
+    if not db_config.connect(verify=True):
         print("❌ Failed to connect to database")
         return False
     
@@ -55,50 +134,50 @@ def send_notifications():
         
         print(f"📊 Found {len(changes['changes'])} service changes")
         
-        # Get subscription manager
-        sub_manager = SubscriptionManager()
         email_service = EmailService()
-        
-        # Get all active subscribers who want all changes
-        all_subscribers = sub_manager.get_active_subscriptions({'subscriptionType': 'all'})
-
-        # Get filtered subscribers (need to check if their services changed)
-        filtered_subscribers = sub_manager.get_active_subscriptions({'subscriptionType': 'filtered'})
+        # Change aggregates by service, region and prefix: matching costs a lookup per selected target
+        change_index = ChangeIndex(changes)
 
-        # Collect recipients with their subscription context
-        recipients = {}
-        changed_services = [change['service'] for change in changes['changes']]
+        outbox = None
+        if use_outbox:
+            outbox = NotificationOutbox()
+            worker_id = worker_id or default_worker_id()
+            if drain_only:
+                success = drain_outbox(outbox, email_service, changes, change_index, worker_id, claim_size, batched)
+                print("\n✅ Outbox drained" if success else "\n⚠️ Outbox drained with warnings")
+                return True
 
-        for sub in all_subscribers:
-            recipients[sub['email']] = {
-                'email': sub['email'],
-                'subscriptionType': 'all',
-                'selectedServices': []
-            }
+        # Get subscription manager
+        sub_manager = SubscriptionManager()
+        counts = {'all': 0, 'filtered': 0}
+        recipients = iter_recipients(sub_manager, change_index, counts)
 
-        for sub in filtered_subscribers:
-            selected_services = sub.get('selectedServices', [])
-            # Check if any of their selected services changed
-            if any(service in changed_services for service in selected_services):
-                # If the same email is in both lists, prefer the filtered context
-                recipients[sub['email']] = {
-                    'email': sub['email'],
-                    'subscriptionType': 'filtered',
-                    'selectedServices': selected_services
-                }
-
-        recipients_list = list(recipients.values())
-
-        if not recipients_list:
-            print("ℹ️ No active subscribers to notify")
-            return True
-        
-        print(f"\n📬 Sending notifications to {len(recipients_list)} subscribers:")
-        print(f"   - All changes: {len(all_subscribers)}")
-        print(f"   - Filtered matches: {len([r for r in recipients_list if r['subscriptionType']=='filtered'])}")
-        
         # Send notifications
-        success = email_service.send_change_notification(recipients_list, changes)
+        if outbox:
+            # Streamed straight into the outbox, which keeps the first job per email
+            queued = outbox.enqueue(change_set_id(changes), recipients)
+            if not counts['all'] and not counts['filtered']:
+                print("ℹ️ No active subscribers to notify")
+                return True
+            print(f"\n📬 Queued {queued} new notifications (already queued recipients are not sent twice):")
+            print(f"   - All changes: {counts['all']}")
+            print(f"   - Filtered matches: {counts['filtered']}")
+            success = drain_outbox(outbox, email_service, changes, change_index, worker_id, claim_size, batched)
+        else:
+            unique = {}
+            for recipient in recipients:
+                unique.setdefault(recipient['email'], recipient)
+            recipients_list = list(unique.values())
+
+            if not recipients_list:
+                print("ℹ️ No active subscribers to notify")
+                return True
+
+            print(f"\n📬 Sending notifications to {len(recipients_list)} subscribers:")
+            print(f"   - All changes: {counts['all']}")
+            print(f"   - Filtered matches: {counts['filtered']}")
+            success = email_service.send_change_notification(recipients_list, changes, batched=batched,
+                                                             change_index=change_index)
         
         if success:
             print("\n✅ Notifications sent successfully!")
@@ -118,5 +197,17 @@ def send_notifications():
 
 
 if __name__ == '__main__':
-    success = send_notifications()
+    parser = argparse.ArgumentParser(description='Send change notification emails to subscribers')
+    parser.add_argument('--no-batch', action='store_true',
+                        help='Send one SendGrid request per recipient instead of batching identical emails')
+    parser.add_argument('--no-outbox', action='store_true',
+                        help='Send directly instead of through the resumable outbox')
+    parser.add_argument('--drain-only', action='store_true',
+                        help="Only send jobs already queued for the latest change set (extra workers)")
+    parser.add_argument('--worker-id', help='Name of this worker in outbox leases (default: host-pid)')
+    parser.add_argument('--claim-size', type=int, default=MAX_PERSONALIZATIONS,
+                        help=f'Outbox jobs claimed per batch (default: {MAX_PERSONALIZATIONS})')
+    args = parser.parse_args()
+    success = send_notifications(batched=not args.no_batch, use_outbox=not args.no_outbox,
+                                 drain_only=args.drain_only, worker_id=args.worker_id, claim_size=args.claim_size)
     sys.exit(0 if success else 1)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Serve every API function routed in vercel.json from one long-lived process.
+
+For self-hosting and local load tests. The endpoint handlers are the ones
+Vercel runs; this server only replaces Vercel's per-file router:
+
+    routing      each vercel.json route maps to the handler class of its api/*.py file
+    keep-alive   HTTP/1.1 persistent connections, closed after --keep-alive idle seconds
+    workers      connections are served by a bounded thread pool (--workers); at most
+                 --max-pending more wait for a worker, beyond that clients get a 503
+    singletons   the pooled MongoDB client (db_config), plan cache, email service and
+                 memory-mapped IP range index are shared by all workers
+    shutdown     SIGINT/SIGTERM stop accepting and let in-flight requests finish: busy
+                 connections close after their current request, idle ones within
+                 --keep-alive seconds. Then the MongoDB pool and plan cache
+                 counters are printed and the MongoDB client is closed.
+
+    python scripts/serve_api.py --port 3000 --workers 16
+    MONGODB_URI=mongodb://localhost:27017 MONGODB_TLS=false EMAIL_TRANSPORT=stub python scripts/serve_api.py
+"""
+
+import argparse
+import importlib
+import json
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Dict, Type
+from urllib.parse import urlsplit
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+from api import db_config
+from api.plan_resolver import plan_resolver
+
+VERCEL_CONFIG = ROOT / 'vercel.json'
+
+DEFAULT_WORKERS = 16
+DEFAULT_KEEP_ALIVE_SECONDS = 5.0
+
+BUSY_BODY = json.dumps({'success': False, 'error': 'Server is busy'}).encode('utf-8')
+BUSY_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                 b'Content-Type: application/json\r\n'
+                 b'Retry-After: 1\r\n'
+                 b'Connection: close\r\n'
+                 b'Content-Length: ' + str(len(BUSY_BODY)).encode('ascii') + b'\r\n\r\n' + BUSY_BODY)
+
+
+def load_routes(config_path: Path = VERCEL_CONFIG) -> Dict[str, Type[BaseHTTPRequestHandler]]:
+    """Route path -> handler class for every Python function in vercel.json"""
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+    routes = {}
+    for route in config.get('routes', []):
+        dest = route['dest'].lstrip('/')
+        if dest.endswith('.py'):
+            module = importlib.import_module(dest[:-3].replace('/', '.'))
+            routes[route['src']] = module.handler
+    return routes
+
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+    """Reads requests off one connection and hands each to its endpoint's handler"""
+
+    protocol_version = 'HTTP/1.1'
+    timeout = DEFAULT_KEEP_ALIVE_SECONDS
+
+    def _dispatch(self):
+        endpoint_class = self.server.routes.get(urlsplit(self.path).path)
+        method = getattr(endpoint_class, 'do_' + self.command, None)
+        if method is None:
+            # The request body (if any) is left unread, so the connection cannot be reused
+            self.close_connection = True
+            status = 404 if endpoint_class is None else 405
+            self.send_error(status)
+            return
+
+        # An endpoint handler for this one request, on the already parsed connection state
+        endpoint = endpoint_class.__new__(endpoint_class)
+        endpoint.__dict__.update(self.__dict__)
+        endpoint.protocol_version = self.protocol_version
+        endpoint.log_message = self.log_message
+        try:
+            method(endpoint)
+        finally:
+            self.close_connection = endpoint.close_connection or self.server.draining.is_set()
+            self.server.count_request()
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = do_OPTIONS = _dispatch
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer whose connections are served by a bounded worker pool"""
+
+    def __init__(self, address, routes: Dict[str, Type[BaseHTTPRequestHandler]], workers: int = DEFAULT_WORKERS,
+                 max_pending: int = None, quiet: bool = False):
+        super().__init__(address, APIRequestHandler)
+        self.routes = routes
+        self.quiet = quiet
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api-worker')
+        self.slots = threading.BoundedSemaphore(workers + (workers * 4 if max_pending is None else max_pending))
+        self.draining = threading.Event()
+        self.stats_lock = threading.Lock()
+        self.requests_served = 0
+        self.connections_rejected = 0
+
+    def count_request(self):
+        with self.stats_lock:
+            self.requests_served += 1
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            # Only the accepting thread touches this counter
+            self.connections_rejected += 1
+            try:
+                request.sendall(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.executor.submit(self._serve_connection, request, client_address)
+
+    def _serve_connection(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def drain(self):
+        """Stop accepting and wait for in-flight connections to finish"""
+        self.draining.set()
+        self.shutdown()
+        self.executor.shutdown(wait=True)
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve all API endpoints from vercel.json in one process')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=3000, help='Port to listen on (default: 3000)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Worker threads, i.e. connections served at once (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--max-pending', type=int,
+                        help='Accepted connections waiting for a worker before new ones get a 503 (default: 4x workers)')
+    parser.add_argument('--keep-alive', type=float, default=DEFAULT_KEEP_ALIVE_SECONDS,
+                        help=f'Seconds an idle connection is kept open (default: {DEFAULT_KEEP_ALIVE_SECONDS:g})')
+    parser.add_argument('--quiet', action='store_true', help='Do not log each request')
+    args = parser.parse_args()
+
+    APIRequestHandler.timeout = args.keep_alive
+    routes = load_routes()
+    server = PooledHTTPServer((args.host, args.port), routes, workers=args.workers,
+                              max_pending=args.max_pending, quiet=args.quiet)
+
+    # shutdown() waits for serve_forever(), which runs in this (main) thread, so drain from another
+    drainer = threading.Thread(target=server.drain, name='api-drain')
+
+    def stop(signum, frame):
+        if not drainer.is_alive() and not server.draining.is_set():
+            drainer.start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"🚀 Serving {len(routes)} routes on http://{args.host}:{server.server_port} "
+          f"({args.workers} workers, {args.keep_alive:g}s keep-alive)")
+    for path, handler_class in routes.items():
+        print(f"   {path:<26} {handler_class.__module__}")
+
+    server.serve_forever()
+    drainer.join()
+
+    print(f"\n🛑 Stopped after {server.requests_served} requests "
+          f"({server.connections_rejected} connections turned away while busy)")
+    if db_config.client is not None:
+        print(f"📊 MongoDB pool: {db_config.pool_stats()}")
+    if plan_resolver.hits or plan_resolver.misses:
+        print(f"📊 Plan cache: {plan_resolver.stats()}")
+    db_config.close()
+
+
+if __name__ == '__main__':
+    main()
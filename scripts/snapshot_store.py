@@ -0,0 +1,122 @@
+"""
+Content-addressed snapshot store for Azure Service Tags history.
+
+Instead of a full ~4 MB copy of Microsoft's JSON per run, every service tag
+body is stored once under the SHA256 of its content, and each snapshot is a
+small manifest of tag name -> hash. Tags that did not change between runs
+share the same object, so storage grows with the amount of change rather
+than with the number of runs.
+
+Layout (under docs/data/store/, served by GitHub Pages like the rest of /data):
+    objects/<hash[:2]>/<hash>.json   one service tag, exactly as Microsoft published it
+    snapshots/YYYY-MM-DD.json        {"changeNumber", "cloud", "tags": [[name, hash], ...]}
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DEFAULT_STORE_DIR = Path('docs/data/store')
+
+
+def calculate_tag_hash(service: Dict) -> str:
+    """Calculate SHA256 hash of a single service tag (name, id and all properties)."""
+    json_str = json.dumps(service, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(json_str.encode('utf-8')).hexdigest()
+
+
+class SnapshotStore:
+    """Read and write Service Tags snapshots as manifests over shared tag objects"""
+
+    def __init__(self, root: Path = DEFAULT_STORE_DIR):
+        self.root = Path(root)
+        self.objects_dir = self.root / 'objects'
+        self.snapshots_dir = self.root / 'snapshots'
+
+    def _object_path(self, tag_hash: str) -> Path:
+        return self.objects_dir / tag_hash[:2] / f'{tag_hash}.json'
+
+    def _manifest_path(self, name: str) -> Path:
+        return self.snapshots_dir / f'{name}.json'
+
+    def has_object(self, tag_hash: str) -> bool:
+        return self._object_path(tag_hash).exists()
+
+    def _write_object(self, tag_hash: str, service: Dict):
+        path = self._object_path(tag_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so an interrupted run never leaves a truncated object
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(service, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def put_object(self, service: Dict, tag_hash: Optional[str] = None) -> bool:
+        """Store a service tag if it is not stored yet. Returns True when it was written."""
+        tag_hash = tag_hash or calculate_tag_hash(service)
+        if self.has_object(tag_hash):
+            return False
+        self._write_object(tag_hash, service)
+        return True
+
+    def get_object(self, tag_hash: str) -> Dict:
+        """Load a single service tag by hash."""
+        with open(self._object_path(tag_hash), 'r') as f:
+            return json.load(f)
+
+    def write_snapshot(self, name: str, data: Dict) -> Dict:
+        """Store a full Service Tags document as a manifest plus any new tag objects.
+
+        Returns the manifest, with 'new_objects' counting tag bodies written this time.
+        """
+        tags = []
+        new_objects = 0
+        for service in data.get('values', []):
+            tag_hash = calculate_tag_hash(service)
+            new_objects += self.put_object(service, tag_hash)
+            tags.append([service['name'], tag_hash])
+
+        header = {key: value for key, value in data.items() if key != 'values'}
+        manifest = self.write_manifest(name, header, tags)
+        logging.info(f"Saved snapshot manifest {name} ({len(tags)} tags, {new_objects} new objects)")
+        return {**manifest, 'new_objects': new_objects}
+
+    def write_manifest(self, name: str, header: Dict, tags: List[List[str]]) -> Dict:
+        """Write a manifest for tags whose objects were already stored with put_object."""
+        manifest = dict(header)
+        manifest['tags'] = tags
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        with open(self._manifest_path(name), 'w') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        return manifest
+
+    def read_manifest(self, name: str) -> Optional[Dict]:
+        """Load a snapshot manifest without materializing any tag bodies."""
+        path = self._manifest_path(name)
+        if not path.exists():
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def read_snapshot(self, name: str) -> Optional[Dict]:
+        """Reconstruct the full Service Tags document for a snapshot."""
+        manifest = self.read_manifest(name)
+        if manifest is None:
+            return None
+        data = {key: value for key, value in manifest.items() if key != 'tags'}
+        data['values'] = [self.get_object(tag_hash) for _, tag_hash in manifest['tags']]
+        return data
+
+    def list_snapshots(self) -> List[str]:
+        """Return the names (dates) of all stored snapshots, oldest first."""
+        if not self.snapshots_dir.exists():
+            return []
+        return sorted(path.stem for path in self.snapshots_dir.glob('*.json'))
+
+    def latest_snapshot(self) -> Optional[str]:
+        """Return the name of the most recent snapshot, if any."""
+        snapshots = self.list_snapshots()
+        return snapshots[-1] if snapshots else None
@@ -0,0 +1,182 @@
+"""
+Deterministic synthetic Service Tags documents for benchmarking.
+
+Documents look like Microsoft's: regional variants of a few dozen services,
+a heavy-tailed number of prefixes per tag (a handful of AzureCloud-style tags
+hold thousands), the real mix of IPv4/IPv6 prefix lengths, and per-tag
+changeNumbers. The defaults match today's Public cloud file.
+
+Every tag is generated from its own seeded RNG, so a document never has to be
+held in memory: write_synthetic_document streams tags straight to disk, and
+week N of the same seed can be regenerated independently of week N-1.
+A week applies churn to the base document: a fraction of tags gain and lose
+prefixes (bumping their changeNumber), and a few tags are removed or added.
+
+    python scripts/synthetic_service_tags.py out.json --scale 10 --week 1
+"""
+
+import argparse
+import math
+import random
+import socket
+import struct
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from tag_stream import ServiceTagsWriter
+
+# Shape of the Public cloud file (changeNumber 376)
+DEFAULT_TAGS = 3041
+DEFAULT_PREFIXES = 95823
+DEFAULT_IPV6_RATIO = 0.255
+DEFAULT_CHURN = 0.04
+
+SERVICES = [
+    'ActionGroup', 'ApiManagement', 'AppConfiguration', 'AppService', 'AppServiceManagement',
+    'AzureActiveDirectory', 'AzureBackup', 'AzureBotService', 'AzureCloud', 'AzureConnectors',
+    'AzureContainerRegistry', 'AzureCosmosDB', 'AzureDataLake', 'AzureDevOps', 'AzureEventGrid',
+    'AzureFrontDoor.Backend', 'AzureIoTHub', 'AzureKeyVault', 'AzureMachineLearning', 'AzureMonitor',
+    'AzureResourceManager', 'AzureSignalR', 'AzureSiteRecovery', 'AzureTrafficManager', 'BatchNodeManagement',
+    'CognitiveServicesManagement', 'DataFactory', 'EventHub', 'GuestAndHybridManagement', 'HDInsight',
+    'LogicApps', 'MicrosoftContainerRegistry', 'PowerBI', 'ServiceBus', 'ServiceFabric', 'Sql',
+    'SqlManagement', 'Storage', 'StorageSyncService', 'WindowsVirtualDesktop'
+]
+REGIONS = [
+    'australiacentral', 'australiaeast', 'australiasoutheast', 'brazilsouth', 'canadacentral',
+    'canadaeast', 'centralindia', 'centralus', 'eastasia', 'eastus', 'eastus2', 'francecentral',
+    'germanywestcentral', 'japaneast', 'japanwest', 'koreacentral', 'northcentralus', 'northeurope',
+    'norwayeast', 'southafricanorth', 'southcentralus', 'southeastasia', 'swedencentral',
+    'switzerlandnorth', 'uaenorth', 'uksouth', 'ukwest', 'westcentralus', 'westeurope', 'westus',
+    'westus2', 'westus3'
+]
+NETWORK_FEATURES = ['API', 'NSG', 'UDR', 'FW']
+
+# Prefix length mix of the Public cloud file
+_IPV4_LENGTHS = [32, 28, 24, 27, 29, 26, 30, 31, 25, 23, 22, 21, 20, 19, 18, 17, 16]
+_IPV4_WEIGHTS = [18, 8, 8, 8, 8, 6, 4, 3.5, 3, 2, 2, 1.5, 1, 0.5, 0.5, 0.3, 0.3]
+_IPV6_LENGTHS = [123, 121, 122, 125, 64, 124, 48, 128, 126, 120, 56, 44]
+_IPV6_WEIGHTS = [17, 13, 12, 11, 9, 8, 6, 4, 4, 3, 2, 1]
+
+
+def _prefix_counts(tags: int, prefixes: int, seed: int) -> List[int]:
+    """Heavy-tailed prefixes-per-tag counts (median ~6, p99 in the hundreds) summing to ~prefixes."""
+    rng = random.Random(f'{seed}:counts')
+    raw = [rng.lognormvariate(math.log(6), 1.6) for _ in range(tags)]
+    scale = prefixes / sum(raw)
+    return [max(1, round(value * scale)) for value in raw]
+
+
+def _format_prefix(rng: random.Random, ipv6_ratio: float) -> str:
+    if rng.random() < ipv6_ratio:
+        length = rng.choices(_IPV6_LENGTHS, _IPV6_WEIGHTS)[0]
+        network = (0x2603 << 112 | rng.getrandbits(112)) >> (128 - length) << (128 - length)
+        return f"{socket.inet_ntop(socket.AF_INET6, network.to_bytes(16, 'big'))}/{length}"
+    length = rng.choices(_IPV4_LENGTHS, _IPV4_WEIGHTS)[0]
+    network = rng.getrandbits(32) >> (32 - length) << (32 - length)
+    return f"{socket.inet_ntoa(struct.pack('!I', network))}/{length}"
+
+
+def _base_tag(index: int, count: int, ipv6_ratio: float, seed: int) -> Dict:
+    rng = random.Random(f'{seed}:tag:{index}')
+    service = SERVICES[index % len(SERVICES)]
+    # The first tag of each service is global (no region), like "AzureCloud" or "Storage"
+    slot = index // len(SERVICES)
+    region = REGIONS[(slot - 1) % len(REGIONS)] if slot else ''
+    name = f'{service}.{region.capitalize()}' if region else service
+    cycle = (slot - 1) // len(REGIONS) if slot else 0
+    if cycle:
+        name = f'{name}.{cycle}'  # keep names unique beyond one tag per service and region
+    prefixes = set()
+    while len(prefixes) < count:
+        prefixes.add(_format_prefix(rng, ipv6_ratio))
+    return {
+        'name': name,
+        'id': name,
+        'properties': {
+            'changeNumber': rng.randint(1, 40),
+            'region': region,
+            'regionId': REGIONS.index(region) + 1 if region else 0,
+            'platform': 'Azure',
+            'systemService': '' if service == 'AzureCloud' else service,
+            'addressPrefixes': sorted(prefixes),
+            'networkFeatures': NETWORK_FEATURES if rng.random() < 0.8 else None
+        }
+    }
+
+
+def _mutate(tag: Dict, rng: random.Random, ipv6_ratio: float):
+    """Replace 1-10% of a tag's prefixes (some removed, some added) and bump its changeNumber."""
+    prefixes = tag['properties']['addressPrefixes']
+    changes = max(1, int(len(prefixes) * rng.uniform(0.01, 0.1)))
+    removed = rng.randint(0, min(changes, len(prefixes) - 1))
+    kept = set(prefixes).difference(rng.sample(prefixes, removed))
+    target = len(kept) + changes - removed
+    while len(kept) < target:
+        kept.add(_format_prefix(rng, ipv6_ratio))
+    tag['properties']['addressPrefixes'] = sorted(kept)
+    tag['properties']['changeNumber'] += 1
+
+
+def synthetic_tags(tags: int = DEFAULT_TAGS, prefixes: int = DEFAULT_PREFIXES,
+                   ipv6_ratio: float = DEFAULT_IPV6_RATIO, churn: float = DEFAULT_CHURN,
+                   week: int = 0, seed: int = 1) -> Iterator[Dict]:
+    """Yield the tags of a synthetic document; week 0 is the base, week N applies N weeks of churn."""
+    counts = _prefix_counts(tags, prefixes, seed)
+    # Tag additions and removals are rarer than prefix changes
+    lifecycle_rate = churn / 20
+    for index, count in enumerate(counts):
+        tag = _base_tag(index, count, ipv6_ratio, seed)
+        for current_week in range(1, week + 1):
+            rng = random.Random(f'{seed}:week:{current_week}:{index}')
+            if rng.random() < lifecycle_rate:
+                tag = None
+                break
+            if rng.random() < churn:
+                _mutate(tag, rng, ipv6_ratio)
+        if tag is not None:
+            yield tag
+    for current_week in range(1, week + 1):
+        for extra in range(int(tags * lifecycle_rate)):
+            index = tags + current_week * tags + extra
+            yield _base_tag(index, counts[extra % tags], ipv6_ratio, seed)
+
+
+def write_synthetic_document(path: Path, scale: float = 1.0, week: int = 0, churn: float = DEFAULT_CHURN,
+                             ipv6_ratio: float = DEFAULT_IPV6_RATIO, seed: int = 1,
+                             tags: Optional[int] = None, prefixes: Optional[int] = None) -> Dict:
+    """Stream a synthetic document to path; scale multiplies today's tag and prefix counts.
+    Returns {'tags', 'prefixes', 'bytes'} for the written document."""
+    tags = tags or max(1, round(DEFAULT_TAGS * scale))
+    prefixes = prefixes or max(tags, round(DEFAULT_PREFIXES * scale))
+    written = {'tags': 0, 'prefixes': 0}
+    with open(path, 'w') as f:
+        writer = ServiceTagsWriter(f)
+        writer.begin({'changeNumber': 376 + week, 'cloud': 'Public'})
+        for tag in synthetic_tags(tags, prefixes, ipv6_ratio, churn, week, seed):
+            writer.write(tag)
+            written['tags'] += 1
+            written['prefixes'] += len(tag['properties']['addressPrefixes'])
+        writer.end()
+    written['bytes'] = Path(path).stat().st_size
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Azure Service Tags document')
+    parser.add_argument('output', help='File to write')
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiple of today's file size")
+    parser.add_argument('--tags', type=int, help='Number of tags (overrides --scale)')
+    parser.add_argument('--prefixes', type=int, help='Total number of prefixes (overrides --scale)')
+    parser.add_argument('--ipv6-ratio', type=float, default=DEFAULT_IPV6_RATIO, help='Fraction of IPv6 prefixes')
+    parser.add_argument('--churn', type=float, default=DEFAULT_CHURN, help='Fraction of tags changed per week')
+    parser.add_argument('--week', type=int, default=0, help='Weeks of churn applied to the base document')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    stats = write_synthetic_document(args.output, args.scale, args.week, args.churn, args.ipv6_ratio,
+                                     args.seed, args.tags, args.prefixes)
+    print(f"📝 Wrote {args.output}: {stats['tags']} tags, {stats['prefixes']} prefixes, {stats['bytes']} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Streaming reader and writer for Service Tags JSON documents.
+
+Microsoft's file is one object whose "values" array holds every service tag.
+ServiceTagsReader walks that object incrementally and yields one tag at a
+time, so memory stays at roughly one tag plus one read buffer no matter how
+large the file grows. The other top-level fields (changeNumber, cloud) are
+collected into reader.header as they are encountered.
+
+ServiceTagsWriter is the inverse: it writes tags one at a time and produces
+exactly the bytes json.dump(data, f, indent=2) would.
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r'\s*')
+
+
+class ServiceTagsReader:
+    """Iterate the service tags of a JSON document read from a text stream"""
+
+    def __init__(self, fp: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.header: Dict = {}
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+        self._state = 'start'  # start -> values -> done
+
+    def _fill(self) -> bool:
+        """Read more input, dropping what was consumed. Returns False at end of input."""
+        if self._eof:
+            return False
+        # Grow reads with the pending value so a large tag is not re-parsed many times
+        chunk = self.fp.read(max(self.chunk_size, len(self._buffer) - self._pos))
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        if not chunk:
+            self._eof = True
+        return bool(chunk)
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character ('' at end of input)."""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char: str):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Invalid Service Tags JSON: expected {char!r}, found {found or 'end of input'!r}")
+        self._pos += 1
+
+    def _decode(self):
+        """Decode the next complete JSON value."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number at the very end of the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self._eof:
+                    raise ValueError(f"Invalid Service Tags JSON: {e}")
+            self._fill()
+
+    def _read_members(self):
+        """Read top-level members into header until "values" starts or the object ends."""
+        while True:
+            char = self._peek()
+            if char == '}':
+                self._pos += 1
+                self._state = 'done'
+                return
+            if char == ',':
+                self._pos += 1
+                continue
+            key = self._decode()
+            if not isinstance(key, str):
+                raise ValueError("Invalid Service Tags JSON: expected an object key")
+            self._expect(':')
+            if key == 'values':
+                self._expect('[')
+                self._state = 'values'
+                return
+            self.header[key] = self._decode()
+
+    def read_header(self) -> Dict:
+        """Read the fields before "values" without touching any tag.
+
+        Raises ValueError if the document has no "values" array.
+        """
+        if self._state == 'start':
+            self._expect('{')
+            self._read_members()
+            if self._state != 'values':
+                raise ValueError("JSON missing 'values' key.")
+        return self.header
+
+    def __iter__(self) -> Iterator[Dict]:
+        self.read_header()
+        while self._state == 'values':
+            char = self._peek()
+            if char == ']':
+                self._pos += 1
+                self._read_members()
+                break
+            if char == ',':
+                self._pos += 1
+                continue
+            yield self._decode()
+
+
+def read_header(path: Path) -> Dict:
+    """Return the top-level fields (changeNumber, cloud, ...) of a Service Tags file."""
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        return ServiceTagsReader(f).read_header()
+
+
+def iter_service_tags(path: Path) -> Iterator[Dict]:
+    """Yield the tags of a Service Tags file one at a time."""
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        yield from ServiceTagsReader(f)
+
+
+def index_service_tags(path: Path) -> Tuple[Dict, Dict[str, Tuple[Optional[int], Optional[str], Optional[str]]]]:
+    """Return (header, {name: (changeNumber, region, systemService)}) for a file, in publish order.
+
+    This is all the watcher needs from the previous snapshot to skip unchanged
+    tags and report removed ones; tag bodies are discarded as they are read.
+    """
+    index = {}
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        reader = ServiceTagsReader(f)
+        for service in reader:
+            properties = service.get('properties', {})
+            index[service['name']] = (properties.get('changeNumber'),
+                                      properties.get('region'), properties.get('systemService'))
+        return reader.header, index
+
+
+def load_service_tags(path: Path, names: Iterable[str]) -> Dict[str, Dict]:
+    """Load only the named tags from a file."""
+    wanted = set(names)
+    if not wanted:
+        return {}
+    return {service['name']: service for service in iter_service_tags(path) if service['name'] in wanted}
+
+
+class ServiceTagsWriter:
+    """Write a Service Tags document tag by tag, formatted like json.dump(indent=2)"""
+
+    def __init__(self, fp: TextIO):
+        self.fp = fp
+        self._count = 0
+
+    def begin(self, header: Dict):
+        self.fp.write('{')
+        for key, value in header.items():
+            self.fp.write(f'\n  {json.dumps(key)}: {_indent(json.dumps(value, indent=2), 2)},')
+        self.fp.write('\n  "values": [')
+
+    def write(self, service: Dict):
+        if self._count:
+            self.fp.write(',')
+        self.fp.write('\n    ' + _indent(json.dumps(service, indent=2), 4))
+        self._count += 1
+
+    def end(self, trailer: Optional[Dict] = None):
+        self.fp.write('\n  ]' if self._count else ']')
+        for key, value in (trailer or {}).items():
+            self.fp.write(f',\n  {json.dumps(key)}: {_indent(json.dumps(value, indent=2), 2)}')
+        self.fp.write('\n}')
+
+
+def _indent(text: str, spaces: int) -> str:
+    return text.replace('\n', '\n' + ' ' * spaces)
+
+
+def write_service_tags(path: Path, header: Dict, services: Iterable[Dict]) -> List[str]:
+    """Stream tags into a file and return their names in order."""
+    names = []
+    with open(path, 'w') as f:
+        writer = ServiceTagsWriter(f)
+        writer.begin(header)
+        for service in services:
+            writer.write(service)
+            names.append(service['name'])
+        writer.end()
+    return names
@@ -10,6 +10,7 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from api import db_config, SubscriptionManager, EmailService
+from api.schema import schema_status
 
 
 def test_connection():
@@ -20,20 +21,26 @@ def test_connection():
     
     # Test connection
     print("1️⃣ Testing database connection...")
-    if db_config.connect():
+    if db_config.connect(verify=True):
         print("   ✅ Successfully connected to MongoDB Atlas\n")
     else:
         print("   ❌ Failed to connect to MongoDB Atlas")
         print("   Check your .env file and MONGODB_URI\n")
         return False
     
-    # Create indexes
-    print("2️⃣ Creating database indexes...")
+    # Check indexes (read-only; scripts/migrate_db.py applies the schema)
+    print("2️⃣ Checking database indexes...")
     try:
-        db_config.create_indexes()
-        print("   ✅ Indexes created\n")
+        status = schema_status()
+        if status['up_to_date']:
+            print(f"   ✅ Indexes at schema version {status['version']}\n")
+        else:
+            print(f"   ⚠️ Schema out of date: version {status['version']} (expected {status['expected_version']})")
+            for collection, names in status['missing'].items():
+                print(f"      - {collection}: missing {', '.join(names)}")
+            print("   Run scripts/migrate_db.py to apply it\n")
     except Exception as e:
-        print(f"   ⚠️ Error creating indexes: {e}\n")
+        print(f"   ⚠️ Error checking indexes: {e}\n")
     
     # Test subscription manager
     print("3️⃣ Testing subscription manager...")
@@ -77,7 +84,7 @@ def create_test_subscription():
     print("🧪 Creating Test Subscription")
     print("="*60 + "\n")
     
-    if not db_config.connect():
+    if not db_config.connect(verify=True):
         print("❌ Failed to connect to database")
         return False
     
@@ -13,29 +13,35 @@ if __name__ == '__main__':
     print("📊 Current Subscriptions in MongoDB")
     print("="*60 + "\n")
     
-    if not db_config.connect():
+    if not db_config.connect(verify=True):
         print("❌ Failed to connect to database")
         sys.exit(1)
     
     try:
         sm = SubscriptionManager()
-        subs = sm.get_active_subscriptions()
+        # Streamed so the listing runs in flat memory however many subscriptions there are
+        subs = sm.iter_active_subscriptions(projection={
+            '_id': 0, 'email': 1, 'subscriptionType': 1, 'status': 1, 'timestamp': 1,
+            'selectedServices': 1, 'selectedRegions': 1
+        })
         
-        if not subs:
+        count = 0
+        for i, sub in enumerate(subs, 1):
+            count = i
+            print(f"{i}. Email: {sub['email']}")
+            print(f"   Type: {sub['subscriptionType']}")
+            print(f"   Status: {sub['status']}")
+            print(f"   Created: {sub['timestamp']}")
+            if sub.get('selectedServices'):
+                print(f"   Services: {len(sub['selectedServices'])} selected")
+            if sub.get('selectedRegions'):
+                print(f"   Regions: {', '.join(sub['selectedRegions'][:3])}{'...' if len(sub['selectedRegions']) > 3 else ''}")
+            print()
+        
+        if not count:
             print("No subscriptions found.\n")
         else:
-            print(f"Found {len(subs)} subscription(s):\n")
-            
-            for i, sub in enumerate(subs, 1):
-                print(f"{i}. Email: {sub['email']}")
-                print(f"   Type: {sub['subscriptionType']}")
-                print(f"   Status: {sub['status']}")
-                print(f"   Created: {sub['timestamp']}")
-                if sub.get('selectedServices'):
-                    print(f"   Services: {len(sub['selectedServices'])} selected")
-                if sub.get('selectedRegions'):
-                    print(f"   Regions: {', '.join(sub['selectedRegions'][:3])}{'...' if len(sub['selectedRegions']) > 3 else ''}")
-                print()
+            print(f"Found {count} subscription(s)\n")
         
         # Show statistics
         stats = sm.get_statistics()